@@ -0,0 +1,175 @@
+"""FAISS index factory for exact and approximate nearest neighbour search.
+
+Supported index types:
+
+* ``flat``     exact brute-force L2 search (``IndexFlatL2``), no training
+* ``ivf_flat`` inverted lists over full vectors (``IndexIVFFlat``)
+* ``ivf_pq``   inverted lists over product-quantized vectors (``IndexIVFPQ``)
+* ``hnsw``     graph-based search (``IndexHNSWFlat``), no training
+* ``auto``     ``flat`` for small corpora, ``ivf_flat`` once the corpus has
+  ``ann_threshold`` vectors and ``ivf_pq`` from ``pq_threshold`` vectors
+
+IVF indexes need training data, so they are only used once the corpus holds
+``MIN_TRAINING_VECTORS`` vectors; below that a flat index is used instead.
+
+Vectors are added with their chunk ids from the vector store, so the ids
+returned by ``search`` are chunk ids whatever the index type. IVF indexes
+store ids natively; flat and HNSW indexes are wrapped in ``IndexIDMap2``.
+Chunks can be removed with ``remove_ids`` except from HNSW graphs, which
+have to be rebuilt instead (see ``supports_removal``). Searches can be
+restricted to a subset of chunk ids with ``filtered_search_params``.
+"""
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ['flat', 'ivf_flat', 'ivf_pq', 'hnsw']
+
+# Largest efSearch used for filtered HNSW searches
+MAX_FILTERED_EF_SEARCH = 4096
+
+# Trained indexes fall back to flat until there is enough data to train them
+MIN_TRAINING_VECTORS = {'ivf_flat': 1_000, 'ivf_pq': 10_000}
+
+DEFAULT_PARAMS = {
+    'nlist': None,           # IVF lists, defaults to ~4 * sqrt(n)
+    'nprobe': 16,            # IVF lists visited per query
+    'pq_m': 48,              # PQ sub-quantizers, must divide the dimension
+    'pq_nbits': 8,
+    'hnsw_m': 32,
+    'ef_construction': 80,
+    'ef_search': 64,
+    'train_size': 100_000,   # maximum number of vectors used for training
+}
+
+
+def resolve_index_type(index_type, count, ann_threshold, pq_threshold):
+    """Map the configured index type to a concrete one for a corpus of ``count`` vectors."""
+    if index_type != 'auto':
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'. Allowed types: auto, {', '.join(INDEX_TYPES)}")
+    elif count >= pq_threshold:
+        index_type = 'ivf_pq'
+    elif count >= ann_threshold:
+        index_type = 'ivf_flat'
+    else:
+        index_type = 'flat'
+
+    if count < MIN_TRAINING_VECTORS.get(index_type, 0):
+        return 'flat'
+    return index_type
+
+
+def base_index(index):
+    """The index doing the search, without its id mapping wrapper."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def index_type_of(index):
+    """Return the factory name of an existing FAISS index."""
+    index = base_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVFFlat):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return 'hnsw'
+    return 'flat'
+
+
+def supports_removal(index):
+    """Whether chunks can be removed from the index in place."""
+    return index_type_of(index) != 'hnsw'
+
+
+def default_nlist(count):
+    """Number of IVF lists for a corpus size, keeping ~39 training points per list."""
+    nlist = int(4 * math.sqrt(max(count, 1)))
+    return max(1, min(nlist, count // 39 if count >= 39 else 1))
+
+
+def create_index(index_type, dimension, count, params=None):
+    """Create an empty (untrained) index of the given type, filled with ``add_with_ids``."""
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    if index_type == 'flat':
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params['hnsw_m'])
+        index.hnsw.efConstruction = params['ef_construction']
+        return faiss.IndexIDMap2(index)
+
+    nlist = params['nlist'] or default_nlist(count)
+    quantizer = faiss.IndexFlatL2(dimension)
+    if index_type == 'ivf_flat':
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    elif index_type == 'ivf_pq':
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, params['pq_m'], params['pq_nbits'])
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'")
+    return index
+
+
+def apply_search_params(index, params=None):
+    """Set query-time parameters (nprobe, efSearch) on an index."""
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    index_type = index_type_of(index)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        faiss.extract_index_ivf(index).nprobe = params['nprobe']
+    elif index_type == 'hnsw':
+        base_index(index).hnsw.efSearch = params['ef_search']
+    return index
+
+
+def filtered_search_params(index, selector, fraction):
+    """Search parameters restricting a search to the ids accepted by ``selector``.
+
+    ``fraction`` is the share of the indexed vectors the selector accepts.
+    IVF and HNSW searches only see the selected vectors among those they
+    visit, so they visit proportionally more lists or graph nodes.
+    """
+    index_type = index_type_of(index)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        ivf = faiss.extract_index_ivf(index)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(ivf.nlist, math.ceil(ivf.nprobe / fraction)))
+    if index_type == 'hnsw':
+        ef_search = base_index(index).hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=min(MAX_FILTERED_EF_SEARCH, math.ceil(ef_search / fraction)))
+    return faiss.SearchParameters(sel=selector)
+
+
+def sample_vectors(vector_batches, count, sample_size, seed=0):
+    """Uniformly sample rows from an iterable of vector arrays without concatenating them."""
+    if count <= sample_size:
+        return np.vstack([np.asarray(batch) for batch in vector_batches])
+    rng = np.random.default_rng(seed)
+    wanted = np.sort(rng.choice(count, size=sample_size, replace=False))
+    samples = []
+    start = 0
+    for batch in vector_batches:
+        lo, hi = np.searchsorted(wanted, [start, start + len(batch)])
+        if hi > lo:
+            samples.append(np.asarray(batch[wanted[lo:hi] - start]))
+        start += len(batch)
+    return np.vstack(samples)
+
+
+def build_index(index_type, dimension, load_vector_batches, count, params=None):
+    """Create, train and fill an index.
+
+    ``load_vector_batches`` is a callable returning an iterable of (ids,
+    float32 vectors) pairs (e.g. the memory-mapped segments of the vector
+    store); it is called once for training and once for adding.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    index = create_index(index_type, dimension, count, params)
+    if not index.is_trained:
+        batches = (vectors for _, vectors in load_vector_batches())
+        training_vectors = sample_vectors(batches, count, params['train_size'])
+        index.train(np.ascontiguousarray(training_vectors, dtype='float32'))
+    for ids, vectors in load_vector_batches():
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), np.asarray(ids, dtype='int64'))
+    return apply_search_params(index, params)
@@ -1,23 +1,43 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import os
-import fitz
 import re
 import time
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import json
 import requests
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 import pickle
-import docx
-from pptx import Presentation
 import hashlib
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import threading
+import queue
+import shutil
+import tempfile
+import contextvars
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from vector_store import ChunkDiff, SegmentStore, atomic_write, preview_text
+from extraction import SUPPORTED_EXTENSIONS, extract_and_spool, iter_document_chunks, page_count, read_spool
+from ann_index import (
+    apply_search_params, build_index, create_index, filtered_search_params, index_type_of, resolve_index_type, \
+    supports_removal
+)
+from lexical_index import reciprocal_rank_fusion
+from query_cache import QueryCache
+from embedding_cache import EmbeddingCache
+from jobs import JobQueue
+from batching import MicroBatcher
+from embeddings import load_embedding_model
+from context_packing import format_passage, pack_contexts
+from reranker import Reranker
+import metrics
+from watcher import DebouncedScheduler
+
+load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -26,12 +46,48 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 # Constants
 UPLOAD_FOLDER = 'uploads'
 MODEL_DIR = 'models'
+# Legacy pickle files, migrated to the segment store on first start
 INDEX_PATH = os.path.join(MODEL_DIR, 'faiss_index.pkl')
 METADATA_PATH = os.path.join(MODEL_DIR, 'metadata.pkl')
+# Append-only segment store for vectors and metadata
+STORE_DIR = os.path.join(MODEL_DIR, 'store')
+STORE_MAX_SEGMENTS = int(os.environ.get('STORE_MAX_SEGMENTS', 32))
+
+# FAISS index type: auto, flat, ivf_flat, ivf_pq or hnsw (see ann_index.py)
+INDEX_TYPE = os.environ.get('INDEX_TYPE', 'auto')
+# With INDEX_TYPE=auto, switch to IVF-Flat / IVF-PQ once the corpus reaches these sizes
+ANN_THRESHOLD = int(os.environ.get('ANN_THRESHOLD', 50_000))
+PQ_THRESHOLD = int(os.environ.get('PQ_THRESHOLD', 1_000_000))
+INDEX_PARAMS = {
+    'nprobe': int(os.environ.get('IVF_NPROBE', 16)),
+    'ef_search': int(os.environ.get('HNSW_EF_SEARCH', 64)),
+}
+# HNSW graphs are rebuilt once this share of their vectors belongs to deleted chunks
+HNSW_MAX_REMOVED_FRACTION = float(os.environ.get('HNSW_MAX_REMOVED_FRACTION', 0.2))
+# Trained approximate indexes are cached here so they are not retrained at every start
+INDEX_CACHE_PATH = os.path.join(MODEL_DIR, 'index.faiss')
+# Remembers the first chunk id stored after the cached index was written
+INDEX_CACHE_STATE_PATH = os.path.join(MODEL_DIR, 'index.faiss.json')
+
+# Retrieval: dense (FAISS), lexical (BM25) or hybrid (both, fused with reciprocal rank fusion)
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+# Candidates taken from each retriever before fusion, and the rank fusion constant
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 20))
+RRF_K = int(os.environ.get('RRF_K', 60))
+# Optional cross-encoder re-ranking of RERANK_CANDIDATES retrieved chunks, bounded by a deadline
+RERANK_ENABLED = os.environ.get('RERANK', 'false').lower() in ('1', 'true', 'yes')
+RERANK_MODEL = os.environ.get('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 20))
+RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', 16))
+RERANK_DEADLINE_MS = float(os.environ.get('RERANK_DEADLINE_MS', 200))
+reranker = Reranker(RERANK_MODEL, batch_size=RERANK_BATCH_SIZE, deadline_ms=RERANK_DEADLINE_MS)
 
 # TODO: hetha document eli ysiir alih imbedding automatik : Badlou bel forlder eli al serveur ydir alih imbedding
 DOCUMENTS_FOLDER = 'uploads'  # Folder to monitor for automatic indexing 
 PROCESSED_FILES_REGISTRY = os.path.join(MODEL_DIR, 'processed_files.pkl')
+# Seconds without a new event before a changed file in the documents folder is handled
+WATCH_DEBOUNCE_SECONDS = float(os.environ.get('WATCH_DEBOUNCE_SECONDS', 1.0))
+JOBS_DIR = os.path.join(MODEL_DIR, 'jobs')
 
 # Create necessary directories
 for directory in [UPLOAD_FOLDER, MODEL_DIR]:
@@ -42,44 +98,611 @@ for directory in [UPLOAD_FOLDER, MODEL_DIR]:
 if not os.path.exists(DOCUMENTS_FOLDER):
     os.makedirs(DOCUMENTS_FOLDER)
 
-# File tracking system
+# File tracking system: content hash and (size, mtime) of every processed file
 processed_files = {}    
+processed_stats = {}
+registry_lock = threading.Lock()
+
+# Ollama settings
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434/api/generate')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'deepseek-r1:7b')
+# Seconds to wait for Ollama to connect / to send the next piece of the answer
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 5))
+OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT', 300))
+OLLAMA_ERROR_MESSAGE = "Désolé, je n'ai pas pu générer une réponse. Veuillez réessayer."
+SYSTEM_MESSAGE = "Vous êtes un assistant utile qui répond aux questions basées sur les contextes fournis. Si les contextes ne contiennent pas l'information demandée, indiquez clairement que vous ne pouvez pas répondre à la question avec les données dont vous disposez."
+
+# Estimated tokens of retrieved context put in a prompt (see context_packing.py)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 768))
+# Longest previous conversation (Ollama context, in tokens) sent back with a prompt; 0 keeps any length.
+# A longer context is dropped rather than cut: it starts with the tokenized system prompt and template.
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 2048))
+
+# HTTP session reused for every Ollama call so connections are kept alive
+ollama_session = requests.Session()
+
+# Number of chunks sent to the embedding model per forward pass
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+
+# Extraction processes used when indexing many documents at once
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+# Documents buffered between the extraction, embedding and writing stages
+INGEST_QUEUE_SIZE = 8
+# Vectors read back from the store per call when adding a new segment to the index
+INDEX_ADD_BATCH_SIZE = 4096
 
 # Initialize the embedding model
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+# Inference backend: torch (float32), onnx or onnx-int8 (see embeddings.py)
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_FILE = os.environ.get('EMBEDDING_ONNX_FILE') or None
+# Loaded by get_embedding_model(), in the background at startup (see start_warmup)
+embedding_model = None
+embedding_model_lock = threading.Lock()
 embedding_dimension = 384  # Dimension for the all-MiniLM-L6-v2 model
 
-# FAISS index and metadata storage
-index = None
-metadata = []
+# Chunk embeddings keyed by a hash of (model, text), so unchanged text is never encoded twice.
+# Backends do not produce identical vectors, so each one has its own cache.
+EMBEDDING_CACHE_DIR = os.path.join(
+    MODEL_DIR, 'embedding_cache' if EMBEDDING_BACKEND == 'torch' else f'embedding_cache_{EMBEDDING_BACKEND}'
+)
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 100_000))  # 0 disables the cache
+# Its files are opened during warm-up (or by the first lookup), not at import
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME, embedding_dimension,
+                                 max_entries=EMBEDDING_CACHE_SIZE)
+
+# Cache of chat answers: exact LRU plus semantic match within a cosine distance
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 512))  # 0 disables the cache
+SEMANTIC_CACHE_DISTANCE = float(os.environ.get('SEMANTIC_CACHE_DISTANCE', 0.05))  # negative disables semantic hits
+query_cache = QueryCache(max_entries=QUERY_CACHE_SIZE, max_distance=SEMANTIC_CACHE_DISTANCE)
+
+# Queries from concurrent requests are encoded and searched together
+QUERY_BATCH_SIZE = int(os.environ.get('QUERY_BATCH_SIZE', 32))  # 1 disables batching
+QUERY_BATCH_WAIT_MS = float(os.environ.get('QUERY_BATCH_WAIT_MS', 2))
+# Most queries a single /api/search request may carry
+MAX_SEARCH_QUERIES = 64
+MAX_SEARCH_TOP_K = 50
+# Searches filtered to at most this many chunks compare the query with each of them
+# instead of searching the FAISS index with an id selector
+FILTER_EXACT_MAX = int(os.environ.get('FILTER_EXACT_MAX', 20000))
+FILTER_FORMATS = ['pdf', 'docx', 'pptx']
+MAX_FILTER_SOURCES = 100
+# Page size of /api/list-documents
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+LIST_SORTS = ['name', 'recent', 'chunks']
+
+# Named collections: each has its own vector store and index under COLLECTIONS_DIR.
+# The corpus directly under MODEL_DIR is the "default" collection.
+COLLECTIONS_DIR = os.path.join(MODEL_DIR, 'collections')
+DEFAULT_COLLECTION = 'default'
+COLLECTION_NAME_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+# Loaded collections are dropped from memory after this long without a search or write,
+# and the least recently used ones beyond MAX_LOADED_COLLECTIONS
+COLLECTION_IDLE_SECONDS = float(os.environ.get('COLLECTION_IDLE_SECONDS', 600))
+MAX_LOADED_COLLECTIONS = int(os.environ.get('MAX_LOADED_COLLECTIONS', 8))
+# Threads searching the collections of one request in parallel
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', min(8, os.cpu_count() or 1)))
+MAX_SEARCH_COLLECTIONS = 16
+
+class IndexSnapshot:
+    """Immutable pairing of a FAISS index with the metadata of its vectors.
+
+    Searches read whichever snapshot is current. Writers apply their changes
+    to another copy of the index and then swap the module-level reference, so
+    a search never waits for ingestion and never sees vectors without their
+    metadata (see ``writable_index``). The BM25 index of the same chunks
+    comes with the metadata.
+
+    ``removed`` are chunk ids deleted since an HNSW graph, which cannot drop
+    vectors, was built: they stay in the graph and ``search`` skips them.
+    """
+
+    def __init__(self, index, metadata, version, removed=None):
+        self.index = index
+        self.metadata = metadata
+        self.version = version
+        self.removed = removed if removed is not None else np.empty(0, dtype='int64')
+        self.search_params = None
+        if len(self.removed):
+            self.removed_selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(self.removed))
+            self.search_params = filtered_search_params(index, self.removed_selector, self.ntotal / max(index.ntotal, 1))
+        # The index copy the next write may reuse, see writable_index
+        self.spare = None
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal - len(self.removed)
+
+    @property
+    def lexical(self):
+        return self.metadata.lexical
+
+    def search(self, queries, k):
+        """FAISS search of the index, without the removed chunks."""
+        return self.index.search(queries, k, params=self.search_params)
+
+class IndexSpare:
+    """The index of a replaced snapshot, kept to be brought up to date by the next write.
+
+    It misses the (stale ids, added ids) ``change`` of the commit that
+    replaced it; ``owner`` is a weak reference to the snapshot searching it,
+    which must be gone before it is written to again.
+    """
+
+    def __init__(self, index, owner, change):
+        self.index = index
+        self.owner = weakref.ref(owner)
+        self.change = change
+
+# FAISS index and metadata storage; replaced as a whole, never mutated
+snapshot = None
+vector_store = None
+# Serializes index and vector store writes (uploads, watcher, reindexing)
+index_write_lock = threading.Lock()
+# Held while a document is being diffed, encoded and committed (see IngestionBatch)
+document_locks = {}
+document_locks_lock = threading.Lock()
+
+class Collection:
+    """A named corpus with its own vector store and index shard under COLLECTIONS_DIR.
+
+    The snapshot is loaded on first use and dropped again by
+    ``evict_idle_collections``; searches still holding it finish on it.
+    ``pins`` counts the ingestion batches and deletions in progress, which
+    need the store to stay loaded.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.snapshot = None
+        self.vector_store = None
+        self.write_lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.pins = 0
+
+    @property
+    def directory(self):
+        return os.path.join(COLLECTIONS_DIR, self.name)
+
+    @property
+    def store_dir(self):
+        return os.path.join(self.directory, 'store')
+
+    @property
+    def upload_dir(self):
+        return os.path.join(self.directory, 'uploads')
+
+    @property
+    def index_cache_path(self):
+        return os.path.join(self.directory, 'index.faiss')
+
+    @property
+    def index_cache_state_path(self):
+        return os.path.join(self.directory, 'index.faiss.json')
+
+    def pin(self):
+        with self.load_lock:
+            self.pins += 1
+            self.last_used = time.monotonic()
+
+    def unpin(self):
+        with self.load_lock:
+            self.pins -= 1
+
+    def evict(self):
+        """Drop the snapshot and store unless a write is using them. Returns whether it did."""
+        # Never wait: a collection being loaded or pinned is in use anyway
+        if not self.load_lock.acquire(blocking=False):
+            return False
+        try:
+            if self.pins or self.snapshot is None:
+                return False
+            self.snapshot = None
+            self.vector_store = None
+            return True
+        finally:
+            self.load_lock.release()
+
+class DefaultCollection(Collection):
+    """The corpus under MODEL_DIR, searched when a request names no collection.
+
+    Its state is the module-level snapshot, vector_store and
+    index_write_lock, its paths follow STORE_DIR and INDEX_CACHE_PATH, and it
+    is never evicted.
+    """
+
+    def __init__(self):
+        self.name = DEFAULT_COLLECTION
+        self.load_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.pins = 0
+
+    store_dir = property(lambda self: STORE_DIR)
+    upload_dir = property(lambda self: UPLOAD_FOLDER)
+    index_cache_path = property(lambda self: INDEX_CACHE_PATH)
+    index_cache_state_path = property(lambda self: INDEX_CACHE_STATE_PATH)
+    write_lock = property(lambda self: index_write_lock)
+
+    @property
+    def snapshot(self):
+        return snapshot
+
+    @snapshot.setter
+    def snapshot(self, value):
+        global snapshot
+        snapshot = value
+
+    @property
+    def vector_store(self):
+        return vector_store
+
+    @vector_store.setter
+    def vector_store(self, value):
+        global vector_store
+        vector_store = value
+
+    def evict(self):
+        return False
+
+default_collection = DefaultCollection()
+collection_registry = {}
+collection_registry_lock = threading.Lock()
+collection_eviction_thread = None
+
+def get_collection(name, create=False):
+    """The collection called ``name``; None if it does not exist on disk and ``create`` is false."""
+    if name == DEFAULT_COLLECTION:
+        return default_collection
+    with collection_registry_lock:
+        collection = collection_registry.get(name)
+        if collection is None and (create or os.path.isdir(os.path.join(COLLECTIONS_DIR, name, 'store'))):
+            collection = collection_registry[name] = Collection(name)
+    evict_idle_collections()
+    if collection is not None:
+        start_collection_eviction()
+    return collection
+
+def list_collections():
+    """Names of the default collection and of every named collection on disk."""
+    names = set(os.listdir(COLLECTIONS_DIR)) if os.path.isdir(COLLECTIONS_DIR) else set()
+    with collection_registry_lock:
+        names.update(collection_registry)
+    return [DEFAULT_COLLECTION] + sorted(name for name in names if COLLECTION_NAME_PATTERN.match(name))
+
+def evict_idle_collections():
+    """Unload the collections idle for COLLECTION_IDLE_SECONDS and the least recently
+    used ones beyond MAX_LOADED_COLLECTIONS. Returns the names of those unloaded."""
+    now = time.monotonic()
+    with collection_registry_lock:
+        loaded = sorted((c for c in collection_registry.values() if c.snapshot is not None),
+                        key=lambda c: c.last_used, reverse=True)
+    evicted = []
+    for position, collection in enumerate(loaded):
+        if now - collection.last_used < COLLECTION_IDLE_SECONDS and position < MAX_LOADED_COLLECTIONS:
+            continue
+        if collection.evict():
+            print(f"Unloaded collection {collection.name} after {now - collection.last_used:.0f}s idle")
+            evicted.append(collection.name)
+    return evicted
+
+def start_collection_eviction():
+    """Start the thread running evict_idle_collections periodically (idempotent).
+
+    Collections must be unloaded even when no request touches them again, or
+    when requests only search the default collection.
+    """
+    global collection_eviction_thread
+    with collection_registry_lock:
+        if collection_eviction_thread is not None:
+            return
+        collection_eviction_thread = threading.Thread(target=run_collection_eviction, name='collection-eviction', daemon=True)
+        collection_eviction_thread.start()
+
+def run_collection_eviction():
+    interval = max(1.0, min(COLLECTION_IDLE_SECONDS / 4, 60.0))
+    while True:
+        time.sleep(interval)
+        try:
+            evict_idle_collections()
+        except Exception as e:
+            print(f"Error unloading idle collections: {e}")
+
+def document_lock(filename, collection=None):
+    """Lock serializing the ingestion and deletion of one document."""
+    key = ((collection or default_collection).name, filename)
+    with document_locks_lock:
+        return document_locks.setdefault(key, threading.Lock())
+
+def current_snapshot(collection=None):
+    """The snapshot searches should use; loads the index first if startup has not yet."""
+    collection = collection or default_collection
+    collection.last_used = time.monotonic()
+    current = collection.snapshot
+    if current is None:
+        current = ensure_index(collection)
+    return current
+
+def publish_snapshot(faiss_index, chunk_metadata, collection=None, removed=None):
+    """Atomically make a new index/metadata pair visible to searches."""
+    collection = collection or default_collection
+    previous = collection.snapshot
+    collection.snapshot = IndexSnapshot(faiss_index, chunk_metadata, previous.version + 1 if previous else 0, removed)
+    return collection.snapshot
+
+def migrate_legacy_pickles():
+    """Copy the vectors and metadata from the old pickle files into the segment store."""
+    with open(INDEX_PATH, 'rb') as f:
+        legacy_index = pickle.load(f)
+    with open(METADATA_PATH, 'rb') as f:
+        legacy_metadata = pickle.load(f)
+
+    vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+    vector_store.append(vectors, legacy_metadata)
+    print(f"Migrated {legacy_index.ntotal} vectors from legacy pickle files to {STORE_DIR}")
+
+def target_index_type(count):
+    """Index type to use for a corpus of the given size."""
+    return resolve_index_type(INDEX_TYPE, count, ANN_THRESHOLD, PQ_THRESHOLD)
+
+def save_index_cache(faiss_index, collection=None):
+    """Write a trained approximate index next to the vector store."""
+    collection = collection or default_collection
+    cache_path = collection.index_cache_path
+    if index_type_of(faiss_index) == 'flat':
+        # Flat indexes are rebuilt from the memory-mapped vectors, no cache needed
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        return
+    tmp_path = f"{cache_path}.tmp"
+    faiss.write_index(faiss_index, tmp_path)
+    next_id = collection.vector_store.next_id
+    atomic_write(
+        collection.index_cache_state_path, lambda f: json.dump({'next_id': next_id}, f), mode='w'
+    )
+    os.replace(tmp_path, cache_path)
+    print(f"Saved {index_type_of(faiss_index)} index with {faiss_index.ntotal} vectors to {cache_path}")
+
+def load_cached_index(index_type, collection=None):
+    """Load the cached index and bring it up to date with the vector store.
+
+    Chunks deleted since the cache was written are removed from it and
+    chunks stored since then are added. Returns None when there is no
+    usable cache for this index type.
+    """
+    collection = collection or default_collection
+    store = collection.vector_store
+    if index_type == 'flat' or not os.path.exists(collection.index_cache_path):
+        return None
+    try:
+        cached_index = faiss.read_index(collection.index_cache_path)
+        with open(collection.index_cache_state_path, 'r', encoding='utf-8') as f:
+            cached_next_id = json.load(f)['next_id']
+    except Exception as e:
+        print(f"Could not read cached index: {e}")
+        return None
+    cached_count = cached_index.ntotal
+    if index_type_of(cached_index) != index_type:
+        return None
+
+    # Chunk ids only grow, so everything stored after the cache has a larger id
+    live_ids = []
+    cached_live = 0
+    for ids, vectors in store.load_vectors():
+        live_ids.append(ids)
+        new = ids >= cached_next_id
+        cached_live += int(len(ids) - new.sum())
+        if new.any():
+            cached_index.add_with_ids(np.ascontiguousarray(vectors[new]), ids[new])
+    added = cached_index.ntotal - cached_count
+
+    try:
+        if cached_count != cached_live:
+            live = faiss.IDSelectorBatch(np.concatenate(live_ids) if live_ids else np.empty(0, dtype='int64'))
+            cached_index.remove_ids(faiss.IDSelectorNot(live))
+    except Exception as e:
+        print(f"Could not remove deleted chunks from cached index: {e}")
+        return None
+    if cached_index.ntotal != store.count:
+        print(f"Cached index has {cached_index.ntotal} vectors, store has {store.count}; rebuilding")
+        return None
+
+    if added + cached_count - cached_live > max(1000, cached_count // 10):
+        save_index_cache(cached_index, collection)
+    return apply_search_params(cached_index, INDEX_PARAMS)
+
+def build_index_from_store(index_type, collection=None):
+    """Build (and train if needed) a FAISS index over every stored vector."""
+    collection = collection or default_collection
+    store = collection.vector_store
+    start = time.time()
+    faiss_index = build_index(index_type, embedding_dimension, store.load_vectors, store.count, INDEX_PARAMS)
+    print(f"Built {index_type} index with {faiss_index.ntotal} vectors in {time.time() - start:.2f}s")
+    save_index_cache(faiss_index, collection)
+    return faiss_index
+
+def load_or_build_index(collection=None):
+    """Return an index over the vector store, preferring the cached trained index."""
+    collection = collection or default_collection
+    index_type = target_index_type(collection.vector_store.count)
+    cached_index = load_cached_index(index_type, collection)
+    if cached_index is not None:
+        return cached_index
+    return build_index_from_store(index_type, collection)
+
+def index_for_corpus_size(faiss_index, collection=None):
+    """Return an index of the right type for its size, rebuilding it when a threshold was crossed."""
+    collection = collection or default_collection
+    index_type = target_index_type(faiss_index.ntotal)
+    if index_type == index_type_of(faiss_index):
+        return faiss_index
+    print(f"Switching FAISS index from {index_type_of(faiss_index)} to {index_type} at {faiss_index.ntotal} vectors")
+    if collection is default_collection:
+        query_cache.reset()
+    return build_index_from_store(index_type, collection)
 
 # Initialize or load FAISS index
-def initialize_index():
-    global index, metadata
-    if os.path.exists(INDEX_PATH) and os.path.exists(METADATA_PATH):
-        # Load existing index and metadata
-        with open(INDEX_PATH, 'rb') as f:
-            index = pickle.load(f)
-        with open(METADATA_PATH, 'rb') as f:
-            metadata = pickle.load(f)
-        print(f"Loaded existing index with {index.ntotal} vectors")
-    else:
-        # Create a new index
-        index = faiss.IndexFlatL2(embedding_dimension)
-        metadata = []
-        print("Created new FAISS index")
+def initialize_index(collection=None):
+    collection = collection or default_collection
+    with collection.write_lock:
+        if collection is default_collection:
+            # Only answers from the default collection are cached
+            query_cache.reset()
+        store = SegmentStore(collection.store_dir, embedding_dimension, max_segments=STORE_MAX_SEGMENTS)
+        collection.vector_store = store
+        faiss_index = create_index('flat', embedding_dimension, 0)
+
+        if store.exists():
+            # Vectors are memory-mapped; chunk text stays on disk until it is looked up
+            faiss_index = load_or_build_index(collection)
+            print(f"Loaded existing index of collection {collection.name} with {faiss_index.ntotal} vectors "
+                  f"from {len(store.segments)} segments")
+        elif collection is default_collection and os.path.exists(INDEX_PATH) and os.path.exists(METADATA_PATH):
+            try:
+                migrate_legacy_pickles()
+                faiss_index = load_or_build_index()
+            except Exception as e:
+                store.reset()
+                print(f"Could not migrate legacy index ({e}); created new FAISS index. Use /api/reindex-all to rebuild it.")
+        else:
+            # Create a new index
+            store.reset()
+            print(f"Created new FAISS index for collection {collection.name}")
+
+        publish_snapshot(faiss_index, store.metadata, collection)
+
+# Startup: the index and the embedding model are loaded lazily, in a
+# background thread started by the server entry points or the first request.
+# Until both are loaded the process is alive but not ready.
+startup_lock = threading.Lock()
+startup_thread = None
+startup_state = {'started_at': time.time(), 'index': 'pending', 'model': 'pending', 'error': None,
+                 'index_seconds': None, 'model_seconds': None,
+                 'reranker': 'pending' if RERANK_ENABLED else 'disabled'}
+
+def ensure_index(collection=None):
+    """Load the index of a collection unless it already is; waits if another thread is loading it.
+
+    Returns the collection's snapshot.
+    """
+    collection = collection or default_collection
+    with collection.load_lock:
+        if collection.snapshot is None:
+            start = time.time()
+            initialize_index(collection)
+            if collection is default_collection:
+                startup_state['index'] = 'ready'
+                startup_state['index_seconds'] = time.time() - start
+        return collection.snapshot
+
+def get_embedding_model():
+    """The embedding model, loaded and warmed up on first use."""
+    global embedding_model
+    if embedding_model is None:
+        with embedding_model_lock:
+            if embedding_model is None:
+                start = time.time()
+                model = load_embedding_model(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, onnx_file=EMBEDDING_ONNX_FILE)
+                # The first forward pass allocates the model's buffers
+                model.encode(['warm up'])
+                embedding_model = model
+                startup_state['model'] = 'ready'
+                startup_state['model_seconds'] = time.time() - start
+                print(f"Loaded {EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND}) in {startup_state['model_seconds']:.2f}s")
+    return embedding_model
+
+def warm_up():
+    """Load the index, the embedding cache, then the embedding model."""
+    try:
+        ensure_index()
+        embedding_cache.open()
+        get_embedding_model()
+        if RERANK_ENABLED:
+            reranker.load()
+            startup_state['reranker'] = 'ready'
+    except Exception as e:
+        print(f"Startup failed: {e}")
+        startup_state['error'] = str(e)
 
-# Call initialization
-initialize_index()
+def start_warmup():
+    """Start loading the heavy components in the background; does nothing if already started.
+
+    Called after the process is set up (and after any fork), so forked
+    workers never inherit a loaded model.
+    """
+    global startup_thread
+    if startup_thread is None:
+        with startup_lock:
+            if startup_thread is None:
+                startup_thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+                startup_thread.start()
+
+def is_ready():
+    return snapshot is not None and embedding_model is not None and (not RERANK_ENABLED or reranker.model is not None)
 
 # Routes
+@app.before_request
+def start_warmup_on_first_request():
+    """Servers that do not call start_warmup (e.g. flask run) warm up on their first request."""
+    start_warmup()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    """Time to response headers per route; streamed bodies are timed by their stages."""
+    start = g.get('request_start')
+    if start is not None:
+        metrics.request_seconds.observe(
+            time.perf_counter() - start,
+            endpoint=request.url_rule.rule if request.url_rule else 'unknown',
+            method=request.method, status=response.status_code
+        )
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Per-stage and per-endpoint latency histograms in the Prometheus text format."""
+    # Scraping must not trigger the index load
+    current = snapshot
+    store = vector_store
+    gauges = [
+        ('rag_ready', 'Whether the index and the embedding model are loaded.', int(is_ready())),
+        ('rag_index_vectors', 'Number of vectors in the published index.', current.ntotal if current else 0),
+        ('rag_segments', 'Number of segments of the vector store.', len(store.segments) if store else 0),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET'])
 def home():
     """Root endpoint for testing."""
     return jsonify({'message': 'Welcome to the Local RAG Chatbot API!'})
+
+@app.route('/api/health/live', methods=['GET'])
+def liveness_endpoint():
+    """Liveness probe: the process is up and serving requests."""
+    return jsonify({'status': 'alive', 'uptime_seconds': time.time() - startup_state['started_at']})
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_endpoint():
+    """Readiness probe: 200 once the index and the embedding model are loaded, 503 before."""
+    if is_ready():
+        status, code = 'ready', 200
+    elif startup_state['error']:
+        status, code = 'failed', 503
+    else:
+        status, code = 'starting', 503
+    return jsonify(dict(startup_state, status=status, uptime_seconds=time.time() - startup_state['started_at'])), code
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Upload file endpoint for multiple document formats (PDF, DOCX, PPTX)."""
+    """Upload file endpoint for multiple document formats (PDF, DOCX, PPTX).
+
+    An optional "collection" form field ingests the file into that
+    collection, created if needed, instead of the default one.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -95,10 +718,15 @@ def upload_file():
     allowed_extensions = ['.pdf', '.docx', '.pptx']
     if file_extension not in allowed_extensions:
         return jsonify({'error': f'Unsupported file format. Allowed formats: {", ".join(allowed_extensions)}'}), 400
+    collection_name = request.form.get('collection') or DEFAULT_COLLECTION
+    if not COLLECTION_NAME_PATTERN.match(collection_name):
+        return jsonify({'error': 'Collection names are 1 to 64 lowercase letters, digits, "-" and "_"'}), 400
 
     try:
-        # Save file in both directories
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        # Files of named collections are kept out of the watched documents folder
+        collection = get_collection(collection_name, create=True)
+        os.makedirs(collection.upload_dir, exist_ok=True)
+        filepath = os.path.join(collection.upload_dir, filename)
         file.save(filepath)
         print(f"File saved successfully at {filepath}")
 
@@ -109,65 +737,211 @@ def upload_file():
         #     f_static.write(file.read())
         # print(f"File saved permanently at {static_filepath}")
 
-        # Extract text based on file type
-        if file_extension == '.pdf':
-            text = extract_text_from_pdf(filepath)
-        elif file_extension == '.docx':
-            text = extract_text_from_docx(filepath)
-        elif file_extension == '.pptx':
-            text = extract_text_from_pptx(filepath)
-        if text:
-            print(f"Text extracted successfully from {file_extension} file. Text length: {len(text)}")
-        
-        # Chunk the text
-        chunks = chunk_text_simple(text, chunk_size=1000, overlap=100)
-        chunk_count = len(chunks)
-        print(f"Text split into {chunk_count} chunks.")
-        
-        # Store chunks in FAISS index
-        success_count = store_in_faiss(chunks, filename)
-        
-        print(f"Successfully stored {success_count} out of {chunk_count} chunks in FAISS index.")
+        file_hash = file_md5(filepath)
+
+        # Extraction, chunking and embedding run in the background job queue, which registers
+        # files of the default collection as processed once ingested (see run_ingestion_job)
+        job, created = job_queue.submit(
+            filepath, filename, file_hash, collection=None if collection is default_collection else collection.name
+        )
+        if created:
+            print(f"Queued ingestion job {job['id']} for {filename}")
+        else:
+            print(f"{filename} with the same content is already queued as job {job['id']}")
+
         return jsonify({
-            'message': f'File processed with {success_count} chunks stored',
+            'message': 'File queued for processing' if created else 'File already queued',
+            'job_id': job['id'],
+            'status': job['status'],
+            'duplicate': not created,
             'filename': filename,
-            'format': file_extension[1:],  # Remove the leading dot
-            'chunks': chunk_count
-        })
+            'collection': collection.name,
+            'format': file_extension[1:]  # Remove the leading dot
+        }), 202
         
     except Exception as e:
         print(f"Error in upload_file: {str(e)}")
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status_endpoint(job_id):
+    """Progress of a background ingestion job: stage, chunks processed and ETA."""
+    job = job_queue.describe(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    return jsonify(job)
+
 @app.route('/api/chat', methods=['POST'])
 def chat_endpoint():
-    """Chat endpoint for handling user queries."""
+    """Chat endpoint for handling user queries.
+
+    Optional "sources" (document names) and "formats" (pdf, docx, pptx)
+    restrict retrieval to some documents, and "collections" searches those
+    collections instead of the default one.
+    """
     data = request.json
     query = data.get('query')
     history = data.get('history', None)  # This should be an array of context tokens
     
     if not query:
         return jsonify({'error': 'No query provided'}), 400
+    filters, error = parse_filters(data)
+    if not error:
+        collections, error = parse_collections(data)
+    if error:
+        return jsonify({'error': error}), 400
     
-    try:
-        # Retrieve context using FAISS
-        augmented_query, contexts = augment_prompt(query)
-        print(f"Augmented query with context: {augmented_query[:100]}...")
+    with metrics.tracing(bool(request.headers.get(metrics.DEBUG_TRACE_HEADER))) as trace:
+        try:
+            start = time.time()
+            cached_result, query_embedding = cached_chat_result(query, history, filters, collections)
+            if cached_result is not None:
+                return jsonify(with_trace(dict(cached_result, cached=True), trace))
+
+            # Retrieve context using FAISS
+            augmented_query, contexts = augment_prompt(query, query_embedding=query_embedding, filters=filters,
+                                                       collections=collections)
+            print(f"Augmented query with context: {augmented_query[:100]}...")
         
-        # Generate response using Ollama
-        response = generate_response_ollama(augmented_query, history)
+            # Generate response using Ollama
+            response = generate_response_ollama(augmented_query, history)
         
-        if not response:
-            return jsonify({'error': 'Failed to generate response'}), 500
+            if not response:
+                return jsonify({'error': 'Failed to generate response'}), 500
         
+            result = {
+                'response': response,
+                'augmentedQuery': augmented_query,
+                'contexts': contexts
+            }
+            cache_chat_result(query, query_embedding, result, time.time() - start)
+            return jsonify(with_trace(result, trace))
+        except Exception as e:
+            print(f"Error in chat endpoint: {e}")
+            return jsonify({'error': f'Error processing query: {str(e)}'}), 500
+def with_trace(result, trace):
+    """A copy of a chat result carrying the stage trace, when one was requested."""
+    return dict(result, trace=trace) if trace is not None else result
+
+def sse_event(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """Streaming chat endpoint: answer tokens are sent as Server-Sent Events.
+
+    Events: 'contexts' (retrieved chunks, sent first), 'token' (a piece of
+    the answer), then 'done' with the Ollama context and timings, or 'error'.
+    Takes the same filters and collections as /api/chat.
+    """
+    data = request.json
+    query = data.get('query')
+    history = data.get('history', None)
+
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    filters, error = parse_filters(data)
+    if not error:
+        collections, error = parse_collections(data)
+    if error:
+        return jsonify({'error': error}), 400
+    trace_enabled = bool(request.headers.get(metrics.DEBUG_TRACE_HEADER))
+
+    def generate():
+        with metrics.tracing(trace_enabled) as trace:
+            start = time.time()
+            cached_result, query_embedding = cached_chat_result(query, history, filters, collections)
+            if cached_result is not None:
+                # Replay the cached answer as a single token
+                yield sse_event('contexts', {'contexts': cached_result['contexts'], 'augmentedQuery': cached_result['augmentedQuery']})
+                yield sse_event('token', {'token': cached_result['response']})
+                elapsed_ms = (time.time() - start) * 1000
+                yield sse_event('done', with_trace({'context': None, 'cached': True,
+                                                    'time_to_first_token_ms': elapsed_ms, 'total_ms': elapsed_ms}, trace))
+                return
+
+            augmented_query, contexts = augment_prompt(query, query_embedding=query_embedding, filters=filters,
+                                                       collections=collections)
+            yield sse_event('contexts', {'contexts': contexts, 'augmentedQuery': augmented_query})
+
+            first_token_ms = None
+            tokens = []
+            for event, payload in stream_response_ollama(augmented_query, history):
+                if event == 'token':
+                    if first_token_ms is None:
+                        first_token_ms = (time.time() - start) * 1000
+                        print(f"Time to first token: {first_token_ms:.0f} ms")
+                    tokens.append(payload)
+                    yield sse_event('token', {'token': payload})
+                elif event == 'done':
+                    payload['time_to_first_token_ms'] = first_token_ms
+                    payload['total_ms'] = (time.time() - start) * 1000
+                    cache_chat_result(query, query_embedding, {
+                        'response': ''.join(tokens),
+                        'augmentedQuery': augmented_query,
+                        'contexts': contexts
+                    }, time.time() - start)
+                    yield sse_event('done', with_trace(payload, trace))
+                else:
+                    yield sse_event('error', {'error': payload})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/search', methods=['POST'])
+def search_endpoint():
+    """Retrieve the top-k contexts of one or more queries, without generating an answer.
+
+    Body: {"queries": [...]} (or {"query": "..."}), optional "top_k",
+    "mode" (dense, lexical or hybrid), "rerank" (true or false, defaults
+    to the RERANK setting), the "sources" and "formats" filters and the
+    "collections" of /api/chat.
+    """
+    data = request.json or {}
+    queries = data.get('queries')
+    if queries is None and data.get('query'):
+        queries = [data['query']]
+    top_k = data.get('top_k', 3)
+    mode = data.get('mode') or RETRIEVAL_MODE
+    rerank = data.get('rerank')
+
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'error': 'Provide a non-empty list of queries'}), 400
+    if len(queries) > MAX_SEARCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_SEARCH_QUERIES} queries per request'}), 400
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_SEARCH_TOP_K:
+        return jsonify({'error': f'top_k must be an integer between 1 and {MAX_SEARCH_TOP_K}'}), 400
+    if mode not in ('dense', 'lexical', 'hybrid'):
+        return jsonify({'error': f"Unknown retrieval mode '{mode}'. Allowed modes: dense, lexical, hybrid"}), 400
+    if rerank is not None and not isinstance(rerank, bool):
+        return jsonify({'error': 'rerank must be true or false'}), 400
+    filters, error = parse_filters(data)
+    if not error:
+        collections, error = parse_collections(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        start = time.time()
+        results = retrieve(queries, top_k, mode=mode, rerank=rerank, filters=filters, collections=collections)
         return jsonify({
-            'response': response,
-            'augmentedQuery': augmented_query,
-            'contexts': contexts
+            'results': [{'query': query, 'contexts': contexts} for query, contexts in zip(queries, results)],
+            'took_ms': (time.time() - start) * 1000
         })
     except Exception as e:
-        print(f"Error in chat endpoint: {e}")
-        return jsonify({'error': f'Error processing query: {str(e)}'}), 500
+        print(f"Error in search endpoint: {e}")
+        return jsonify({'error': f'Error searching: {str(e)}'}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats_endpoint():
+    """Hit rate and latency saved by the query cache, plus embedding cache and re-ranker counters."""
+    return jsonify(dict(query_cache.get_stats(), embedding_cache=embedding_cache.get_stats(),
+                        reranker=dict(reranker.get_stats(), enabled=RERANK_ENABLED)))
+
 @app.route('/api/test', methods=['GET'])
 def test_endpoint():
     """Test endpoint to verify API is working."""
@@ -180,133 +954,370 @@ def reindex_all_documents():
     """Reindex all documents in the documents folder."""
     try:
         # Reset the processed files registry to force reprocessing
-        global processed_files
+        global processed_files, processed_stats
         processed_files = {}
+        processed_stats = {}
         
         # Get all document files
-        files_processed = 0
+        filepaths = []
         for filename in os.listdir(DOCUMENTS_FOLDER):
             filepath = os.path.join(DOCUMENTS_FOLDER, filename)
             if os.path.isfile(filepath):
                 file_extension = os.path.splitext(filepath)[1].lower()
                 if file_extension in ['.pdf', '.docx', '.pptx']:
-                    try:
-                        process_document_from_path(filepath)
-                        files_processed += 1
-                    except Exception as e:
-                        print(f"Error processing {filepath}: {e}")
+                    filepaths.append(filepath)
+
+        # Unchanged chunks are kept, so reindexing does not grow the index
+        cache_counts = {}
+        files_processed = ingest_documents(filepaths, cache_counts=cache_counts)
+
+        # Documents that are no longer in the folder are removed from the index
+        folder_sources = {os.path.basename(filepath) for filepath in filepaths}
+        removed = [source for source in current_snapshot().metadata.sources() if source not in folder_sources]
+        for source in removed:
+            delete_document(source)
+
+        # Register the indexed files again, so the watcher does not ingest them a second time
+        catalog = current_snapshot().metadata.catalog
+        registered = {
+            filepath: (file_md5(filepath), file_signature(filepath))
+            for filepath in filepaths if os.path.basename(filepath) in catalog and os.path.exists(filepath)
+        }
+        with registry_lock:
+            for filepath, (file_hash, signature) in registered.items():
+                processed_files[filepath] = file_hash
+                processed_stats[filepath] = signature
         
         # Save the updated registry
         save_processed_files()
         
         return jsonify({
             'message': f'Reindexed {files_processed} documents from {DOCUMENTS_FOLDER}',
-            'files_processed': files_processed
+            'files_processed': files_processed,
+            'documents_removed': removed,
+            'embedding_cache': cache_counts
         })
     except Exception as e:
         print(f"Error reindexing documents: {e}")
         return jsonify({'error': f'Error reindexing documents: {str(e)}'}), 500
 
+@app.route('/api/documents/<filename>', methods=['DELETE'])
+def delete_document_endpoint(filename):
+    """Remove a document from the index and from the documents folder.
+
+    The "collection" query parameter deletes it from a named collection.
+    """
+    if os.path.basename(filename) != filename or filename.startswith('.'):
+        return jsonify({'error': 'Invalid file name'}), 400
+    collection = collection_from_args()
+    if collection is None:
+        return jsonify({'error': f"Unknown collection '{request.args.get('collection')}'"}), 404
+
+    try:
+        if collection is default_collection:
+            filepath = os.path.join(DOCUMENTS_FOLDER, filename)
+        else:
+            filepath = os.path.join(collection.upload_dir, filename)
+        chunks_removed = delete_document(filename, collection)
+        file_removed = os.path.isfile(filepath)
+        if not chunks_removed and not file_removed:
+            return jsonify({'error': f'Document {filename} not found'}), 404
+
+        # Forget the file so that the watcher indexes it again if it comes back
+        if collection is default_collection:
+            with registry_lock:
+                file_hash = processed_files.pop(filepath, None)
+                processed_stats.pop(filepath, None)
+            if file_hash is not None:
+                save_processed_files()
+        if file_removed:
+            os.remove(filepath)
+
+        return jsonify({
+            'message': f'Deleted {filename}',
+            'filename': filename,
+            'collection': collection.name,
+            'chunks_removed': chunks_removed
+        })
+    except Exception as e:
+        print(f"Error deleting document {filename}: {e}")
+        return jsonify({'error': f'Error deleting document: {str(e)}'}), 500
+
 # Add endpoint to list all indexed documents
 @app.route('/api/list-documents', methods=['GET'])
 def list_indexed_documents():
-    """List all indexed documents."""
+    """List indexed documents from the document catalog, one page at a time.
+
+    Query parameters: "offset", "limit", "q" (part of the file name, case
+    insensitive), "sort" (name, recent or chunks) and "collection". Folder
+    documents are the files of the documents folder, filtered and paged the
+    same way; named collections have none.
+    """
     try:
-        # Extract unique document sources from metadata
-        document_sources = set()
-        for item in metadata:
-            if 'source' in item:
-                document_sources.add(item['source'])
-        
-        # Also list documents in the documents folder
-        folder_documents = []
-        for filename in os.listdir(DOCUMENTS_FOLDER):
-            filepath = os.path.join(DOCUMENTS_FOLDER, filename)
-            if os.path.isfile(filepath):
-                file_extension = os.path.splitext(filepath)[1].lower()
-                if file_extension in ['.pdf', '.docx', '.pptx']:
-                    folder_documents.append({
-                        'filename': filename,
-                        'path': filepath,
-                        'indexed': filename in document_sources,
-                        'size': os.path.getsize(filepath)
-                    })
-        
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', DEFAULT_LIST_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    if offset < 0 or not 1 <= limit <= MAX_LIST_LIMIT:
+        return jsonify({'error': f'offset must be positive and limit between 1 and {MAX_LIST_LIMIT}'}), 400
+    sort = request.args.get('sort', 'name')
+    if sort not in LIST_SORTS:
+        return jsonify({'error': f"Unknown sort '{sort}'. Allowed sorts: {', '.join(LIST_SORTS)}"}), 400
+    text = request.args.get('q', '').lower()
+    collection = collection_from_args()
+    if collection is None:
+        return jsonify({'error': f"Unknown collection '{request.args.get('collection')}'"}), 404
+
+    try:
+        # The catalog is kept up to date by every commit, no need to read chunk metadata
+        metadata = current_snapshot(collection).metadata
+        catalog = metadata.catalog
+        names = metadata.catalog_names
+        if text:
+            names = [name for name in names if text in name.lower()]
+        if sort == 'recent':
+            names = sorted(names, key=lambda name: catalog[name]['ingested_at'] or 0, reverse=True)
+        elif sort == 'chunks':
+            names = sorted(names, key=lambda name: -catalog[name]['chunks'])
+        page = names[offset:offset + limit]
+
+        # Files in the documents folder; one directory listing, no file is opened
+        folder_files = []
+        if collection is default_collection and os.path.isdir(DOCUMENTS_FOLDER):
+            with os.scandir(DOCUMENTS_FOLDER) as entries:
+                folder_files = sorted(
+                    (entry.name, entry.path, entry.stat().st_size) for entry in entries
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+                    and text in entry.name.lower()
+                )
+        folder_documents = [
+            {'filename': filename, 'path': path, 'indexed': filename in catalog, 'size': size}
+            for filename, path, size in folder_files[offset:offset + limit]
+        ]
+
         return jsonify({
-            'indexed_documents': list(document_sources),
-            'folder_documents': folder_documents
+            'collection': collection.name,
+            'documents': [dict(catalog[name], filename=name) for name in page],
+            'indexed_documents': page,
+            'folder_documents': folder_documents,
+            'total': len(names),
+            'folder_total': len(folder_files),
+            'offset': offset,
+            'limit': limit,
+            'next_offset': offset + limit if offset + limit < max(len(names), len(folder_files)) else None
         })
     except Exception as e:
         print(f"Error listing documents: {e}")
         return jsonify({'error': f'Error listing documents: {str(e)}'}), 500
 
+@app.route('/api/stats', methods=['GET'])
+def stats_endpoint():
+    """Corpus, index and memory statistics, read from counters instead of the chunks.
+
+    The "collection" query parameter selects the collection described.
+    """
+    collection = collection_from_args()
+    if collection is None:
+        return jsonify({'error': f"Unknown collection '{request.args.get('collection')}'"}), 404
+    try:
+        current = current_snapshot(collection)
+        store = collection.vector_store
+        rows = sum(segment['count'] for segment in store.segments)
+        with collection_registry_lock:
+            loaded = sum(1 for c in collection_registry.values() if c.snapshot is not None)
+        return jsonify({
+            'collection': collection.name,
+            'documents': len(current.metadata.catalog),
+            'chunks': store.count,
+            'deleted_chunks': store.deleted_count,
+            'segments': len(store.segments),
+            'dimension': store.dimension,
+            'index': {'type': index_type_of(current.index), 'vectors': current.ntotal,
+                      'version': current.version},
+            'vector_bytes': rows * store.dimension * 4,
+            'memory': {'rss_bytes': process_rss_bytes(),
+                       'embedding_cache_entries': embedding_cache.get_stats()['entries'],
+                       'query_cache_entries': query_cache.get_stats()['entries'],
+                       'loaded_collections': loaded}
+        })
+    except Exception as e:
+        print(f"Error computing stats: {e}")
+        return jsonify({'error': f'Error computing stats: {str(e)}'}), 500
+
+@app.route('/api/collections', methods=['GET'])
+def list_collections_endpoint():
+    """Every collection, whether it is loaded and, if it is, its size. Does not load any."""
+    try:
+        now = time.monotonic()
+        collections = []
+        for name in list_collections():
+            collection = get_collection(name)
+            if collection is None:
+                continue
+            current = collection.snapshot
+            collections.append({
+                'name': name,
+                'loaded': current is not None,
+                'documents': len(current.metadata.catalog) if current is not None else None,
+                'vectors': current.ntotal if current is not None else None,
+                'idle_seconds': now - collection.last_used,
+            })
+        return jsonify({'collections': collections, 'idle_timeout_seconds': COLLECTION_IDLE_SECONDS,
+                        'max_loaded': MAX_LOADED_COLLECTIONS})
+    except Exception as e:
+        print(f"Error listing collections: {e}")
+        return jsonify({'error': f'Error listing collections: {str(e)}'}), 500
+
+def collection_from_args():
+    """The collection named by the "collection" query parameter (the default one if absent), or None."""
+    name = request.args.get('collection') or DEFAULT_COLLECTION
+    return get_collection(name) if COLLECTION_NAME_PATTERN.match(name) else None
+
+def process_rss_bytes():
+    """Resident memory of the process, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
 # Helper Functions
 
 # Load processed files registry if exists
 def load_processed_files():
-    global processed_files
+    global processed_files, processed_stats
     if os.path.exists(PROCESSED_FILES_REGISTRY):
         with open(PROCESSED_FILES_REGISTRY, 'rb') as f:
-            processed_files = pickle.load(f)
-            print(f"Loaded registry with {len(processed_files)} processed files")
+            registry = pickle.load(f)
+        # Older registries only map paths to hashes
+        if isinstance(registry.get('files'), dict):
+            processed_files, processed_stats = registry['files'], registry['stats']
+        else:
+            processed_files, processed_stats = registry, {}
+        print(f"Loaded registry with {len(processed_files)} processed files")
     else:
         processed_files = {}
+        processed_stats = {}
         print("Created new processed files registry")
 
 # Save processed files registry
 def save_processed_files():
-    with open(PROCESSED_FILES_REGISTRY, 'wb') as f:
-        pickle.dump(processed_files, f)
-    print(f"Saved registry with {len(processed_files)} processed files")
+    with registry_lock:
+        registry = {'files': processed_files, 'stats': processed_stats}
+        atomic_write(PROCESSED_FILES_REGISTRY, lambda f: pickle.dump(registry, f))
+    print(f"Saved registry with {len(registry['files'])} processed files")
+
+def file_signature(filepath):
+    """(size, mtime) of a file: when both are unchanged, its content is assumed unchanged."""
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+def file_md5(filepath, block_size=1024 * 1024):
+    """MD5 of a file, read block by block."""
+    digest = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def changed_file_hash(filepath):
+    """Hash of a file if its content changed since it was registered, else None.
+
+    The file is only hashed when its size or mtime changed. The registry is
+    updated in memory; callers save it once for a whole batch of files.
+    """
+    signature = file_signature(filepath)
+    with registry_lock:
+        if filepath in processed_files and processed_stats.get(filepath) == signature:
+            return None
+    file_hash = file_md5(filepath)
+    with registry_lock:
+        processed_stats[filepath] = signature
+        if processed_files.get(filepath) == file_hash:
+            return None
+        processed_files[filepath] = file_hash
+    return file_hash
 
 # Check if a file has been processed before
 def is_file_processed(filepath):
-    # Calculate file hash for reliable tracking
     try:
-        with open(filepath, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        
-        # Check if file hash exists in registry
-        if filepath in processed_files and processed_files[filepath] == file_hash:
-            return True
-        
-        # Update registry with new hash
-        processed_files[filepath] = file_hash
-        save_processed_files()
-        return False
+        return changed_file_hash(filepath) is None
     except Exception as e:
         print(f"Error checking if file is processed: {e}")
         return False
 
+def register_processed_file(filepath, file_hash):
+    """Record that a version of a file was ingested.
+
+    Its signature is dropped, so the file is hashed again at its next check:
+    it may have changed while it was being ingested.
+    """
+    with registry_lock:
+        processed_files[filepath] = file_hash
+        processed_stats.pop(filepath, None)
+    save_processed_files()
+
+def unregister_processed_file(filepath, file_hash):
+    """Forget a version of a file that failed to ingest, so its next check ingests it again."""
+    with registry_lock:
+        if processed_files.get(filepath) != file_hash:
+            return
+        del processed_files[filepath]
+        processed_stats.pop(filepath, None)
+    save_processed_files()
+
 # File event handler for watchdog
 class DocumentHandler(FileSystemEventHandler):
+    """Forwards document events to the debouncing scheduler without blocking the observer thread."""
+
     def on_created(self, event):
-        self.process_file_event(event)
+        self.schedule(event, event.src_path, 'changed')
     
     def on_modified(self, event):
-        self.process_file_event(event)
-        
-    def process_file_event(self, event):
+        self.schedule(event, event.src_path, 'changed')
+
+    def on_deleted(self, event):
+        self.schedule(event, event.src_path, 'deleted')
+
+    def on_moved(self, event):
+        # Editors often save to a temporary file and rename it over the document
+        self.schedule(event, event.src_path, 'deleted')
+        self.schedule(event, event.dest_path, 'changed')
+
+    def schedule(self, event, path, change):
         # Skip directory events and hidden files
-        if event.is_directory or os.path.basename(event.src_path).startswith('.'):
+        if event.is_directory or os.path.basename(path).startswith('.'):
             return
-            
-        # Check file extension
-        file_extension = os.path.splitext(event.src_path)[1].lower()
-        allowed_extensions = ['.pdf', '.docx', '.pptx']
-        
-        if file_extension in allowed_extensions:
-            # Add a small delay to ensure the file is fully written
-            time.sleep(1)
-            
+        if os.path.splitext(path)[1].lower() in ['.pdf', '.docx', '.pptx']:
+            watch_scheduler.schedule(path, change)
+
+def handle_watched_files(changes):
+    """Handle the settled changes of the documents folder, last event per file.
+
+    New and modified documents are queued as ingestion jobs; the registry is
+    saved once for the whole batch.
+    """
+    for filepath, change in changes:
+        try:
+            if change == 'deleted' or not os.path.isfile(filepath):
+                if change == 'deleted':
+                    print(f"Document removed: {filepath}")
+                    delete_document(os.path.basename(filepath))
+                    with registry_lock:
+                        processed_files.pop(filepath, None)
+                        processed_stats.pop(filepath, None)
+                continue
+
             # Check if we've already processed this file version
-            if not is_file_processed(event.src_path):
-                print(f"New or modified document detected: {event.src_path}")
-                try:
-                    # Process the document
-                    process_document_from_path(event.src_path)
-                except Exception as e:
-                    print(f"Error processing document {event.src_path}: {e}")
+            file_hash = changed_file_hash(filepath)
+            if file_hash is None:
+                continue
+            print(f"New or modified document detected: {filepath}")
+            job, _ = job_queue.submit(filepath, os.path.basename(filepath), file_hash)
+            print(f"Queued ingestion job {job['id']} for {filepath}")
+        except Exception as e:
+            print(f"Error handling change of {filepath}: {e}")
+    save_processed_files()
 
 # Process a document from the filesystem
 def process_document_from_path(filepath):
@@ -315,30 +1326,26 @@ def process_document_from_path(filepath):
         filename = os.path.basename(filepath)
         print(f"Processing document: {filename}")
         
-        # Extract text based on file type
         file_extension = os.path.splitext(filepath)[1].lower()
-        
-        if file_extension == '.pdf':
-            text = extract_text_from_pdf(filepath)
-        elif file_extension == '.docx':
-            text = extract_text_from_docx(filepath)
-        elif file_extension == '.pptx':
-            text = extract_text_from_pptx(filepath)
-        else:
+        if file_extension not in SUPPORTED_EXTENSIONS:
             print(f"Unsupported file format: {file_extension}")
             return
-        
-        print(f"Text extracted successfully from {filepath}. Text length: {len(text)}")
-        
-        # Chunk the text
-        chunks = chunk_text_simple(text, chunk_size=1000, overlap=100)
-        chunk_count = len(chunks)
-        print(f"Text split into {chunk_count} chunks.")
-        
-        # Store chunks in FAISS index
-        success_count = store_in_faiss(chunks, filename)
-        
-        print(f"Successfully stored {success_count} out of {chunk_count} chunks in FAISS index.")
+
+        # Pages are extracted, chunked, encoded and written as they are read
+        cache_counts = {}
+        timings = {}
+        batch = IngestionBatch(cache_counts=cache_counts)
+        try:
+            chunk_count = batch.add_document(filename, iter_document_chunks(filepath, timings=timings))
+            print(f"Text split into {chunk_count} chunks.")
+            success_count = batch.commit()
+        except Exception:
+            batch.abort()
+            raise
+        observe_extraction(timings)
+        print(f"{filename}: {describe_cache_counts(cache_counts)}")
+
+        print(f"Successfully stored {success_count} new or changed chunks out of {chunk_count} in FAISS index.")
         return success_count
         
     except Exception as e:
@@ -354,258 +1361,981 @@ def start_document_observer():
     print(f"Started monitoring {DOCUMENTS_FOLDER} for new documents")
     return observer
 
-def extract_text_from_pdf(filepath):
-    """Extract text from a PDF file."""
-    text = ""
+def observe_extraction(timings):
+    """Record the extraction and chunking times collected by iter_document_chunks."""
+    for stage in ('extraction', 'chunking'):
+        if stage in timings:
+            metrics.observe_stage(stage, timings[stage])
+
+def build_chunk_metadata(chunk, filename, i, page=None):
+    """Build the metadata record stored alongside a chunk embedding."""
+    return {
+        'text': preview_text(chunk),
+        'full_text': chunk,
+        'source': filename,
+        'chunk_id': f"{filename}-chunk-{i}",
+        'chunk': i,
+        'page': page
+    }
+
+def encode_chunks(chunks, batch_size=EMBEDDING_BATCH_SIZE, progress=None, cache_counts=None):
+    """Encode chunks in batches, taking the ones already seen from the embedding cache.
+
+    Returns a float32 array of embeddings and the positions of the chunks
+    that were encoded; a failing batch is skipped without losing the others.
+    ``progress``, if given, is called with the number of chunks handled so far.
+    ``cache_counts``, if given, is a dict whose 'hits' and 'misses' are
+    incremented, so callers can report the hit ratio of a whole run.
+    """
+    embeddings = np.empty((len(chunks), embedding_dimension), dtype='float32')
+    found = np.zeros(len(chunks), dtype=bool)
+    for i, vector in enumerate(embedding_cache.get_many(chunks)):
+        if vector is not None:
+            embeddings[i] = vector
+            found[i] = True
+    misses = np.nonzero(~found)[0]
+    if cache_counts is not None:
+        cache_counts['hits'] = cache_counts.get('hits', 0) + len(chunks) - len(misses)
+        cache_counts['misses'] = cache_counts.get('misses', 0) + len(misses)
+    if progress is not None and len(misses) < len(chunks):
+        progress(len(chunks) - len(misses))
+
+    # Only cache misses go through the model
+    for start in range(0, len(misses), batch_size):
+        batch_positions = misses[start:start + batch_size]
+        batch = [chunks[i] for i in batch_positions]
+        try:
+            with metrics.timed('embedding'):
+                batch_embeddings = get_embedding_model().encode(
+                    batch, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False
+                )
+            embeddings[batch_positions] = np.asarray(batch_embeddings, dtype='float32')
+            found[batch_positions] = True
+            embedding_cache.put_many(batch, embeddings[batch_positions])
+        except Exception as batch_error:
+            print(f"Error encoding chunks {batch_positions[0]}-{batch_positions[-1]}: {batch_error}")
+        if progress is not None:
+            progress(len(chunks) - len(misses) + start + len(batch))
+
+    return embeddings[found], np.nonzero(found)[0].tolist()
+
+def describe_cache_counts(cache_counts):
+    """Human-readable embedding cache hit ratio of an ingestion run."""
+    lookups = cache_counts.get('hits', 0) + cache_counts.get('misses', 0)
+    ratio = cache_counts.get('hits', 0) / lookups if lookups else 0.0
+    return f"{cache_counts.get('hits', 0)}/{lookups} chunks from the embedding cache ({ratio:.0%} hit ratio)"
+
+class IngestionBatch:
+    """Documents streamed into one new store segment and committed together.
+
+    Each chunk is matched against the stored version of its document as it
+    arrives: unchanged chunks are skipped, chunks whose text is already
+    stored reuse that vector, and the others are encoded in batches of
+    ``batch_size`` (through the embedding cache). Vectors go straight to a
+    SegmentWriter, so only one batch of chunks is held in memory whatever the
+    size of the documents. ``commit`` tombstones the stored chunks that are
+    gone, adds the new ones to a copy of the index and publishes it.
+
+    The lock of every document is held from ``add_document`` until the batch
+    is committed or aborted, so two versions of a document are never diffed
+    against the same stored chunks. The batch writes to ``collection`` (the
+    default one if None), which stays loaded until then.
+    """
+
+    def __init__(self, batch_size=EMBEDDING_BATCH_SIZE, cache_counts=None, collection=None):
+        self.batch_size = batch_size
+        self.cache_counts = {} if cache_counts is None else cache_counts
+        self.collection = collection or default_collection
+        self.collection.pin()
+        try:
+            ensure_index(self.collection)
+            self.store = self.collection.vector_store
+            self.writer = self.store.segment_writer()
+        except Exception:
+            self.collection.unpin()
+            raise
+        self.filenames = []
+        self.documents = {}   # catalog fields of each document, see SegmentStore.commit
+        self.locks = {}   # filename -> document lock held until commit or abort
+        self.stale_ids = []
+        self.to_encode = []   # records waiting for the next encoding batch
+        self.to_reuse = []    # (stored chunk id, record) waiting to be copied
+        self.chunks_encoded = 0
+
+    def add_document(self, filename, chunks, progress=None):
+        """Add (page, chunk) pairs of one document, in order; returns the number of chunks.
+
+        ``progress``, if given, is called with (last page read, chunks read)
+        each time a page is done.
+        """
+        if filename not in self.locks:
+            self.lock_document(filename)
+        self.filenames.append(filename)
+
+        diff = ChunkDiff(self.store.metadata.source_digests(filename))
+        content_hash = hashlib.md5()
+        count = 0
+        page = previous_page = None
+        for count, (page, chunk) in enumerate(chunks, start=1):
+            if progress is not None and count > 1 and page != previous_page:
+                progress(previous_page, count - 1)
+            previous_page = page
+            content_hash.update(chunk.encode('utf-8') + b'\0')
+            status, chunk_id = diff.match(count - 1, chunk)
+            if status == 'kept':
+                continue
+            record = build_chunk_metadata(chunk, filename, count - 1, page)
+            if status == 'reused':
+                self.to_reuse.append((chunk_id, record))
+            else:
+                self.to_encode.append(record)
+            if len(self.to_encode) >= self.batch_size or len(self.to_reuse) >= self.batch_size:
+                self.flush()
+        self.stale_ids.extend(diff.stale())
+        self.documents[filename] = {'content_hash': content_hash.hexdigest()}
+        if progress is not None:
+            progress(page, count)
+        return count
+
+    def lock_document(self, filename, blocking=True):
+        """Take the lock of a document for the batch, before ``add_document``.
+
+        Returns False when ``blocking`` is false and another batch holds it:
+        a batch holding locks must not wait for another one, which may be
+        waiting for its locks in turn.
+        """
+        lock = document_lock(filename, self.collection)
+        if not lock.acquire(blocking=blocking):
+            return False
+        self.locks[filename] = lock
+        return True
+
+    def flush(self):
+        """Encode or copy the buffered chunks and write them to the segment."""
+        if self.to_reuse:
+            stored_ids = [chunk_id for chunk_id, _ in self.to_reuse]
+            vectors = self.store.get_vectors(stored_ids)
+            with metrics.timed('persistence'):
+                self.writer.write(vectors, [record for _, record in self.to_reuse])
+            self.to_reuse = []
+        if self.to_encode:
+            embeddings, positions = encode_chunks(
+                [record['full_text'] for record in self.to_encode],
+                batch_size=self.batch_size, cache_counts=self.cache_counts
+            )
+            with metrics.timed('persistence'):
+                self.writer.write(embeddings, [self.to_encode[position] for position in positions])
+            self.chunks_encoded += len(positions)
+            self.to_encode = []
+
+    def commit(self):
+        """Persist the batch and publish a snapshot with it. Returns the number of chunks written."""
+        try:
+            self.flush()
+            with self.collection.write_lock:
+                written = write_changes(self.writer, self.stale_ids, self.documents, self.collection)
+        except Exception:
+            self.abort()
+            raise
+        self._release()
+        if self.collection is default_collection:
+            query_cache.invalidate_sources(set(self.filenames))
+        return written
+
+    def abort(self):
+        """Drop everything written by the batch."""
+        if self.writer is not None:
+            self.writer.abort()
+        self._release()
+
+    def _release(self):
+        for lock in self.locks.values():
+            lock.release()
+        self.locks = {}
+        if self.writer is not None:
+            # Committed or aborted: the collection may be unloaded again
+            self.writer = None
+            self.collection.unpin()
+
+def write_changes(writer, stale_ids, documents=None, collection=None):
+    """Commit a segment and tombstones, apply them to another copy of the index and publish it.
+
+    ``writer`` may be None when chunks are only removed; ``documents`` are
+    catalog fields for the store. Must be called with the write lock of the
+    collection held. Returns the number of chunks added.
+    """
+    collection = collection or default_collection
+    store = collection.vector_store
+    current = current_snapshot(collection)
+    with metrics.timed('persistence'):
+        ids = store.commit(writer, stale_ids, documents)
+    change = (np.asarray(stale_ids, dtype='int64'), ids)
+
+    with metrics.timed('index_add'):
+        removed = current.removed
+        if len(change[0]) and not supports_removal(current.index):
+            # HNSW graphs cannot drop vectors: searches skip them until too many are left
+            removed = np.union1d(removed, change[0])
+            if len(removed) > HNSW_MAX_REMOVED_FRACTION * current.index.ntotal:
+                next_index = build_index_from_store(target_index_type(store.count), collection)
+                publish_snapshot(next_index, store.metadata, collection)
+                return len(ids)
+        next_index = writable_index(current)
+        apply_index_change(next_index, change, store)
+        resized_index = index_for_corpus_size(next_index, collection)
+    if resized_index is not next_index:
+        publish_snapshot(resized_index, store.metadata, collection)
+    else:
+        published = publish_snapshot(next_index, store.metadata, collection, removed)
+        # The index searched until now is written to by the next commit, once no search uses it
+        published.spare = IndexSpare(current.index, current, change)
+    return len(ids)
+
+def writable_index(current):
+    """A copy of the index of ``current`` that no search uses, for the next snapshot.
+
+    The index of the snapshot ``current`` replaced is brought up to date and
+    reused when no search holds that snapshot anymore; otherwise the current
+    index is cloned. Commits therefore cost the size of their changes, not
+    of the corpus, at the price of keeping two copies of the index in memory.
+    """
+    spare, current.spare = current.spare, None
+    if spare is not None and spare.owner() is None:
+        # The chunks it misses are all live in the metadata of ``current``
+        apply_index_change(spare.index, spare.change, current.metadata)
+        return spare.index
+    return apply_search_params(faiss.clone_index(current.index), INDEX_PARAMS)
+
+def apply_index_change(faiss_index, change, store):
+    """Remove the stale ids and add the new ids of a commit to an index.
+
+    New vectors are read back from ``store`` (anything with ``get_vectors``).
+    Stale ids are left in indexes that cannot drop vectors.
+    """
+    stale_ids, ids = change
+    if len(stale_ids) and supports_removal(faiss_index):
+        faiss_index.remove_ids(stale_ids)
+    for start in range(0, len(ids), INDEX_ADD_BATCH_SIZE):
+        batch_ids = ids[start:start + INDEX_ADD_BATCH_SIZE]
+        faiss_index.add_with_ids(store.get_vectors(batch_ids), batch_ids)
+
+def delete_document(filename, collection=None):
+    """Remove every chunk of a document from the index and the vector store of a collection.
+
+    Returns the number of chunks removed.
+    """
+    collection = collection or default_collection
+    collection.pin()
     try:
-        doc = fitz.open(filepath)
-        for page in doc:
-            text += page.get_text()
-        return text
-    except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
-        raise Exception(f"Failed to extract text from PDF: {e}")
+        ensure_index(collection)
+        with document_lock(filename, collection), collection.write_lock:
+            stale_ids = collection.vector_store.metadata.source_ids(filename)
+            if not stale_ids:
+                return 0
+            write_changes(None, stale_ids, collection=collection)
+    finally:
+        collection.unpin()
+
+    if collection is default_collection:
+        query_cache.invalidate_sources({filename})
+    print(f"Removed {len(stale_ids)} chunks of {filename} from the index of collection {collection.name}.")
+    return len(stale_ids)
 
-def extract_text_from_docx(filepath):
-    """Extract text from a Word document."""
-    text = ""
+def store_in_faiss(chunks, filename, batch_size=EMBEDDING_BATCH_SIZE):
+    """Store processed chunks in FAISS index, encoding only the chunks that changed."""
+    cache_counts = {}
+    batch = IngestionBatch(batch_size=batch_size, cache_counts=cache_counts)
     try:
-        doc = docx.Document(filepath)
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-        
-        # Extract text from tables as well
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text += cell.text + " "
-                text += "\n"
-        
-        return text
-    except Exception as e:
-        print(f"Error extracting text from DOCX: {e}")
-        raise Exception(f"Failed to extract text from DOCX: {e}")
+        batch.add_document(filename, ((None, chunk) for chunk in chunks))
+        written = batch.commit()
+    except Exception:
+        batch.abort()
+        raise
+    if cache_counts.get('hits') or cache_counts.get('misses'):
+        print(f"{filename}: {describe_cache_counts(cache_counts)}")
+    return written
+
+def run_ingestion_job(job, progress):
+    """Ingest one uploaded document for the background job queue.
 
-def extract_text_from_pptx(filepath):
-    """Extract text from a PowerPoint presentation."""
-    text = ""
+    The document is read, chunked, encoded and written one page at a time,
+    into the job's collection; progress is reported in pages when the page
+    count is known upfront. Files of the default collection are registered
+    as processed only once ingested, and unregistered if the job fails, so
+    the folder watcher and the startup indexing retry them.
+    """
+    registered = not job.get('collection') or job['collection'] == DEFAULT_COLLECTION
     try:
-        pres = Presentation(filepath)
-        for slide in pres.slides:
-            text += f"Slide {pres.slides.index(slide) + 1}:\n"
-            
-            # Extract text from shapes (includes text boxes)
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-            
-            # Add separator between slides
-            text += "\n" + "-"*40 + "\n"
-        
-        return text
-    except Exception as e:
-        print(f"Error extracting text from PPTX: {e}")
-        raise Exception(f"Failed to extract text from PPTX: {e}")
+        result = ingest_job_file(job, progress)
+    except Exception:
+        if registered:
+            unregister_processed_file(job['filepath'], job['content_hash'])
+        raise
+    if registered:
+        register_processed_file(job['filepath'], job['content_hash'])
+    return result
 
-def process_document(filepath):
-    """Process document based on file extension."""
-    file_extension = os.path.splitext(filepath)[1].lower()
-    
-    if file_extension == '.pdf':
-        return extract_text_from_pdf(filepath)
-    elif file_extension == '.docx':
-        return extract_text_from_docx(filepath)
-    elif file_extension == '.pptx':
-        return extract_text_from_pptx(filepath)
+def ingest_job_file(job, progress):
+    """Ingest the file of an ingestion job; returns the job's result."""
+    filepath = job['filepath']
+    filename = job['filename']
+    collection = get_collection(job.get('collection') or DEFAULT_COLLECTION, create=True)
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"Uploaded file {filepath} no longer exists")
+
+    progress(stage='extracting')
+    pages_total = page_count(filepath)
+
+    progress(stage='embedding', pages_total=pages_total, pages_processed=0, chunks_processed=0)
+    cache_counts = {}
+    timings = {}
+    batch = IngestionBatch(cache_counts=cache_counts, collection=collection)
+    try:
+        chunk_count = batch.add_document(
+            filename, iter_document_chunks(filepath, timings=timings),
+            progress=lambda page, chunks: progress(pages_processed=page or 0, chunks_processed=chunks)
+        )
+        print(f"Text split into {chunk_count} chunks.")
+
+        progress(stage='indexing')
+        success_count = batch.commit()
+    except Exception:
+        batch.abort()
+        raise
+    observe_extraction(timings)
+    print(f"{filename}: {describe_cache_counts(cache_counts)}")
+    print(f"Successfully stored {success_count} new or changed chunks out of {chunk_count} in FAISS index.")
+    return {
+        'chunks': chunk_count,
+        'pages': pages_total,
+        'chunks_encoded': batch.chunks_encoded,
+        'chunks_stored': success_count,
+        'embedding_cache_hits': cache_counts.get('hits', 0),
+        'embedding_cache_misses': cache_counts.get('misses', 0),
+    }
+
+def ingest_documents(filepaths, workers=INGEST_WORKERS, batch_size=EMBEDDING_BATCH_SIZE, cache_counts=None):
+    """Index many documents with a pipelined ingestion engine.
+
+    Extraction and chunking run in a process pool across cores and spool
+    their chunks to temporary files. A single model thread streams the
+    spooled chunks of the ready documents into one IngestionBatch, encoding
+    chunks from several documents per model batch, and a single writer
+    thread commits the batches, so index writes stay serialized. Returns the
+    number of documents indexed; embedding cache hits and misses of the run
+    are added to ``cache_counts`` if given.
+    """
+    cache_counts = {} if cache_counts is None else cache_counts
+    embed_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    indexed = []
+    spool_dir = tempfile.mkdtemp(prefix='ingest-')
+
+    def embed_worker():
+        batch = None
+        try:
+            while True:
+                document = embed_queue.get()
+                if document is None:
+                    break
+                filename, spool_path, _ = document
+                if batch is not None and (filename in batch.filenames or not batch.lock_document(filename, blocking=False)):
+                    # The same document twice, whose first version must be committed before diffing
+                    # again, or one held by another ingestion: the batch is committed before waiting,
+                    # so two ingestions never wait for each other's documents
+                    write_queue.put(batch)
+                    batch = None
+                if batch is None:
+                    batch = IngestionBatch(batch_size=batch_size, cache_counts=cache_counts)
+                try:
+                    batch.add_document(filename, read_spool(spool_path))
+                except Exception as e:
+                    # Part of the document may already be in the segment, so the whole batch is dropped
+                    print(f"Error encoding {', '.join(batch.filenames)}: {e}")
+                    batch.abort()
+                    batch = None
+                    continue
+                finally:
+                    os.remove(spool_path)
+
+                # Commit every document that is ready as one new snapshot
+                if embed_queue.empty() or len(batch.filenames) >= INGEST_QUEUE_SIZE:
+                    write_queue.put(batch)
+                    batch = None
+            if batch is not None:
+                write_queue.put(batch)
+                batch = None
+        finally:
+            if batch is not None:
+                batch.abort()
+            write_queue.put(None)
+
+    def write_worker():
+        while True:
+            batch = write_queue.get()
+            if batch is None:
+                break
+            try:
+                success_count = batch.commit()
+                indexed.extend(batch.filenames)
+                print(f"Successfully stored {success_count} new or changed chunks from {len(batch.filenames)} documents in FAISS index.")
+            except Exception as e:
+                print(f"Error storing {', '.join(batch.filenames)}: {e}")
+
+    threads = [
+        threading.Thread(target=embed_worker, name='ingest-embed', daemon=True),
+        threading.Thread(target=write_worker, name='ingest-write', daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(extract_and_spool, filepath, spool_dir): filepath for filepath in filepaths}
+            for future in as_completed(futures):
+                try:
+                    filename, spool_path, chunk_count, timings = future.result()
+                except Exception as e:
+                    print(f"Error processing {futures[future]}: {e}")
+                    continue
+                observe_extraction(timings)
+                print(f"Extracted {chunk_count} chunks from {filename}")
+                embed_queue.put((filename, spool_path, chunk_count))
+    finally:
+        embed_queue.put(None)
+        for thread in threads:
+            thread.join()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    print(f"Indexed {len(indexed)} documents: {describe_cache_counts(cache_counts)}")
+    return len(indexed)
+
+def encode_queries(queries):
+    """Embed several queries in one forward pass, as an (n, dimension) float32 array."""
+    return np.asarray(get_embedding_model().encode(queries, batch_size=max(len(queries), 1)), dtype='float32')
+
+def search_dense_batch(requests):
+    """Run one FAISS search for several (query embedding, k) requests.
+
+    Every request is answered from the same snapshot, which is returned with
+    its results: (snapshot, distances, chunk ids).
+    """
+    current = current_snapshot()
+    k = max(k for _, k in requests)
+    D, I = current.search(np.stack([embedding for embedding, _ in requests]), k)
+    return [(current, D[i, :request_k], I[i, :request_k]) for i, (_, request_k) in enumerate(requests)]
+
+query_encoder = MicroBatcher(encode_queries, max_batch_size=QUERY_BATCH_SIZE,
+                             max_wait_ms=QUERY_BATCH_WAIT_MS, name='query-encoder')
+# Queries leave the encoder together, so the searcher batches what is pending without waiting
+dense_searcher = MicroBatcher(search_dense_batch, max_batch_size=QUERY_BATCH_SIZE,
+                              max_wait_ms=0, name='dense-searcher')
+
+def encode_query(query):
+    """Embed a query as a (1, dimension) float32 array ready for FAISS."""
+    return query_encoder.submit(query)[None, :]
+
+def cached_chat_result(query, history=None, filters=None, collections=None):
+    """Look up a cached answer for a query.
+
+    Returns (result, query_embedding). On a miss result is None and the query
+    embedding computed for the semantic lookup is returned so it can be reused
+    for retrieval. Answers that depend on a chat history, on retrieval
+    filters or on named collections are never cached.
+    """
+    if history or filters or collections or not query_cache.enabled:
+        return None, None
+    with metrics.timed('cache_lookup'):
+        result = query_cache.get_exact(query)
+    if result is not None:
+        return result, None
+    with metrics.timed('query_encode'):
+        query_embedding = encode_query(query)
+    with metrics.timed('semantic_cache_lookup'):
+        result = query_cache.get_semantic(query_embedding[0])
+    return result, query_embedding
+
+def cache_chat_result(query, query_embedding, result, compute_seconds):
+    """Store a freshly generated answer in the query cache."""
+    if query_embedding is None or not result['response'] or result['response'] == OLLAMA_ERROR_MESSAGE:
+        return
+    sources = {context['source'] for context in result['contexts']}
+    query_cache.put(query, query_embedding[0], result, sources, compute_seconds)
+
+def parse_filters(data):
+    """Read the optional "sources" (document names) and "formats" filters of a request body.
+
+    Returns (filters, error message); filters is None when the body has none.
+    """
+    sources = data.get('sources')
+    formats = data.get('formats')
+    if sources is None and formats is None:
+        return None, None
+    if sources is not None and (not isinstance(sources, list) or len(sources) > MAX_FILTER_SOURCES
+                                or not all(isinstance(source, str) for source in sources)):
+        return None, f'sources must be a list of at most {MAX_FILTER_SOURCES} document names'
+    if formats is not None:
+        if not isinstance(formats, list) or not all(isinstance(f, str) for f in formats):
+            return None, f"formats must be a list of: {', '.join(FILTER_FORMATS)}"
+        formats = [f.lower().lstrip('.') for f in formats]
+        if not all(f in FILTER_FORMATS for f in formats):
+            return None, f"formats must be a list of: {', '.join(FILTER_FORMATS)}"
+    return {'sources': sources, 'formats': formats}, None
+
+def parse_collections(data):
+    """Read the optional "collections" of a request body: names of the collections to search.
+
+    Returns (collections, error message); collections is None when the body
+    names none, and the default collection is then searched alone.
+    """
+    names = data.get('collections')
+    if names is None:
+        return None, None
+    if (not isinstance(names, list) or not 1 <= len(names) <= MAX_SEARCH_COLLECTIONS
+            or not all(isinstance(name, str) for name in names)):
+        return None, f'collections must be a list of 1 to {MAX_SEARCH_COLLECTIONS} collection names'
+    collections = []
+    for name in dict.fromkeys(names):
+        collection = get_collection(name) if COLLECTION_NAME_PATTERN.match(name) else None
+        if collection is None:
+            return None, f"Unknown collection '{name}'"
+        collections.append(collection)
+    return collections, None
+
+def filtered_ids(current, filters):
+    """Sorted ids of the chunks of a snapshot's documents that match the filters."""
+    catalog = current.metadata.catalog
+    if filters.get('sources') is not None:
+        names = [name for name in filters['sources'] if name in catalog]
     else:
-        raise ValueError(f"Unsupported file format: {file_extension}")
+        names = current.metadata.catalog_names
+    if filters.get('formats') is not None:
+        names = [name for name in names if os.path.splitext(name)[1].lower().lstrip('.') in filters['formats']]
+    return current.metadata.ids_of_sources(names)
 
+def search_dense_filtered(current, embedding, k, allowed):
+    """Dense search restricted to the chunks in ``allowed`` (sorted ids).
 
-def chunk_text_simple(text, chunk_size=1000, overlap=100):
-    """Split text into overlapping chunks with a simpler method."""
-    chunks = []
-    start = 0
-    text_length = len(text)
-    
-    # If text is very short, return it as is
-    if text_length <= chunk_size:
-        return [text]
-    
-    while start < text_length:
-        # Determine the end of current chunk
-        end = min(start + chunk_size, text_length)
-        
-        # Add chunk to results
-        current_chunk = text[start:end]
-        chunks.append(current_chunk)
-        
-        # Calculate start of next chunk with overlap
-        start = start + chunk_size - overlap
-    
-    return chunks
+    Up to FILTER_EXACT_MAX chunks, the query is compared with each of their
+    stored vectors, so the cost follows the size of the subset, not of the
+    corpus. Larger subsets are searched in the FAISS index with an id
+    selector. Returns (distances, ids) like one row of a FAISS search.
+    """
+    if len(allowed) <= FILTER_EXACT_MAX:
+        k = min(k, len(allowed))
+        D, I = faiss.knn(embedding[None, :], current.metadata.get_vectors(allowed), k)
+        return D[0], allowed[I[0]]
+    selector = faiss.IDSelectorBatch(allowed)
+    params = filtered_search_params(current.index, selector, len(allowed) / max(current.ntotal, 1))
+    D, I = current.index.search(embedding[None, :], k, params=params)
+    return D[0], I[0]
 
-def store_in_faiss(chunks, filename):
-    """Store processed chunks in FAISS index."""
-    global index, metadata
-    
-    success_count = 0
-    for i, chunk in enumerate(chunks):
+def retrieval_candidates(top_k, mode):
+    """Number of chunks each retriever returns for a search of ``top_k`` chunks."""
+    if mode not in ('dense', 'lexical', 'hybrid'):
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Allowed modes: dense, lexical, hybrid")
+    return max(top_k, HYBRID_CANDIDATES) if mode == 'hybrid' else top_k
+
+def search_chunks(current, query, query_embedding, top_k, mode=None, dense_results=None, allowed=None):
+    """Find the best chunks for a query in a snapshot.
+
+    Returns a list of (chunk id, L2 distance to the query, retrievers that
+    found it), best first. In hybrid mode the dense and BM25 rankings of
+    HYBRID_CANDIDATES chunks each are fused with reciprocal rank fusion.
+    ``dense_results`` are the (distances, ids) of a FAISS search already run
+    on ``current``, e.g. by ``dense_searcher``. ``allowed`` (sorted chunk
+    ids, see ``filtered_ids``) restricts both retrievers to those chunks.
+    """
+    mode = mode or RETRIEVAL_MODE
+    candidates = retrieval_candidates(top_k, mode)
+
+    rankings = {}
+    distances = {}
+    if mode != 'lexical':
+        if dense_results is None and allowed is not None:
+            dense_results = search_dense_filtered(current, query_embedding[0], candidates, allowed)
+        elif dense_results is None:
+            D, I = current.search(query_embedding, candidates)
+            dense_results = D[0], I[0]
+        D, I = dense_results
+        found = I >= 0
+        rankings['dense'] = I[found].tolist()
+        distances.update(zip(rankings['dense'], D[found].tolist()))
+    if mode != 'dense':
+        rankings['lexical'] = current.lexical.search(query, candidates, allowed)[0].tolist()
+    fused = [chunk_id for chunk_id, _ in reciprocal_rank_fusion(rankings.values(), k=RRF_K)[:top_k]]
+
+    # Chunks only found by BM25 still get a distance, computed from their stored vector
+    missing = [chunk_id for chunk_id in fused if chunk_id not in distances]
+    if missing and query_embedding is not None:
         try:
-            # Generate embedding
-            embedding = embedding_model.encode([chunk])[0]
-            
-            # Convert to the format FAISS needs
-            embedding_np = np.array([embedding]).astype('float32')
-            
-            # Add to FAISS index
-            index.add(embedding_np)
-            
-            # Store metadata
-            chunk_id = f"{filename}-chunk-{i}"
-            # Truncate text for metadata
-            truncated_text = chunk[:500] if len(chunk) > 500 else chunk
-            # Clean text of non-ASCII characters
-            clean_text = ''.join(char for char in truncated_text if ord(char) < 128)
-            
-            metadata.append({
-                'text': clean_text, 
-                'full_text': chunk,
-                'source': filename, 
-                'chunk_id': chunk_id
+            vectors = current.metadata.get_vectors(missing)
+            distances.update(zip(missing, np.sum((vectors - query_embedding[0]) ** 2, axis=1).tolist()))
+        except (KeyError, OSError) as e:
+            print(f"Could not compute distances of lexical hits: {e}")
+
+    return [
+        (chunk_id, distances.get(chunk_id), [name for name, ranking in rankings.items() if chunk_id in ranking])
+        for chunk_id in fused
+    ]
+
+def retrieve(queries, top_k=3, mode=None, query_embeddings=None, rerank=None, filters=None, collections=None):
+    """Retrieve the contexts of several queries.
+
+    Query encoding and FAISS searches go through the micro-batchers, so they
+    are shared with the queries of concurrent requests. With re-ranking
+    (RERANK_ENABLED unless ``rerank`` says otherwise), RERANK_CANDIDATES
+    chunks are fetched per query and the cross-encoder keeps the ``top_k``
+    best. ``filters`` (see ``parse_filters``) restrict the search to some
+    documents. ``collections`` (see ``parse_collections``) are searched
+    instead of the default collection, see ``search_collections``. Returns
+    one list of contexts per query.
+    """
+    mode = mode or RETRIEVAL_MODE
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    fetch_k = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+    candidates = retrieval_candidates(fetch_k, mode)
+    if mode != 'lexical' and query_embeddings is None:
+        with metrics.timed('query_encode'):
+            query_embeddings = np.stack(query_encoder.submit_many(list(queries)))
+    if collections is not None:
+        with metrics.timed('search'):
+            results = search_collections(collections, list(queries), query_embeddings, fetch_k, mode, filters)
+    elif filters:
+        # Filtered searches depend on the subset, they are not batched with other queries
+        with metrics.timed('filtered_search'):
+            current = current_snapshot()
+            allowed = filtered_ids(current, filters)
+            results = [
+                contexts_for_hits(current, search_chunks(
+                    current, query, query_embeddings[i][None, :] if mode != 'lexical' else None,
+                    fetch_k, mode=mode, allowed=allowed
+                )) if len(allowed) else []
+                for i, query in enumerate(queries)
+            ]
+    elif mode == 'lexical':
+        with metrics.timed('search'):
+            current = current_snapshot()
+            results = [contexts_for_hits(current, search_chunks(current, query, None, fetch_k, mode=mode))
+                       for query in queries]
+    else:
+        with metrics.timed('search'):
+            dense = dense_searcher.submit_many([(embedding, candidates) for embedding in query_embeddings])
+            results = []
+            for query, embedding, (current, D, I) in zip(queries, query_embeddings, dense):
+                # The lexical side searches the snapshot the dense results come from
+                hits = search_chunks(current, query, embedding[None, :], fetch_k, mode=mode, dense_results=(D, I))
+                results.append(contexts_for_hits(current, hits))
+
+    if rerank:
+        try:
+            with metrics.timed('rerank'):
+                return reranker.rerank(list(queries), results, top_k)
+        except Exception as e:
+            # Re-ranking is an optional refinement; first-stage results are still good answers
+            print(f"Re-ranking failed, using first-stage ranking: {e}")
+    return [contexts[:top_k] for contexts in results]
+
+def search_collection(collection, queries, query_embeddings, k, mode, filters=None):
+    """The ``k`` best contexts of several queries in one collection, tagged with its name.
+
+    The dense side of unfiltered queries is one FAISS search for all of them.
+    """
+    with metrics.timed('collection_search'):
+        current = current_snapshot(collection)
+        allowed = filtered_ids(current, filters) if filters else None
+        if allowed is not None and not len(allowed):
+            return [[] for _ in queries]
+        dense = None
+        if mode != 'lexical' and allowed is None and current.ntotal:
+            dense = current.search(query_embeddings, retrieval_candidates(k, mode))
+        results = []
+        for i, query in enumerate(queries):
+            hits = search_chunks(
+                current, query, query_embeddings[i][None, :] if mode != 'lexical' else None, k, mode=mode,
+                dense_results=(dense[0][i], dense[1][i]) if dense is not None else None, allowed=allowed
+            )
+            results.append([dict(context, collection=collection.name) for context in contexts_for_hits(current, hits)])
+        return results
+
+def search_collections(collections, queries, query_embeddings, k, mode, filters=None):
+    """Search several collections in parallel and merge their results.
+
+    Each collection is searched in the fan-out thread pool (FAISS and numpy
+    release the GIL while searching). The ``k`` contexts of each query with
+    the smallest distance across collections are kept; contexts without a
+    distance (lexical mode) follow, by their rank in their own collection.
+    """
+    if len(collections) == 1:
+        per_collection = [search_collection(collections[0], queries, query_embeddings, k, mode, filters)]
+    else:
+        # Stage timings of the pool threads go to the trace of this request
+        futures = [
+            fanout_pool.submit(contextvars.copy_context().run, search_collection,
+                               collection, queries, query_embeddings, k, mode, filters)
+            for collection in collections
+        ]
+        per_collection = [future.result() for future in futures]
+    merged = []
+    for i in range(len(queries)):
+        ranked = sorted(
+            ((context['similarity'] is None, context['similarity'] or 0.0, rank), position, context)
+            for position, results in enumerate(per_collection) for rank, context in enumerate(results[i])
+        )
+        merged.append([context for _, _, context in ranked[:k]])
+    return merged
+
+fanout_pool = ThreadPoolExecutor(max_workers=max(1, FANOUT_WORKERS), thread_name_prefix='collection-search')
+
+def contexts_for_hits(current, hits):
+    """Turn the hits of ``search_chunks`` into the contexts returned to the client."""
+    contexts = []
+    for idx, distance, matched_by in hits:
+        doc = current.metadata.get(idx)
+        if doc is not None:  # Check if index is valid
+            contexts.append({
+                'content': doc['full_text'],
+                'source': doc['source'],
+                'chunk_id': doc['chunk_id'],
+                'chunk': doc.get('chunk'),
+                'page': doc['page'],
+                'similarity': float(distance) if distance is not None else None,
+                'matched_by': matched_by
             })
-            
-            success_count += 1
-            
-        except Exception as chunk_error:
-            print(f"Error storing chunk {i}: {chunk_error}")
-    
-    # Save updated index and metadata
-    with open(INDEX_PATH, 'wb') as f:
-        pickle.dump(index, f)
-    with open(METADATA_PATH, 'wb') as f:
-        pickle.dump(metadata, f)
-        
-    return success_count
+    return contexts
+
+def build_augmented_query(query, source_knowledge):
+    """The prompt asking the LLM to answer a query from the given contexts."""
+    return f"""En utilisant UNIQUEMENT les contextes ci-dessous, réponds à la requête. 
+Si les contextes ne contiennent pas d'information pertinente pour répondre à la requête, indique que tu n'as pas suffisamment d'informations.
+
+Contextes:
+{source_knowledge}
+
+Requête: {query}"""
 
-def augment_prompt(query, top_k=3):
-    """Augment user query with context from FAISS."""
+def augment_prompt(query, top_k=3, query_embedding=None, filters=None, collections=None):
+    """Augment user query with context from FAISS and the BM25 index."""
     try:
-        # Generate embedding for query
-        query_embedding = embedding_model.encode([query])[0]
-        query_embedding_np = np.array([query_embedding]).astype('float32')
-        
-        # Search FAISS index
-        D, I = index.search(query_embedding_np, top_k)
-        
-        # Process results
-        contexts = []
-        for i, idx in enumerate(I[0]):
-            if idx < len(metadata) and idx >= 0:  # Check if index is valid
-                doc = metadata[idx]
-                contexts.append({
-                    'content': doc['full_text'],
-                    'source': doc['source'],
-                    'chunk_id': doc['chunk_id'],
-                    'similarity': float(D[0][i])
-                })
+        # Reuse the query embedding when the caller already has it
+        contexts = retrieve([query], top_k, query_embeddings=query_embedding, filters=filters,
+                            collections=collections)[0]
         
         # Check if contexts were found
         if not contexts:
             print("No relevant contexts found in FAISS.")
             return f"Réponds à cette requête: {query}", []
         
-        # Build context from results
-        context_texts = []
-        for i, doc in enumerate(contexts):
-            context_texts.append(f"Document {i+1} (Source: {doc['source']}):\n{doc['content']}")
+        # Deduplicate, merge adjacent chunks and fit the result in the token budget
+        with metrics.timed('packing'):
+            passages, stats = pack_contexts(contexts, CONTEXT_TOKEN_BUDGET)
+        source_knowledge = "\n\n".join(format_passage(i + 1, passage) for i, passage in enumerate(passages))
+        print(f"Found {len(contexts)} relevant contexts for query, packed into {stats['passages']} passages: "
+              f"{stats['tokens']} tokens instead of {stats['unpacked_tokens']} (budget {CONTEXT_TOKEN_BUDGET})")
         
-        source_knowledge = "\n\n".join(context_texts)
-        print(f"Found {len(contexts)} relevant contexts for query.")
-        
-        augmented_query = f"""En utilisant UNIQUEMENT les contextes ci-dessous, réponds à la requête. 
-Si les contextes ne contiennent pas d'information pertinente pour répondre à la requête, indique que tu n'as pas suffisamment d'informations.
-
-Contextes:
-{source_knowledge}
-
-Requête: {query}"""
-        
-        return augmented_query, contexts
+        return build_augmented_query(query, source_knowledge), contexts
     except Exception as e:
         print(f"Error in augment_prompt: {e}")
         # Fallback to regular query without context
         return f"Réponds à cette requête: {query}", []
-import requests
+def build_ollama_payload(augmented_query, history=None, stream=False):
+    """Build the request body for Ollama's /api/generate endpoint."""
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": augmented_query,
+        "system": SYSTEM_MESSAGE,
+        "stream": stream
+    }
+
+    # Add chat history if provided; a conversation over the budget starts afresh
+    if history and isinstance(history, list):
+        if HISTORY_TOKEN_BUDGET and len(history) > HISTORY_TOKEN_BUDGET:
+            print(f"Dropping a conversation context of {len(history)} tokens (budget {HISTORY_TOKEN_BUDGET})")
+        else:
+            payload["context"] = history
+    return payload
+
+def clean_response(response_content):
+    """Remove the model's <think> block and surrounding whitespace from an answer."""
+    # Supprimer les balises <think> et </think> avec split() puis enlever les espaces inutiles
+    if "<think>" in response_content and "</think>" in response_content:
+        response_content = response_content.split("<think>")[0] + response_content.split("</think>")[-1]
+
+    # Supprimer les espaces avant et après la réponse
+    return response_content.strip()
 
 def generate_response_ollama(augmented_query, history=None):
     """Generate response using Ollama API."""
     try:
-        # Prepare the prompt with system message
-        system_message = "Vous êtes un assistant utile qui répond aux questions basées sur les contextes fournis. Si les contextes ne contiennent pas l'information demandée, indiquez clairement que vous ne pouvez pas répondre à la question avec les données dont vous disposez."
-        
         # Construct the payload for Ollama
-        payload = {
-            "model": "deepseek-r1:7b",
-            "prompt": augmented_query,
-            "system": system_message,
-            "stream": False
-        }
-        
-        # Add chat history if provided
-        if history and isinstance(history, list):
-            payload["context"] = history
-            print(payload)
+        payload = build_ollama_payload(augmented_query, history)
 
-        # Make the API call to Ollama
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json=payload
-        )
+        # Make the API call to Ollama over the shared keep-alive session
+        with metrics.timed('llm'):
+            response = ollama_session.post(
+                OLLAMA_URL, json=payload, timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)
+            )
         
         # Check if the request was successful
         if response.status_code == 200:
             result = response.json()
-            response_content = result.get("response", "")
-
-            # Supprimer les balises <think> et </think> avec split() puis enlever les espaces inutiles
-            if "<think>" in response_content and "</think>" in response_content:
-                response_content = response_content.split("<think>")[0] + response_content.split("</think>")[-1]
-
-            # Supprimer les espaces avant et après la réponse
-            response_content = response_content.strip()
-
+            with metrics.timed('think_strip'):
+                response_content = clean_response(result.get("response", ""))
             print(f"Response generated successfully.")
             return response_content
         else:
             print(f"Error from Ollama API: {response.status_code}, {response.text}")
-            return "Désolé, je n'ai pas pu générer une réponse. Veuillez réessayer."
+            return OLLAMA_ERROR_MESSAGE
             
     except Exception as e:
         print(f"Error generating response: {e}")
-        return "Désolé, je n'ai pas pu générer une réponse. Veuillez réessayer."
+        return OLLAMA_ERROR_MESSAGE
+
+class ThinkTagFilter:
+    """Drop <think>...</think> spans from text that arrives in pieces.
+
+    A tag may be split across several tokens, so a possible partial tag at the
+    end of the buffer is held back until the next piece arrives.
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False
+
+    def feed(self, text):
+        """Add streamed text and return the part that can be shown to the user."""
+        self.buffer += text
+        output = []
+        while True:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            position = self.buffer.find(tag)
+            if position >= 0:
+                if not self.in_think:
+                    output.append(self.buffer[:position])
+                self.buffer = self.buffer[position + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            # Keep the longest suffix that could be the start of the tag
+            keep = next((k for k in range(len(tag) - 1, 0, -1) if self.buffer.endswith(tag[:k])), 0)
+            if not self.in_think:
+                output.append(self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return self._strip_leading("".join(output))
+
+    def flush(self):
+        """Return whatever is left once the stream has ended."""
+        remaining = "" if self.in_think else self.buffer
+        self.buffer = ""
+        return self._strip_leading(remaining)
+
+    def _strip_leading(self, text):
+        # Like the non-streaming path, the answer should not start with whitespace
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+def stream_response_ollama(augmented_query, history=None):
+    """Stream a response from the Ollama API.
+
+    Yields ('token', text) for each visible piece of the answer, with
+    <think> spans removed, then ('done', info) where info holds the Ollama
+    context for the next turn. Errors are yielded as ('error', message).
+    """
+    payload = build_ollama_payload(augmented_query, history, stream=True)
+    think_filter = ThinkTagFilter()
+    start = time.perf_counter()
+    first_token = True
+    strip_seconds = 0.0
+    try:
+        with ollama_session.post(
+            OLLAMA_URL, json=payload, stream=True, timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)
+        ) as response:
+            if response.status_code != 200:
+                print(f"Error from Ollama API: {response.status_code}, {response.text}")
+                yield 'error', OLLAMA_ERROR_MESSAGE
+                return
+
+            # Ollama streams one JSON object per line
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                strip_start = time.perf_counter()
+                token = think_filter.feed(chunk.get("response", ""))
+                strip_seconds += time.perf_counter() - strip_start
+                if token:
+                    if first_token:
+                        first_token = False
+                        metrics.observe_stage('llm_first_token', time.perf_counter() - start)
+                    yield 'token', token
+                if chunk.get("done"):
+                    tail = think_filter.flush()
+                    if tail:
+                        yield 'token', tail
+                    metrics.observe_stage('llm', time.perf_counter() - start)
+                    metrics.observe_stage('think_strip', strip_seconds)
+                    yield 'done', {'context': chunk.get("context")}
+                    return
+    except Exception as e:
+        print(f"Error streaming response: {e}")
+        yield 'error', OLLAMA_ERROR_MESSAGE
+        return
+
+    tail = think_filter.flush()
+    if tail:
+        yield 'token', tail
+    yield 'done', {'context': None}
+
+
+# Background ingestion jobs for uploads and watched files, persisted under models/jobs
+# once started (see job_queue.start, called where the server starts)
+job_queue = JobQueue(JOBS_DIR, run_ingestion_job)
+# Bursts of events on the documents folder are coalesced before reaching the job queue
+watch_scheduler = DebouncedScheduler(handle_watched_files, WATCH_DEBOUNCE_SECONDS, name='document-watcher')
+
+
+def index_new_documents():
+    """Initial indexing at startup: ingest the documents folder files not processed yet."""
+    print("Performing initial indexing of documents folder...")
+    new_files = []
+    for filename in os.listdir(DOCUMENTS_FOLDER):
+        filepath = os.path.join(DOCUMENTS_FOLDER, filename)
+        if os.path.isfile(filepath) and not filename.startswith('.'):
+            file_extension = os.path.splitext(filepath)[1].lower()
+            if file_extension in ['.pdf', '.docx', '.pptx']:
+                if not is_file_processed(filepath):
+                    new_files.append(filepath)
+    save_processed_files()
+    if new_files:
+        ingest_documents(new_files)
 
 
 # Add this to your main function
 if __name__ == '__main__':
-    # Load existing processed files registry
-    load_processed_files()
-    
-    # Start the document observer in a background thread
-    observer = start_document_observer()
+    # With debug=True, the reloader parent only watches the source files and restarts
+    # the child, which serves requests: only the child loads the index and the
+    # registry, resumes upload jobs, watches the documents folder and indexes it
+    serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    observer = None
+    if serving:
+        # Load the index and the embedding model while the server starts
+        start_warmup()
+
+        # Load existing processed files registry
+        load_processed_files()
+
+        job_queue.start()
+        observer = start_document_observer()
     
     try:
-        # Initial indexing of documents in the folder at startup
-        print("Performing initial indexing of documents folder...")
-        for filename in os.listdir(DOCUMENTS_FOLDER):
-            filepath = os.path.join(DOCUMENTS_FOLDER, filename)
-            if os.path.isfile(filepath) and not filename.startswith('.'):
-                file_extension = os.path.splitext(filepath)[1].lower()
-                if file_extension in ['.pdf', '.docx', '.pptx']:
-                    if not is_file_processed(filepath):
-                        try:
-                            process_document_from_path(filepath)
-                        except Exception as e:
-                            print(f"Error during initial indexing of {filepath}: {e}")
+        if serving:
+            index_new_documents()
         
         # Start Flask app
         print("Starting Flask application...")
@@ -613,6 +2343,7 @@ if __name__ == '__main__':
     
     finally:
         # Stop the observer when the app is shutting down
-        observer.stop()
-        observer.join()
-        print("Document monitoring stopped")
\ No newline at end of file
+        if observer is not None:
+            observer.stop()
+            observer.join()
+            print("Document monitoring stopped")
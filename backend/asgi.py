@@ -0,0 +1,370 @@
+"""Asynchronous serving mode for the RAG chatbot API.
+
+The chat endpoints are served natively on the event loop:
+
+* retrieval (query embedding + FAISS search) runs in a thread pool,
+* Ollama is called through one pooled ``httpx.AsyncClient`` with timeouts,
+* at most LLM_MAX_CONCURRENCY generations run at once; further requests wait
+  in a queue of at most LLM_MAX_QUEUE entries and are rejected with 503 once
+  it is full.
+
+Every other route (upload, reindex, listing, ...) is served by the Flask app.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+import app as rag
+import metrics
+
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', 64))
+RETRIEVAL_WORKERS = int(os.environ.get('RETRIEVAL_WORKERS', 4))
+
+
+class QueueFullError(Exception):
+    """Raised when too many requests are already waiting for the LLM."""
+
+
+class LLMGateway:
+    """Pooled, concurrency-limited access to the Ollama API."""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.client = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(rag.OLLAMA_TIMEOUT, connect=rag.OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency
+            )
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def acquire(self):
+        """Wait for a generation slot, or raise QueueFullError if the queue is full."""
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            raise QueueFullError()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+    async def generate(self, augmented_query, history=None):
+        """Blocking-style generation; the caller must hold a slot."""
+        payload = rag.build_ollama_payload(augmented_query, history)
+        try:
+            with metrics.timed('llm'):
+                response = await self.client.post(rag.OLLAMA_URL, json=payload)
+            if response.status_code != 200:
+                print(f"Error from Ollama API: {response.status_code}, {response.text}")
+                return rag.OLLAMA_ERROR_MESSAGE
+            with metrics.timed('think_strip'):
+                return rag.clean_response(response.json().get("response", ""))
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return rag.OLLAMA_ERROR_MESSAGE
+
+    async def stream(self, augmented_query, history=None):
+        """Async counterpart of app.stream_response_ollama; the caller must hold a slot."""
+        payload = rag.build_ollama_payload(augmented_query, history, stream=True)
+        think_filter = rag.ThinkTagFilter()
+        start = time.perf_counter()
+        first_token = True
+        strip_seconds = 0.0
+        try:
+            async with self.client.stream('POST', rag.OLLAMA_URL, json=payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    print(f"Error from Ollama API: {response.status_code}, {response.text}")
+                    yield 'error', rag.OLLAMA_ERROR_MESSAGE
+                    return
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    strip_start = time.perf_counter()
+                    token = think_filter.feed(chunk.get("response", ""))
+                    strip_seconds += time.perf_counter() - strip_start
+                    if token:
+                        if first_token:
+                            first_token = False
+                            metrics.observe_stage('llm_first_token', time.perf_counter() - start)
+                        yield 'token', token
+                    if chunk.get("done"):
+                        tail = think_filter.flush()
+                        if tail:
+                            yield 'token', tail
+                        metrics.observe_stage('llm', time.perf_counter() - start)
+                        metrics.observe_stage('think_strip', strip_seconds)
+                        yield 'done', {'context': chunk.get("context")}
+                        return
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield 'error', rag.OLLAMA_ERROR_MESSAGE
+            return
+
+        tail = think_filter.flush()
+        if tail:
+            yield 'token', tail
+        yield 'done', {'context': None}
+
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+def trace_requested(scope):
+    """Whether the request carries the debug trace header."""
+    name = metrics.DEBUG_TRACE_HEADER.lower().encode()
+    return any(key == name and value for key, value in scope['headers'])
+
+
+async def read_json(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return json.loads(body or b'{}')
+
+
+async def send_json(send, status, data):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class RagASGIApp:
+    """ASGI application: native async chat endpoints in front of the Flask app."""
+
+    def __init__(self):
+        self.flask_app = WsgiToAsgi(rag.app)
+        self.executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix='retrieval')
+        self.llm = None
+        self.observer = None
+        self.routes = {
+            '/api/chat': self.chat,
+            '/api/chat/stream': self.chat_stream,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in self.routes:
+            start = time.perf_counter()
+
+            async def send_observed(message):
+                if message['type'] == 'http.response.start':
+                    metrics.request_seconds.observe(time.perf_counter() - start, endpoint=scope['path'],
+                                                    method='POST', status=message['status'])
+                await send(message)
+
+            await self.routes[scope['path']](scope, receive, send_observed)
+        else:
+            await self.flask_app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # The semaphore must be created inside the server's event loop
+                self.llm = LLMGateway()
+                await self.llm.start()
+                # Same startup as app.py: the index and the embedding model load in the
+                # background (see /api/health/ready), then jobs resume and the folder is watched
+                rag.start_warmup()
+                rag.load_processed_files()
+                rag.job_queue.start()
+                self.observer = rag.start_document_observer()
+                # Files added while the server was down are indexed without delaying startup
+                threading.Thread(target=rag.index_new_documents, name='initial-indexing', daemon=True).start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.observer is not None:
+                    self.observer.stop()
+                    self.observer.join()
+                    print("Document monitoring stopped")
+                await self.llm.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run_in_pool(self, function, *args):
+        # Run in a copy of the request's context so its stages reach its trace
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, function, *args)
+
+    async def retrieve(self, query, history, filters=None, collections=None):
+        """Cache lookup then retrieval, off the event loop.
+
+        Returns (cached_result, query_embedding, augmented_query, contexts);
+        the last two are None on a cache hit.
+        """
+        cached_result, query_embedding = await self.run_in_pool(
+            rag.cached_chat_result, query, history, filters, collections
+        )
+        if cached_result is not None:
+            return cached_result, query_embedding, None, None
+        augmented_query, contexts = await self.run_in_pool(
+            lambda: rag.augment_prompt(query, query_embedding=query_embedding, filters=filters,
+                                       collections=collections)
+        )
+        return None, query_embedding, augmented_query, contexts
+
+    async def chat(self, scope, receive, send):
+        """Async version of the /api/chat endpoint."""
+        try:
+            data = await read_json(receive)
+        except ValueError:
+            return await send_json(send, 400, {'error': 'Invalid JSON body'})
+        query = data.get('query')
+        history = data.get('history', None)
+        if not query:
+            return await send_json(send, 400, {'error': 'No query provided'})
+        filters, error = rag.parse_filters(data)
+        if not error:
+            collections, error = await self.run_in_pool(rag.parse_collections, data)
+        if error:
+            return await send_json(send, 400, {'error': error})
+
+        with metrics.tracing(trace_requested(scope)) as trace:
+            start = time.time()
+            try:
+                cached_result, query_embedding, augmented_query, contexts = await self.retrieve(
+                    query, history, filters, collections
+                )
+                if cached_result is not None:
+                    return await send_json(send, 200, rag.with_trace(dict(cached_result, cached=True), trace))
+                await self.llm.acquire()
+            except QueueFullError:
+                return await send_json(send, 503, {'error': 'Server busy, please try again later'})
+            except Exception as e:
+                print(f"Error in chat endpoint: {e}")
+                return await send_json(send, 500, {'error': f'Error processing query: {str(e)}'})
+
+            try:
+                response = await self.llm.generate(augmented_query, history)
+            finally:
+                self.llm.release()
+
+            if not response:
+                return await send_json(send, 500, {'error': 'Failed to generate response'})
+            result = {
+                'response': response,
+                'augmentedQuery': augmented_query,
+                'contexts': contexts
+            }
+            rag.cache_chat_result(query, query_embedding, result, time.time() - start)
+            await send_json(send, 200, rag.with_trace(result, trace))
+
+    async def chat_stream(self, scope, receive, send):
+        """Async version of the /api/chat/stream endpoint (same events)."""
+        try:
+            data = await read_json(receive)
+        except ValueError:
+            return await send_json(send, 400, {'error': 'Invalid JSON body'})
+        query = data.get('query')
+        history = data.get('history', None)
+        if not query:
+            return await send_json(send, 400, {'error': 'No query provided'})
+        filters, error = rag.parse_filters(data)
+        if not error:
+            collections, error = await self.run_in_pool(rag.parse_collections, data)
+        if error:
+            return await send_json(send, 400, {'error': error})
+
+        with metrics.tracing(trace_requested(scope)) as trace:
+            start = time.time()
+            try:
+                cached_result, query_embedding, augmented_query, contexts = await self.retrieve(
+                    query, history, filters, collections
+                )
+                if cached_result is None:
+                    await self.llm.acquire()
+            except QueueFullError:
+                return await send_json(send, 503, {'error': 'Server busy, please try again later'})
+            except Exception as e:
+                print(f"Error in chat stream endpoint: {e}")
+                return await send_json(send, 500, {'error': f'Error processing query: {str(e)}'})
+
+            async def send_event(event, payload):
+                await send({
+                    'type': 'http.response.body',
+                    'body': rag.sse_event(event, payload).encode('utf-8'),
+                    'more_body': True
+                })
+
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ] + CORS_HEADERS
+            })
+            if cached_result is not None:
+                # Replay the cached answer as a single token
+                await send_event('contexts', {'contexts': cached_result['contexts'], 'augmentedQuery': cached_result['augmentedQuery']})
+                await send_event('token', {'token': cached_result['response']})
+                elapsed_ms = (time.time() - start) * 1000
+                await send_event('done', rag.with_trace({'context': None, 'cached': True,
+                                                         'time_to_first_token_ms': elapsed_ms, 'total_ms': elapsed_ms}, trace))
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+
+            try:
+                await send_event('contexts', {'contexts': contexts, 'augmentedQuery': augmented_query})
+
+                first_token_ms = None
+                tokens = []
+                async for event, payload in self.llm.stream(augmented_query, history):
+                    if event == 'token':
+                        if first_token_ms is None:
+                            first_token_ms = (time.time() - start) * 1000
+                        tokens.append(payload)
+                        await send_event('token', {'token': payload})
+                    elif event == 'done':
+                        payload['time_to_first_token_ms'] = first_token_ms
+                        payload['total_ms'] = (time.time() - start) * 1000
+                        rag.cache_chat_result(query, query_embedding, {
+                            'response': ''.join(tokens),
+                            'augmentedQuery': augmented_query,
+                            'contexts': contexts
+                        }, time.time() - start)
+                        await send_event('done', rag.with_trace(payload, trace))
+                    else:
+                        await send_event('error', {'error': payload})
+                await send({'type': 'http.response.body', 'body': b''})
+            finally:
+                self.llm.release()
+
+
+app = RagASGIApp()
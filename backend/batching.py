@@ -0,0 +1,88 @@
+"""Micro-batching of work submitted by concurrent request threads.
+
+A single forward pass of the embedding model (or a single FAISS search) over
+32 queries costs little more than over one, so queries that arrive while
+the model is busy, or within ``max_wait_ms`` of each other, are processed as
+one batch by a worker thread. Each caller blocks until its own result is
+ready.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collects items from concurrent callers and runs ``function`` on them in batches.
+
+    ``function`` takes a list of items and returns a list with one result
+    per item, in the same order. With ``max_batch_size`` 1, items are
+    processed directly in the caller's thread.
+    """
+
+    def __init__(self, function, max_batch_size=32, max_wait_ms=2.0, name='micro-batcher'):
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.pending = []
+        self.condition = threading.Condition()
+        self.worker = None
+        self.stats = {'items': 0, 'batches': 0}
+
+    @property
+    def enabled(self):
+        return self.max_batch_size > 1
+
+    def submit(self, item):
+        """Process one item and return its result."""
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items):
+        """Process several items, possibly in the same batches as other callers' items."""
+        if not self.enabled:
+            with self.condition:
+                self.stats['items'] += len(items)
+                self.stats['batches'] += len(items)
+            return [self.function([item])[0] for item in items]
+
+        futures = [Future() for _ in items]
+        with self.condition:
+            self.pending.extend(zip(items, futures))
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.worker.start()
+            self.condition.notify()
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Give concurrent callers a few milliseconds to join the batch
+                deadline = time.monotonic() + self.max_wait
+                while len(self.pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch_size]
+                del self.pending[:self.max_batch_size]
+                self.stats['items'] += len(batch)
+                self.stats['batches'] += 1
+
+            try:
+                results = self.function([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+        stats['average_batch_size'] = stats['items'] / stats['batches'] if stats['batches'] else 0.0
+        stats['max_batch_size'] = self.max_batch_size
+        return stats
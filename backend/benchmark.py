@@ -0,0 +1,1692 @@
+"""Benchmarks for the RAG backend.
+
+Run from the backend folder, e.g.:
+    python benchmark.py ingest --batch-size 64
+
+To check a change for performance regressions, save an end-to-end run
+before it and compare the run after it with that one:
+    python benchmark.py e2e --output before.json
+    python benchmark.py e2e --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+import app
+from vector_store import SegmentStore, preview_text
+from ann_index import INDEX_TYPES, build_index
+from embedding_cache import EmbeddingCache
+from jobs import JobQueue
+from query_cache import QueryCache
+from batching import MicroBatcher
+from embeddings import EMBEDDING_BACKENDS, MAX_RECALL_DELTA, load_embedding_model
+from lexical_index import LATENCY_BUDGET_MS, reciprocal_rank_fusion
+from extraction import iter_document_chunks
+from context_packing import count_tokens, format_passage
+import metrics
+
+
+def load_sample_chunks(folder=app.UPLOAD_FOLDER):
+    """Extract and chunk every supported document in a folder."""
+    chunks = []
+    for filename in sorted(os.listdir(folder)):
+        filepath = os.path.join(folder, filename)
+        if os.path.splitext(filename)[1].lower() not in ['.pdf', '.docx', '.pptx']:
+            continue
+        try:
+            chunks.extend(chunk for _, chunk in iter_document_chunks(filepath))
+        except Exception as e:
+            print(f"Skipping {filename}: {e}")
+            continue
+    return chunks
+
+
+def bench_ingest(args):
+    """Compare per-chunk and batched embedding + index add throughput."""
+    chunks = load_sample_chunks(args.folder)
+    chunks = chunks * args.repeat
+    print(f"Benchmarking ingestion of {len(chunks)} chunks from {args.folder}")
+
+    # Warm up the model so the first measurement is not penalised
+    app.get_embedding_model().encode(chunks[:1])
+    # Measure the model itself, not the embedding cache
+    app.embedding_cache = EmbeddingCache(None, app.EMBEDDING_MODEL_NAME, app.embedding_dimension, max_entries=0)
+
+    # Previous behaviour: one encode() and one add() per chunk
+    index = faiss.IndexFlatL2(app.embedding_dimension)
+    start = time.perf_counter()
+    for chunk in chunks:
+        embedding = app.get_embedding_model().encode([chunk])[0]
+        index.add(np.array([embedding]).astype('float32'))
+    per_chunk_seconds = time.perf_counter() - start
+
+    # Batched encoding and a single vectorized add
+    index = faiss.IndexFlatL2(app.embedding_dimension)
+    start = time.perf_counter()
+    embeddings, _ = app.encode_chunks(chunks, batch_size=args.batch_size)
+    index.add(embeddings)
+    batched_seconds = time.perf_counter() - start
+
+    print(f"per-chunk: {len(chunks) / per_chunk_seconds:8.1f} chunks/sec ({per_chunk_seconds:.2f}s)")
+    print(f"batched:   {len(chunks) / batched_seconds:8.1f} chunks/sec ({batched_seconds:.2f}s, batch size {args.batch_size})")
+    print(f"speedup:   {per_chunk_seconds / batched_seconds:.2f}x")
+
+
+# Executed in a fresh interpreter so that peak memory only covers the load itself
+COLD_START_SCRIPT = """
+import json, pickle, resource, sys, time
+import faiss, numpy as np
+from vector_store import SegmentStore
+
+fmt, directory, dimension = sys.argv[1], sys.argv[2], int(sys.argv[3])
+start = time.perf_counter()
+if fmt == 'pickle':
+    with open(directory + '/faiss_index.pkl', 'rb') as f:
+        index = pickle.load(f)
+    with open(directory + '/metadata.pkl', 'rb') as f:
+        metadata = pickle.load(f)
+else:
+    store = SegmentStore(directory + '/store', dimension)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    for ids, vectors in store.load_vectors():
+        index.add_with_ids(np.ascontiguousarray(vectors), ids)
+    metadata = store.metadata
+startup_seconds = time.perf_counter() - start
+
+start = time.perf_counter()
+D, I = index.search(np.random.rand(1, dimension).astype('float32'), 3)
+hits = [metadata[int(i)]['full_text'] for i in I[0]]
+query_seconds = time.perf_counter() - start
+
+# ru_maxrss survives exec on Linux, so prefer the high-water mark of this process image
+try:
+    with open('/proc/self/status') as f:
+        peak_kb = int(f.read().split('VmHWM:')[1].split()[0])
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps({
+    'startup_seconds': startup_seconds,
+    'first_query_seconds': query_seconds,
+    'peak_rss_mb': peak_kb / 1024,
+}))
+"""
+
+
+# Indexes one document in a fresh interpreter so that peak memory only covers that document
+LARGE_DOCUMENT_SCRIPT = """
+import json, sys, time
+import benchmark
+app = benchmark.app
+
+mode, path, directory = sys.argv[1], sys.argv[2], sys.argv[3]
+benchmark.use_temporary_store(directory)
+# Pages of the memory-mapped embedding cache would count towards the peak
+app.embedding_cache = benchmark.EmbeddingCache(None, app.EMBEDDING_MODEL_NAME, app.embedding_dimension, max_entries=0)
+app.get_embedding_model().encode(['warm up'])
+
+def memory_kb(field):
+    with open('/proc/self/status') as f:
+        return int(f.read().split(field + ':')[1].split()[0])
+
+before_kb = memory_kb('VmRSS')
+start = time.perf_counter()
+if mode == 'whole':
+    # Previous behaviour: the whole text and every chunk are held in memory
+    from extraction import chunk_text_simple, process_document
+    chunks = chunk_text_simple(process_document(path))
+    stored = app.store_in_faiss(chunks, benchmark.os.path.basename(path))
+else:
+    stored = app.process_document_from_path(path)
+seconds = time.perf_counter() - start
+
+print(json.dumps({
+    'seconds': seconds,
+    'chunks': stored,
+    'peak_rss_mb': memory_kb('VmHWM') / 1024,
+    'peak_growth_mb': (memory_kb('VmHWM') - before_kb) / 1024,
+}))
+"""
+
+
+# Import cost of the app in a fresh interpreter, then what loading the rest used to add to it
+IMPORT_TIME_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+import_seconds = time.perf_counter() - start
+start = time.perf_counter()
+app.ensure_index()
+index_seconds = time.perf_counter() - start
+start = time.perf_counter()
+app.get_embedding_model()
+model_seconds = time.perf_counter() - start
+print(json.dumps({'import_seconds': import_seconds, 'index_seconds': index_seconds, 'model_seconds': model_seconds}))
+"""
+
+
+def synthetic_chunk(i, text_chars):
+    """Deterministic filler text for a synthetic chunk."""
+    words = f"chunk {i} lorem ipsum dolor sit amet "
+    return (words * (text_chars // len(words) + 1))[:text_chars]
+
+
+def bench_coldstart(args):
+    """Measure startup time and peak memory for the legacy pickles vs. the segment store."""
+    directory = args.dir or tempfile.mkdtemp(prefix='rag-coldstart-')
+    dimension = app.embedding_dimension
+    rng = np.random.default_rng(0)
+
+    if not os.path.exists(os.path.join(directory, 'store', 'manifest.json')):
+        print(f"Generating {args.chunks} synthetic chunks in {directory}")
+        store = SegmentStore(os.path.join(directory, 'store'), dimension, max_segments=args.chunks)
+        legacy_index = faiss.IndexFlatL2(dimension)
+        legacy_metadata = []
+        for start in range(0, args.chunks, args.segment_size):
+            count = min(args.segment_size, args.chunks - start)
+            vectors = rng.random((count, dimension), dtype='float32')
+            records = []
+            for i in range(start, start + count):
+                text = synthetic_chunk(i, args.text_chars)
+                records.append({'text': preview_text(text), 'full_text': text,
+                                'source': f"doc-{i // 100}.pdf", 'chunk_id': f"doc-{i // 100}.pdf-chunk-{i % 100}",
+                                'chunk': i % 100})
+            store.append(vectors, records)
+            legacy_index.add(vectors)
+            legacy_metadata.extend(records)
+        with open(os.path.join(directory, 'faiss_index.pkl'), 'wb') as f:
+            pickle.dump(legacy_index, f)
+        with open(os.path.join(directory, 'metadata.pkl'), 'wb') as f:
+            pickle.dump(legacy_metadata, f)
+        del legacy_index, legacy_metadata
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    for fmt in ['pickle', 'store']:
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_START_SCRIPT, fmt, directory, str(dimension)],
+            cwd=backend_dir, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{fmt:6}: startup {result['startup_seconds']:7.2f}s, "
+              f"first query {result['first_query_seconds'] * 1000:7.1f}ms, "
+              f"peak RSS {result['peak_rss_mb']:8.1f} MB")
+
+
+def bench_startup(args):
+    """Import time, time to liveness, readiness and first successful chat of a fresh server process."""
+    import requests
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    imports = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_TIME_SCRIPT], cwd=backend_dir,
+                                check=True, capture_output=True, text=True).stdout
+        imports.append(json.loads(output.strip().splitlines()[-1]))
+    import_seconds, index_seconds, model_seconds = (
+        np.median([result[key] for result in imports]) for key in ('import_seconds', 'index_seconds', 'model_seconds')
+    )
+    print(f"import app       {import_seconds:6.2f}s")
+    print(f"  + index        {index_seconds:6.2f}s")
+    print(f"  + model        {model_seconds:6.2f}s  (eager startup: {import_seconds + index_seconds + model_seconds:.2f}s)")
+
+    stub_port, app_port = args.port + 1, args.port
+    env = dict(os.environ, PORT=str(stub_port), OLLAMA_URL=f"http://127.0.0.1:{stub_port}/api/generate")
+    if args.mode == 'asgi':
+        server_cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(app_port), '--log-level', 'warning']
+    else:
+        server_cmd = [sys.executable, '-c',
+                      f"import app; app.start_warmup(); app.app.run(host='127.0.0.1', port={app_port}, threaded=True)"]
+    stub = subprocess.Popen([sys.executable, 'stub_ollama.py'], cwd=backend_dir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{app_port}"
+    timings = {'live': [], 'ready': [], 'first chat': []}
+    try:
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            server = subprocess.Popen(server_cmd, cwd=backend_dir, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_http(f"{base_url}/api/health/live")
+                timings['live'].append(time.perf_counter() - start)
+
+                def poll_readiness():
+                    while requests.get(f"{base_url}/api/health/ready", timeout=args.timeout).status_code != 200:
+                        time.sleep(0.05)
+                    timings['ready'].append(time.perf_counter() - start)
+
+                poller = threading.Thread(target=poll_readiness)
+                poller.start()
+                # A chat sent as soon as the process is live waits for the warm-up instead of failing
+                response = requests.post(f"{base_url}/api/chat", json={'query': args.query}, timeout=args.timeout)
+                if response.status_code != 200 or not response.json().get('response'):
+                    raise RuntimeError(f"First chat failed: {response.status_code} {response.text[:200]}")
+                timings['first chat'].append(time.perf_counter() - start)
+                poller.join()
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    for name, values in timings.items():
+        print(f"{args.mode} {name:11} {np.median(values):6.2f}s (median of {len(values)})")
+
+
+def clustered_vectors(count, dimension, clusters, rng):
+    """Synthetic vectors grouped around random centres, closer to real embeddings than uniform noise."""
+    centres = rng.standard_normal((clusters, dimension), dtype='float32')
+    assignment = rng.integers(0, clusters, size=count)
+    return centres[assignment] + 0.3 * rng.standard_normal((count, dimension), dtype='float32')
+
+
+def bench_ann(args):
+    """Recall@k vs. query latency for each index type, against exact flat search."""
+    rng = np.random.default_rng(0)
+    dimension = app.embedding_dimension
+    data = clustered_vectors(args.vectors + args.queries, dimension, args.clusters, rng)
+    vectors, queries = data[:args.vectors], data[args.vectors:]
+    print(f"{args.vectors} vectors, {args.queries} queries, k={args.k}")
+
+    ground_truth = None
+    types = args.types or INDEX_TYPES
+    if 'flat' not in types:
+        types = ['flat'] + types
+    for index_type in types:
+        params = {'nprobe': args.nprobe, 'ef_search': args.ef_search}
+        start = time.perf_counter()
+        ids = np.arange(len(vectors), dtype='int64')
+        index = build_index(index_type, dimension, lambda: [(ids, vectors)], len(vectors), params)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        results = []
+        for query in queries:
+            start = time.perf_counter()
+            _, I = index.search(query.reshape(1, -1), args.k)
+            latencies.append(time.perf_counter() - start)
+            results.append(I[0])
+        results = np.array(results)
+        if ground_truth is None:
+            ground_truth = results
+
+        recall = np.mean([len(set(r) & set(g)) / args.k for r, g in zip(results, ground_truth)])
+        latencies_ms = np.array(latencies) * 1000
+        print(f"{index_type:9} recall@{args.k} {recall:.3f}  "
+              f"p50 {np.percentile(latencies_ms, 50):6.2f}ms  p99 {np.percentile(latencies_ms, 99):6.2f}ms  "
+              f"build {build_seconds:6.1f}s")
+
+
+def start_stub_ollama():
+    """Serve stub_ollama.py on a free local port and point the app at it."""
+    from werkzeug.serving import make_server
+    import stub_ollama
+
+    server = make_server('127.0.0.1', 0, stub_ollama.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.OLLAMA_URL = f"http://127.0.0.1:{server.server_port}/api/generate"
+    return server
+
+
+def bench_ttft(args):
+    """Time to first token of /api/chat/stream vs. total latency of /api/chat (stub LLM)."""
+    server = start_stub_ollama()
+    client = app.app.test_client()
+    blocking, first_token, streamed = [], [], []
+    try:
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.post('/api/chat', json={'query': args.query})
+            blocking.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            response = client.post('/api/chat/stream', json={'query': args.query}, buffered=False)
+            seen_token = False
+            for line in response.response:
+                if not seen_token and line.startswith(b'event: token'):
+                    first_token.append(time.perf_counter() - start)
+                    seen_token = True
+            response.close()
+            streamed.append(time.perf_counter() - start)
+    finally:
+        server.shutdown()
+
+    for name, values in [('blocking total', blocking), ('stream first token', first_token), ('stream total', streamed)]:
+        values_ms = np.array(values) * 1000
+        print(f"{name:19} p50 {np.percentile(values_ms, 50):7.1f}ms  p99 {np.percentile(values_ms, 99):7.1f}ms")
+
+
+def wait_for_http(url, timeout=120):
+    """Poll a URL until it answers, so benchmarks start once a server is ready."""
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.25)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+async def run_load(url, users, requests_per_user, query, timeout):
+    """Send chat requests from concurrent users and collect per-request latencies."""
+    import asyncio
+    import httpx
+
+    latencies = []
+    errors = 0
+
+    async def user(client):
+        nonlocal errors
+        for _ in range(requests_per_user):
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json={'query': query})
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=users)) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client) for _ in range(users)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def bench_load(args):
+    """Load-test /api/chat served by Flask (wsgi) or uvicorn (asgi) against the stub Ollama."""
+    import asyncio
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    stub_port, app_port = args.port + 1, args.port
+    env = dict(os.environ, PORT=str(stub_port), OLLAMA_URL=f"http://127.0.0.1:{stub_port}/api/generate",
+               LLM_MAX_CONCURRENCY=str(args.llm_concurrency))
+    if args.mode == 'asgi':
+        server_cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(app_port), '--log-level', 'warning']
+    else:
+        server_cmd = [sys.executable, '-c',
+                      f"import app; app.app.run(host='127.0.0.1', port={app_port}, threaded=True)"]
+
+    processes = [
+        subprocess.Popen([sys.executable, 'stub_ollama.py'], cwd=backend_dir, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+        subprocess.Popen(server_cmd, cwd=backend_dir, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+    ]
+    try:
+        wait_for_http(f"http://127.0.0.1:{app_port}/api/test")
+        latencies, errors, elapsed = asyncio.run(run_load(
+            f"http://127.0.0.1:{app_port}/api/chat", args.users, args.requests, args.query, args.timeout
+        ))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    print(f"{args.mode}: {args.users} users x {args.requests} requests, {errors} errors"
+          + (f", LLM concurrency {args.llm_concurrency}" if args.mode == 'asgi' else ''))
+    print(f"throughput {len(latencies) / elapsed:7.2f} req/s  "
+          f"p50 {np.percentile(latencies_ms, 50):8.1f}ms  p99 {np.percentile(latencies_ms, 99):8.1f}ms")
+
+
+SYNTHETIC_WORDS = (
+    "analyse donnees modele apprentissage projet rapport etudiant competences "
+    "python flask reseau neurones matrice equation integrale derivee probabilite "
+    "experience stage universite gestion equipe presentation resultats conclusion"
+).split()
+
+
+def synthetic_page(rng, chars):
+    """Random French-looking filler text of roughly ``chars`` characters."""
+    words = []
+    length = 0
+    while length < chars:
+        word = SYNTHETIC_WORDS[rng.integers(len(SYNTHETIC_WORDS))]
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def generate_corpus(directory, documents, pages=10, chars_per_page=2000, seed=0):
+    """Write a mix of synthetic PDF, DOCX and PPTX files and return their paths."""
+    import fitz
+    import docx
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(documents):
+        extension = ['.pdf', '.docx', '.pptx'][i % 3]
+        path = os.path.join(directory, f"synthetic-{i:05d}{extension}")
+        texts = [synthetic_page(rng, chars_per_page) for _ in range(pages)]
+        if extension == '.pdf':
+            pdf = fitz.open()
+            for text in texts:
+                page = pdf.new_page()
+                page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=6)
+            pdf.save(path)
+            pdf.close()
+        elif extension == '.docx':
+            document = docx.Document()
+            for text in texts:
+                document.add_paragraph(text)
+            document.save(path)
+        else:
+            presentation = Presentation()
+            for text in texts:
+                slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+                box = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(6))
+                box.text_frame.text = text
+            presentation.save(path)
+        paths.append(path)
+    return paths
+
+
+def use_temporary_store(directory):
+    """Point the app at an empty vector store and embedding cache so benchmarks never touch models/."""
+    app.STORE_DIR = os.path.join(directory, 'store')
+    app.INDEX_CACHE_PATH = os.path.join(directory, 'index.faiss')
+    app.INDEX_CACHE_STATE_PATH = os.path.join(directory, 'index.faiss.json')
+    app.embedding_cache = EmbeddingCache(
+        os.path.join(directory, 'embedding_cache'), app.EMBEDDING_MODEL_NAME, app.embedding_dimension,
+        max_entries=app.EMBEDDING_CACHE_SIZE
+    )
+    app.initialize_index()
+
+
+def bench_largedoc(args):
+    """Time and peak memory of indexing one very large PDF, whole-text vs. page-by-page streaming."""
+    import fitz
+
+    directory = tempfile.mkdtemp(prefix='rag-largedoc-')
+    path = os.path.join(directory, 'large.pdf')
+    rng = np.random.default_rng(0)
+    pdf = fitz.open()
+    for _ in range(args.pages):
+        page = pdf.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), synthetic_page(rng, args.chars_per_page), fontsize=6)
+    pdf.save(path)
+    pdf.close()
+    print(f"Generated a {args.pages}-page PDF ({os.path.getsize(path) / 2**20:.1f} MB) in {directory}")
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    for mode in ['whole', 'streaming']:
+        output = subprocess.run(
+            [sys.executable, '-c', LARGE_DOCUMENT_SCRIPT, mode, path, os.path.join(directory, mode)],
+            cwd=backend_dir, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:9}: {result['chunks']} chunks in {result['seconds']:7.2f}s "
+              f"({args.pages / result['seconds']:7.1f} pages/sec), "
+              f"peak RSS {result['peak_rss_mb']:7.1f} MB (+{result['peak_growth_mb']:.1f} MB while indexing)")
+
+
+# Questions about the sample uploads, with the document that answers them
+RELEVANCE_QUERIES = [
+    ("Quel est le numéro de téléphone de l'hôtel KOSY Appart à Troyes ?", 'Jennene_Emna.docx'),
+    ("Quand est prévue l'arrivée en France à Troyes ?", 'Jennene_Emna.docx'),
+    ("Lettre au Consul Général de France concernant l'hébergement", 'Jennene_Emna.docx'),
+    ("Où Mohamed Chater a-t-il fait son stage chez Neopolis ?", 'Mohamed-Chater-FlowCV-Resume-20241112_1.pdf'),
+    ("ISET Kélibia développement des systèmes d'information", 'Mohamed-Chater-FlowCV-Resume-20241112_1.pdf'),
+    ("Symfony Angular Kotlin Flutter", 'Mohamed-Chater-FlowCV-Resume-20241112_1.pdf'),
+    ("CGPA at Charusat University", 'Prakshal_resume_1.pdf'),
+    ("bird species classification Streamlit TechXi", 'Prakshal_resume_1.pdf'),
+    ("University of Ottawa Master of Engineering", 'Prakshal_resume_1.pdf'),
+    ("Rasa ou Dialogflow pour le chatbot", 'Presentation-du-Projet-de-Fin-dEtudes_1.pptx'),
+    ("Objectifs du projet de fin d'études", 'Presentation-du-Projet-de-Fin-dEtudes_1.pptx'),
+    ("Le PC s'est éteint d'un coup, court-circuit de la carte mère", 'test.docx'),
+    ("écran noir, barrettes de RAM mal enfichées", 'test11.docx'),
+    ("Le PC est très lent, passer d'un HDD à un SSD", 'test5.docx'),
+    ("S=8+2", 'test5.docx'),
+    ("2x^3 - 3x^2 + x - 5 = 0", 'testmath.docx'),
+    ("méthode de Cardan pour l'équation cubique", 'testmath.docx'),
+]
+
+
+def bench_hybrid(args):
+    """Relevance of dense, BM25 and hybrid retrieval on the sample uploads, and BM25 latency on a large corpus."""
+    directory = tempfile.mkdtemp(prefix='rag-hybrid-')
+    use_temporary_store(directory)
+    filepaths = [os.path.join(args.folder, filename) for filename in sorted(os.listdir(args.folder))
+                 if os.path.splitext(filename)[1].lower() in ['.pdf', '.docx', '.pptx']]
+    app.ingest_documents(filepaths, workers=1)
+    current = app.current_snapshot()
+    queries = [(query, source) for query, source in RELEVANCE_QUERIES
+               if source in {os.path.basename(path) for path in filepaths}]
+
+    print(f"\nRelevance over {len(queries)} questions on {args.folder} ({current.ntotal} chunks)")
+    print(f"{'mode':8} {'hit@' + str(args.k):>7} {'MRR':>6}")
+    for mode in ['dense', 'lexical', 'hybrid']:
+        hits = 0
+        reciprocal_ranks = 0.0
+        for query, source in queries:
+            results = app.search_chunks(current, query, app.encode_query(query), args.k, mode=mode)
+            sources = [current.metadata[chunk_id]['source'] for chunk_id, _, _ in results]
+            if source in sources:
+                hits += 1
+                reciprocal_ranks += 1 / (sources.index(source) + 1)
+        print(f"{mode:8} {hits / len(queries):7.2f} {reciprocal_ranks / len(queries):6.2f}")
+
+    # Latency on a synthetic corpus with a Zipf-like vocabulary
+    print(f"\nGenerating {args.chunks} synthetic chunks for the latency check")
+    rng = np.random.default_rng(0)
+    vocabulary = np.array([f"w{i}" for i in range(args.vocabulary)])
+    weights = 1 / np.arange(1, args.vocabulary + 1)
+    weights /= weights.sum()
+    store = SegmentStore(os.path.join(directory, 'latency'), app.embedding_dimension, max_segments=args.chunks)
+    segment_size = 10_000
+    for start in range(0, args.chunks, segment_size):
+        count = min(segment_size, args.chunks - start)
+        words = rng.choice(vocabulary, size=(count, args.words_per_chunk), p=weights)
+        records = [{'full_text': ' '.join(row), 'source': f"doc-{(start + i) // 100}.pdf", 'chunk': (start + i) % 100}
+                   for i, row in enumerate(words)]
+        store.append(rng.random((count, app.embedding_dimension), dtype='float32'), records)
+    lexical = store.metadata.lexical
+    dense_ranking = list(range(app.HYBRID_CANDIDATES))
+
+    timings = []
+    for _ in range(args.queries):
+        query = ' '.join(rng.choice(vocabulary, size=4, p=weights))
+        start = time.perf_counter()
+        ids, _ = lexical.search(query, app.HYBRID_CANDIDATES)
+        reciprocal_rank_fusion([dense_ranking, ids.tolist()], k=app.RRF_K)
+        timings.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(timings, [50, 95])
+    print(f"BM25 + fusion over {lexical.count} chunks: p50 {p50:.2f} ms, p95 {p95:.2f} ms "
+          f"(budget {args.budget_ms} ms at p95)")
+    if p95 > args.budget_ms:
+        print("FAILED latency budget exceeded")
+        sys.exit(1)
+
+
+def exact_top_k(documents, queries, k):
+    """Ids of the k nearest documents of each query, by exact L2 search."""
+    index = faiss.IndexFlatL2(documents.shape[1])
+    index.add(np.ascontiguousarray(documents, dtype='float32'))
+    return index.search(np.ascontiguousarray(queries, dtype='float32'), k)[1]
+
+
+def recall_at_k(found, expected):
+    """Mean fraction of the expected ids that were found, per query."""
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected)]))
+
+
+def bench_embeddings(args):
+    """Embeddings/sec, query latency and recall@k against PyTorch float32 for each embedding backend."""
+    chunks = load_sample_chunks(args.folder) * args.repeat
+    rng = np.random.default_rng(0)
+    queries = [query for query, _ in RELEVANCE_QUERIES]
+    queries += [chunks[i][:args.query_chars] for i in rng.integers(len(chunks), size=args.queries - len(queries))]
+    k = min(args.k, len(chunks))
+    print(f"{len(chunks)} chunks, {len(queries)} queries, recall@{k} against torch "
+          f"(full: documents and queries re-encoded, mixed: only queries)")
+    print(f"{'backend':10} {'emb/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'full':>6} {'mixed':>6} {'cosine':>7}")
+
+    reference = None
+    failed = []
+    # torch goes first: it is the reference of the recall columns
+    for backend in ['torch'] + [backend for backend in args.backends if backend != 'torch']:
+        try:
+            model = load_embedding_model(app.EMBEDDING_MODEL_NAME, backend)
+        except Exception as e:
+            print(f"{backend:10} unavailable: {e}")
+            continue
+        model.encode(['warm up'])
+        start = time.perf_counter()
+        vectors = np.asarray(model.encode(chunks, batch_size=args.batch_size), dtype='float32')
+        rate = len(chunks) / (time.perf_counter() - start)
+        timings = []
+        for query in queries[:args.latency_queries]:
+            start = time.perf_counter()
+            model.encode([query])
+            timings.append((time.perf_counter() - start) * 1000)
+        p50, p95 = np.percentile(timings, [50, 95])
+        query_vectors = np.asarray(model.encode(queries), dtype='float32')
+
+        if reference is None:
+            reference = vectors, exact_top_k(vectors, query_vectors, k)
+        reference_vectors, expected = reference
+        full = recall_at_k(exact_top_k(vectors, query_vectors, k), expected)
+        mixed = recall_at_k(exact_top_k(reference_vectors, query_vectors, k), expected)
+        cosine = float(np.mean(np.sum(vectors * reference_vectors, axis=1) / (
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference_vectors, axis=1) + 1e-12)))
+        print(f"{backend:10} {rate:8.1f} {p50:7.2f} {p95:7.2f} {full:6.3f} {mixed:6.3f} {cosine:7.4f}")
+        if 1 - min(full, mixed) > args.max_recall_delta:
+            failed.append(backend)
+
+    if failed:
+        print(f"FAILED recall delta above {args.max_recall_delta} for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+def bench_packing(args):
+    """Prompt tokens and LLM latency with contexts pasted whole vs. packed into the token budget."""
+    directory = tempfile.mkdtemp(prefix='rag-packing-')
+    use_temporary_store(directory)
+    filepaths = [os.path.join(args.folder, filename) for filename in sorted(os.listdir(args.folder))
+                 if os.path.splitext(filename)[1].lower() in ['.pdf', '.docx', '.pptx']]
+    app.ingest_documents(filepaths, workers=1)
+    app.CONTEXT_TOKEN_BUDGET = args.budget
+    queries = [query for query, _ in RELEVANCE_QUERIES]
+
+    server = None
+    if args.ollama_url:
+        app.OLLAMA_URL = args.ollama_url
+    else:
+        import stub_ollama
+        stub_ollama.PREFILL_PER_TOKEN = args.prefill_per_token
+        server = start_stub_ollama()
+
+    results = {'whole': [], 'packed': []}
+    try:
+        for query in queries:
+            contexts = app.retrieve([query], args.k)[0]
+            whole = app.build_augmented_query(
+                query, "\n\n".join(format_passage(i + 1, context) for i, context in enumerate(contexts))
+            )
+            packed, _ = app.augment_prompt(query, top_k=args.k)
+            for label, prompt in (('whole', whole), ('packed', packed)):
+                start = time.perf_counter()
+                response = app.ollama_session.post(app.OLLAMA_URL, json=app.build_ollama_payload(prompt),
+                                                   timeout=(app.OLLAMA_CONNECT_TIMEOUT, app.OLLAMA_TIMEOUT))
+                seconds = time.perf_counter() - start
+                results[label].append((count_tokens(prompt), response.json().get('prompt_eval_count'), seconds))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(f"{len(queries)} queries, top {args.k} contexts, budget {args.budget} tokens, LLM {app.OLLAMA_URL}")
+    print(f"{'prompt':8} {'est. tokens':>11} {'LLM tokens':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, rows in results.items():
+        estimated = np.mean([row[0] for row in rows])
+        counted = [row[1] for row in rows if row[1] is not None]
+        latencies = np.array([row[2] for row in rows]) * 1000
+        print(f"{label:8} {estimated:11.0f} {np.mean(counted) if counted else float('nan'):10.0f} "
+              f"{np.percentile(latencies, 50):8.0f} {np.percentile(latencies, 95):8.0f}")
+
+
+def bench_rerank(args):
+    """Retrieval quality and latency, and /api/chat latency, with and without cross-encoder re-ranking."""
+    directory = tempfile.mkdtemp(prefix='rag-rerank-')
+    use_temporary_store(directory)
+    filepaths = [os.path.join(args.folder, filename) for filename in sorted(os.listdir(args.folder))
+                 if os.path.splitext(filename)[1].lower() in ['.pdf', '.docx', '.pptx']]
+    app.ingest_documents(filepaths, workers=1)
+    queries = [(query, source) for query, source in RELEVANCE_QUERIES
+               if source in {os.path.basename(path) for path in filepaths}]
+    app.RERANK_CANDIDATES = args.candidates
+    app.reranker.deadline = args.deadline_ms / 1000
+    app.reranker.load()
+    app.query_cache.max_entries = 0  # every chat goes through retrieval
+    server = start_stub_ollama()
+    client = app.app.test_client()
+
+    print(f"{len(queries)} questions, {args.mode} retrieval, {args.candidates} candidates, "
+          f"deadline {args.deadline_ms:.0f} ms, re-ranker {app.RERANK_MODEL}")
+    print(f"{'re-rank':8} {'hit@' + str(args.k):>6} {'MRR':>6} {'retrieve p50':>13} {'p95':>7} {'chat p50':>9}")
+    try:
+        for rerank in (False, True):
+            hits = 0
+            reciprocal_ranks = 0.0
+            retrieval_ms = []
+            for query, source in queries:
+                start = time.perf_counter()
+                contexts = app.retrieve([query], args.k, mode=args.mode, rerank=rerank)[0]
+                retrieval_ms.append((time.perf_counter() - start) * 1000)
+                sources = [context['source'] for context in contexts]
+                if source in sources:
+                    hits += 1
+                    reciprocal_ranks += 1 / (sources.index(source) + 1)
+
+            app.RERANK_ENABLED = rerank
+            chat_ms = []
+            for query, _ in queries:
+                start = time.perf_counter()
+                client.post('/api/chat', json={'query': query})
+                chat_ms.append((time.perf_counter() - start) * 1000)
+            p50, p95 = np.percentile(retrieval_ms, [50, 95])
+            print(f"{'on' if rerank else 'off':8} {hits / len(queries):6.2f} {reciprocal_ranks / len(queries):6.2f} "
+                  f"{p50:10.1f} ms {p95:7.1f} {np.percentile(chat_ms, 50):6.0f} ms")
+    finally:
+        server.shutdown()
+    stats = app.reranker.get_stats()
+    print(f"re-ranker: {stats['pairs_scored']} pairs scored, {stats['pairs_skipped']} skipped at the deadline, "
+          f"{stats['deadline_hits']} deadline hits")
+
+
+def stage_summary(text, metric='rag_stage_duration_seconds'):
+    """Count and mean duration of every stage in a /metrics scrape."""
+    totals = {}
+    for line in text.splitlines():
+        for suffix in ('_sum', '_count'):
+            if line.startswith(metric + suffix + '{'):
+                labels, value = line[len(metric + suffix) + 1:].rsplit('} ', 1)
+                stage = labels.split('"')[1]
+                totals.setdefault(stage, {})[suffix[1:]] = float(value)
+    return {stage: (int(values['count']), values['sum'] / values['count'] * 1000)
+            for stage, values in totals.items() if values.get('count')}
+
+
+def bench_metrics(args):
+    """Per-stage latencies of ingestion and /api/chat read back from /metrics, and the cost of one observation."""
+    directory = tempfile.mkdtemp(prefix='rag-metrics-')
+    use_temporary_store(directory)
+    app.ingest_documents(generate_corpus(os.path.join(directory, 'corpus'), args.documents), workers=1)
+    app.query_cache.max_entries = 0
+
+    server = start_stub_ollama()
+    client = app.app.test_client()
+    trace = None
+    try:
+        for i in range(args.requests):
+            response = client.post('/api/chat', json={'query': f"{RELEVANCE_QUERIES[i % len(RELEVANCE_QUERIES)][0]} {i}"},
+                                   headers={metrics.DEBUG_TRACE_HEADER: '1'})
+            trace = response.get_json().get('trace')
+            stream = client.post('/api/chat/stream', json={'query': f"stream {i}"}, buffered=False)
+            for _ in stream.response:
+                pass
+            stream.close()
+        scrape = client.get('/metrics')
+    finally:
+        server.shutdown()
+
+    print(f"{args.documents} documents ingested, {args.requests} chats + {args.requests} streamed chats, "
+          f"/metrics: {len(scrape.data)} bytes ({scrape.mimetype})")
+    print(f"{'stage':22} {'count':>6} {'mean ms':>9}")
+    for stage, (count, mean_ms) in sorted(stage_summary(scrape.get_data(as_text=True)).items()):
+        print(f"{stage:22} {count:6d} {mean_ms:9.3f}")
+    print("Trace of the last /api/chat: " + ', '.join(f"{step['stage']} {step['ms']:.1f}ms" for step in trace or []))
+
+    histogram = metrics.Histogram('bench_seconds', 'Benchmark histogram.', ['stage'])
+    start = time.perf_counter()
+    for _ in range(args.observations):
+        histogram.observe(0.001, stage='bench')
+    print(f"One observation costs {(time.perf_counter() - start) / args.observations * 1e6:.2f}us")
+
+
+def bench_pipeline(args):
+    """Docs/sec of the pipelined ingestion engine for several extraction worker counts."""
+    directory = tempfile.mkdtemp(prefix='rag-pipeline-')
+    paths = generate_corpus(os.path.join(directory, 'corpus'), args.documents, pages=args.pages)
+    print(f"Generated {len(paths)} documents with {args.pages} pages each in {directory}")
+    app.get_embedding_model().encode(['warm up'])
+
+    use_temporary_store(os.path.join(directory, 'sequential'))
+    start = time.perf_counter()
+    for path in paths:
+        app.process_document_from_path(path)
+    sequential_seconds = time.perf_counter() - start
+    print(f"sequential      {len(paths) / sequential_seconds:7.2f} docs/sec")
+
+    for workers in args.workers:
+        use_temporary_store(os.path.join(directory, f"workers-{workers}"))
+        start = time.perf_counter()
+        indexed = app.ingest_documents(paths, workers=workers)
+        seconds = time.perf_counter() - start
+        print(f"{workers} workers       {indexed / seconds:7.2f} docs/sec "
+              f"({sequential_seconds / seconds:.2f}x sequential)")
+
+
+def bench_stress(args):
+    """Hammer retrieval from several threads while documents are ingested; report any torn reads."""
+    directory = tempfile.mkdtemp(prefix='rag-stress-')
+    app.STORE_MAX_SEGMENTS = args.max_segments  # force compactions during the run
+    use_temporary_store(directory)
+
+    committed = []
+    stop = threading.Event()
+    counters = {'queries': 0, 'torn': 0, 'wrong': 0, 'errors': 0}
+    counters_lock = threading.Lock()
+
+    def document_text(i, j):
+        return f"document-{i} chunk-{j} " + ' '.join(SYNTHETIC_WORDS[(i * 7 + j + k) % len(SYNTHETIC_WORDS)] for k in range(30))
+
+    def writer():
+        for i in range(args.documents):
+            chunks = [document_text(i, j) for j in range(args.chunks)]
+            app.store_in_faiss(chunks, f"stress-{i}.pdf")
+            committed.append(i)
+        stop.set()
+
+    def reader(seed):
+        rng = np.random.default_rng(seed)
+        while not stop.is_set():
+            if not committed:
+                time.sleep(0.001)
+                continue
+            i = committed[rng.integers(len(committed))]
+            j = int(rng.integers(args.chunks))
+            query = document_text(i, j)
+            result = {'queries': 1}
+            try:
+                snapshot = app.current_snapshot()
+                if snapshot.ntotal != len(snapshot.metadata):
+                    result['torn'] = 1
+                _, contexts = app.augment_prompt(query, top_k=1)
+                if not contexts or contexts[0]['content'] != query or contexts[0]['source'] != f"stress-{i}.pdf":
+                    result['wrong'] = 1
+            except Exception as e:
+                print(f"Reader error: {e}")
+                result['errors'] = 1
+            with counters_lock:
+                for key, value in result.items():
+                    counters[key] += value
+
+    threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(args.readers)]
+    threads.append(threading.Thread(target=writer))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.documents} documents ingested while {args.readers} readers ran {counters['queries']} queries "
+          f"in {elapsed:.1f}s ({counters['queries'] / elapsed:.0f} queries/s)")
+    print(f"torn snapshots: {counters['torn']}, wrong results: {counters['wrong']}, errors: {counters['errors']}")
+    print(f"final index: {app.current_snapshot().ntotal} vectors, {len(app.vector_store.segments)} segments")
+    if counters['torn'] or counters['wrong'] or counters['errors']:
+        sys.exit(1)
+
+
+def bench_search(args):
+    """Retrieval throughput of concurrent clients with and without query micro-batching, plus /api/search."""
+    directory = tempfile.mkdtemp(prefix='rag-search-')
+    paths = generate_corpus(os.path.join(directory, 'corpus'), args.documents, pages=args.pages)
+    use_temporary_store(directory)
+    app.ingest_documents(paths, workers=1)
+    rng = np.random.default_rng(1)
+    queries = [synthetic_page(rng, 80) for _ in range(512)]
+    print(f"{app.current_snapshot().ntotal} chunks from {len(paths)} documents, mode {args.mode}")
+    app.encode_queries(queries[:8])
+
+    def run(users):
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        def client(seed):
+            for i in range(args.requests):
+                query = queries[(seed * args.requests + i) % len(queries)]
+                start = time.perf_counter()
+                app.retrieve([query], args.k, mode=args.mode)
+                with latencies_lock:
+                    latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return np.array(latencies) * 1000, time.perf_counter() - start
+
+    print(f"{'clients':>7} {'batching':>9} {'queries/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'avg batch':>9}")
+    for users in args.users:
+        for batch_size in (1, args.batch_size):
+            app.query_encoder = MicroBatcher(app.encode_queries, max_batch_size=batch_size, max_wait_ms=args.wait_ms)
+            app.dense_searcher = MicroBatcher(app.search_dense_batch, max_batch_size=batch_size, max_wait_ms=0)
+            latencies_ms, elapsed = run(users)
+            p50, p95 = np.percentile(latencies_ms, [50, 95])
+            print(f"{users:7d} {'off' if batch_size == 1 else batch_size:>9} {len(latencies_ms) / elapsed:10.1f} "
+                  f"{p50:8.2f} {p95:8.2f} {app.query_encoder.get_stats()['average_batch_size']:9.1f}")
+
+    # One multi-query request against the same queries sent one by one
+    client = app.app.test_client()
+    batch = queries[:app.MAX_SEARCH_QUERIES]
+    start = time.perf_counter()
+    for query in batch:
+        client.post('/api/search', json={'query': query, 'top_k': args.k, 'mode': args.mode})
+    single_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    response = client.post('/api/search', json={'queries': batch, 'top_k': args.k, 'mode': args.mode})
+    multi_seconds = time.perf_counter() - start
+    results = response.get_json()['results']
+    print(f"/api/search, {len(batch)} queries: one per request {single_seconds * 1000:.1f} ms, "
+          f"one request {multi_seconds * 1000:.1f} ms ({single_seconds / multi_seconds:.1f}x), "
+          f"{sum(len(result['contexts']) for result in results)} contexts")
+
+
+def bench_reindex(args):
+    """Reindex a corpus repeatedly, then edit and delete documents; the index must not grow with duplicates."""
+    import docx
+
+    directory = tempfile.mkdtemp(prefix='rag-reindex-')
+    paths = generate_corpus(os.path.join(directory, 'corpus'), args.documents, pages=args.pages)
+    use_temporary_store(directory)
+    print(f"Generated {len(paths)} documents with {args.pages} pages each in {directory}")
+
+    # Count the chunks that actually go through the embedding model
+    encode = app.get_embedding_model().encode
+    encoded = [0]
+
+    def counting_encode(sentences, *encode_args, **encode_kwargs):
+        encoded[0] += len(sentences)
+        return encode(sentences, *encode_args, **encode_kwargs)
+
+    app.embedding_model.encode = counting_encode
+    failures = []
+
+    def run(label):
+        encoded[0] = 0
+        start = time.perf_counter()
+        app.ingest_documents(paths, workers=args.workers)
+        seconds = time.perf_counter() - start
+        ntotal = app.current_snapshot().ntotal
+        print(f"{label:24} {ntotal:7d} vectors  {encoded[0]:6d} chunks encoded  {seconds:6.2f}s")
+        if ntotal != len(app.current_snapshot().metadata):
+            failures.append(f"{label}: index has {ntotal} vectors but metadata {len(app.current_snapshot().metadata)} chunks")
+        failures.extend(f"{label}: {mismatch}" for mismatch in catalog_mismatches(app.vector_store))
+        return ntotal
+
+    initial = run('initial index')
+    for round_number in range(1, args.rounds + 1):
+        ntotal = run(f"reindex {round_number}")
+        if ntotal != initial or encoded[0]:
+            failures.append(f"reindex {round_number}: {ntotal} vectors (expected {initial}), {encoded[0]} chunks encoded")
+
+    # Appending a page to one document only changes its last chunks
+    edited_path = next(path for path in paths if path.endswith('.docx'))
+    document = docx.Document(edited_path)
+    document.add_paragraph(synthetic_page(np.random.default_rng(1), 2000))
+    document.save(edited_path)
+    edited = run('after editing 1 document')
+    if not 0 < encoded[0] <= 4 or edited <= initial:
+        failures.append(f"edit: {encoded[0]} chunks encoded, {edited} vectors (had {initial})")
+    if run('reindex after edit') != edited or encoded[0]:
+        failures.append('reindex after edit changed the index')
+
+    removed = app.delete_document(os.path.basename(paths[0]))
+    ntotal = app.current_snapshot().ntotal
+    print(f"{'after deleting 1 document':24} {ntotal:7d} vectors  ({removed} chunks removed)")
+    if not removed or ntotal != edited - removed or os.path.basename(paths[0]) in app.current_snapshot().metadata.sources():
+        failures.append(f"delete: {removed} chunks removed, {ntotal} vectors left (had {edited})")
+    failures.extend(f"delete: {mismatch}" for mismatch in catalog_mismatches(app.vector_store))
+
+    app.embedding_model.encode = encode
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def catalog_mismatches(store):
+    """Differences between the store's maintained catalog and one rebuilt from its segments."""
+    expected = store._build_catalog(store.segments)
+    mismatches = []
+    for name in set(expected) | set(store.catalog):
+        entry, rebuilt = store.catalog.get(name), expected.get(name)
+        if entry is None or rebuilt is None:
+            mismatches.append(f"catalog entry of {name}: {entry} (expected {rebuilt})")
+        elif (entry['chunks'], entry['bytes']) != (rebuilt['chunks'], rebuilt['bytes']) \
+                or entry['first_id'] > rebuilt['first_id'] or entry['last_id'] < rebuilt['last_id']:
+            mismatches.append(f"catalog entry of {name}: {entry} (expected {rebuilt})")
+    return mismatches
+
+
+def bench_catalog(args):
+    """Latency of document listing and stats on a store with many documents, catalog vs. scanning the chunks."""
+    directory = tempfile.mkdtemp(prefix='rag-catalog-')
+    store = SegmentStore(os.path.join(directory, 'store'), app.embedding_dimension, max_segments=args.segments)
+    rng = np.random.default_rng(0)
+    per_commit = args.documents // args.commits
+    for commit in range(args.commits):
+        records = [{'full_text': synthetic_chunk(chunk, 200), 'source': f"doc-{commit * per_commit + doc:07d}.pdf",
+                    'chunk_id': f"doc-{commit * per_commit + doc:07d}.pdf-chunk-{chunk}"}
+                   for doc in range(per_commit) for chunk in range(args.chunks)]
+        store.append(rng.standard_normal((len(records), store.dimension), dtype='float32'), records)
+    # Delete a tenth of the documents so the segments carry tombstones
+    store.delete([chunk_id for doc in range(0, per_commit * args.commits, 10)
+                  for chunk_id in store.metadata.source_ids(f"doc-{doc:07d}.pdf")])
+    print(f"{len(store.catalog)} documents, {store.count} chunks in {len(store.segments)} segments")
+
+    def scan_sources():
+        # What listing did before the catalog: collect the sources of the live rows of every segment
+        sources = set()
+        for segment, files in zip(store.segments, store.metadata.files):
+            live = ~np.isin(files.columns['id'], files.tombstones(segment)) if segment.get('deleted') else slice(None)
+            sources.update(files.sources[source] for source in np.unique(files.columns['source'][live]))
+        return sorted(sources)
+
+    app.STORE_DIR = store.directory
+    app.INDEX_CACHE_PATH = os.path.join(directory, 'index.faiss')
+    app.INDEX_CACHE_STATE_PATH = os.path.join(directory, 'index.faiss.json')
+    app.initialize_index()
+    client = app.app.test_client()
+    timings = {
+        'scan every segment': lambda: scan_sources(),
+        'list page 1': lambda: client.get('/api/list-documents?limit=100'),
+        'list last page': lambda: client.get(f"/api/list-documents?limit=100&offset={len(store.catalog) - 100}"),
+        'list filtered': lambda: client.get('/api/list-documents?q=doc-00012'),
+        'list by recency': lambda: client.get('/api/list-documents?sort=recent'),
+        'stats': lambda: client.get('/api/stats'),
+    }
+    for label, function in timings.items():
+        function()
+        latencies = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            function()
+            latencies.append(time.perf_counter() - start)
+        print(f"{label:20} p50 {np.percentile(latencies, 50) * 1000:8.2f}ms")
+    mismatches = catalog_mismatches(store)
+    for mismatch in mismatches[:10]:
+        print(f"FAILED {mismatch}")
+    if mismatches:
+        sys.exit(1)
+    print(json.dumps(client.get('/api/stats').get_json()))
+
+
+def bench_filter(args):
+    """Latency and recall of source-filtered dense search vs. post-filtering a global search, on a synthetic corpus."""
+    directory = tempfile.mkdtemp(prefix='rag-filter-')
+    rng = np.random.default_rng(0)
+    dimension = app.embedding_dimension
+    app.STORE_DIR = os.path.join(directory, 'store')
+    app.INDEX_CACHE_PATH = os.path.join(directory, 'index.faiss')
+    app.INDEX_CACHE_STATE_PATH = os.path.join(directory, 'index.faiss.json')
+    app.INDEX_TYPE = args.index_type
+    store = SegmentStore(app.STORE_DIR, dimension)
+    names = [f"doc-{doc:05d}{['.pdf', '.docx', '.pptx'][doc % 3]}" for doc in range(args.documents)]
+    per_commit = max(1, args.documents // 10)
+    for first in range(0, args.documents, per_commit):
+        records = [{'full_text': synthetic_chunk(chunk, 100), 'source': name, 'chunk_id': f"{name}-chunk-{chunk}"}
+                   for name in names[first:first + per_commit] for chunk in range(args.chunks)]
+        store.append(clustered_vectors(len(records), dimension, args.clusters, rng), records)
+    app.initialize_index()
+    current = app.current_snapshot()
+    queries = clustered_vectors(args.queries, dimension, args.clusters, rng)
+    print(f"{current.ntotal} chunks of {args.documents} documents, {app.index_type_of(current.index)} index, "
+          f"k={args.k}, exact below {app.FILTER_EXACT_MAX} chunks")
+
+    def post_filter(query, allowed):
+        # Search the whole index and drop other documents, fetching more until k chunks are left
+        fetch = args.k
+        while True:
+            D, I = current.search(query[None, :], fetch)
+            kept = I[0][np.isin(I[0], allowed)]
+            if len(kept) >= args.k or fetch >= current.ntotal:
+                return kept[:args.k]
+            fetch *= 4
+
+    filters = {
+        '1 document': {'sources': names[:1]},
+        '10 documents': {'sources': names[:10]},
+        f"{args.documents // 10} documents": {'sources': names[:args.documents // 10]},
+        'pptx (1/3)': {'formats': ['pptx']},
+    }
+    print(f"{'filter':16} {'chunks':>7} {'post-filter p50':>16} {'recall@k':>9} {'filtered p50':>13} {'recall@k':>9}")
+    for label, spec in filters.items():
+        spec = {'sources': None, 'formats': None, **spec}
+        allowed = app.filtered_ids(current, spec)
+        vectors = current.metadata.get_vectors(allowed)
+        timings = {'post': [], 'filtered': []}
+        recalls = {'post': [], 'filtered': []}
+        for query in queries:
+            start = time.perf_counter()
+            post_found = post_filter(query, allowed)
+            timings['post'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            ids = app.filtered_ids(current, spec)
+            _, found = app.search_dense_filtered(current, query, args.k, ids)
+            timings['filtered'].append(time.perf_counter() - start)
+            exact = allowed[np.argsort(np.sum((vectors - query) ** 2, axis=1))[:args.k]]
+            recalls['post'].append(recall_at_k([post_found], [exact]))
+            recalls['filtered'].append(recall_at_k([found], [exact]))
+        print(f"{label:16} {len(allowed):7d} {np.percentile(timings['post'], 50) * 1000:14.2f}ms "
+              f"{np.mean(recalls['post']):9.3f} {np.percentile(timings['filtered'], 50) * 1000:11.2f}ms "
+              f"{np.mean(recalls['filtered']):9.3f}")
+
+
+def bench_embedcache(args):
+    """Rebuild a corpus from scratch with a cold, then a warm embedding cache."""
+    directory = tempfile.mkdtemp(prefix='rag-embedcache-')
+    paths = generate_corpus(os.path.join(directory, 'corpus'), args.documents, pages=args.pages)
+    print(f"Generated {len(paths)} documents with {args.pages} pages each in {directory}")
+    app.get_embedding_model().encode(['warm up'])
+
+    use_temporary_store(os.path.join(directory, 'cold'))
+    cache = app.embedding_cache
+    for label in ('cold', 'warm'):
+        # Each run starts from an empty vector store; only the embedding cache is shared
+        use_temporary_store(os.path.join(directory, label))
+        app.embedding_cache = cache
+        cache_counts = {}
+        start = time.perf_counter()
+        indexed = app.ingest_documents(paths, workers=args.workers, cache_counts=cache_counts)
+        seconds = time.perf_counter() - start
+        print(f"{label} cache  {indexed / seconds:7.2f} docs/sec ({seconds:.2f}s)  {app.describe_cache_counts(cache_counts)}")
+    stats = cache.get_stats()
+    print(f"cache: {stats['entries']}/{stats['max_entries']} entries, {stats['evictions']} evictions")
+
+
+def bench_watcher(args):
+    """Events, hashes, registry writes and ingestion jobs caused by bursts of editor saves in the watched folder."""
+    directory = tempfile.mkdtemp(prefix='rag-watcher-')
+    use_temporary_store(directory)
+    sources = generate_corpus(os.path.join(directory, 'corpus'), args.documents)
+    watched = os.path.join(directory, 'watched')
+    os.makedirs(watched)
+    app.DOCUMENTS_FOLDER = watched
+    app.PROCESSED_FILES_REGISTRY = os.path.join(directory, 'processed_files.pkl')
+    app.job_queue = JobQueue(os.path.join(directory, 'jobs'), app.run_ingestion_job)
+    app.job_queue.start()
+    app.load_processed_files()
+
+    counts = {'hashes': 0, 'registry_saves': 0}
+    file_md5, save_processed_files = app.file_md5, app.save_processed_files
+
+    def counted_md5(*a, **kw):
+        counts['hashes'] += 1
+        return file_md5(*a, **kw)
+
+    def counted_save():
+        counts['registry_saves'] += 1
+        save_processed_files()
+
+    app.file_md5, app.save_processed_files = counted_md5, counted_save
+    handler_seconds = []
+    dispatch = app.DocumentHandler.dispatch
+
+    def timed_dispatch(self, event):
+        start = time.perf_counter()
+        dispatch(self, event)
+        handler_seconds.append(time.perf_counter() - start)
+
+    app.DocumentHandler.dispatch = timed_dispatch
+    observer = app.start_document_observer()
+    try:
+        for round_number in range(args.rounds):
+            for source in sources:
+                with open(source, 'rb') as f:
+                    data = f.read()
+                # Editors write a document in several flushed pieces
+                target = os.path.join(watched, os.path.basename(source))
+                piece = -(-len(data) // args.writes)
+                with open(target, 'wb') as f:
+                    for start in range(0, len(data), piece):
+                        f.write(data[start:start + piece])
+                        f.flush()
+                        os.fsync(f.fileno())
+            time.sleep(app.WATCH_DEBOUNCE_SECONDS * 2 + 0.5)
+        while any(job['status'] in ('queued', 'running') for job in app.job_queue.jobs.values()):
+            time.sleep(0.1)
+    finally:
+        observer.stop()
+        observer.join()
+        app.DocumentHandler.dispatch = dispatch
+        app.file_md5, app.save_processed_files = file_md5, save_processed_files
+
+    stats = app.watch_scheduler.get_stats()
+    jobs = list(app.job_queue.jobs.values())
+    indexed = sorted(app.current_snapshot().metadata.sources())
+    print(f"{args.documents} documents saved {args.rounds} times in {args.writes} writes each")
+    print(f"watchdog events: {len(handler_seconds)}, observer thread busy p50 "
+          f"{np.percentile(np.array(handler_seconds) * 1e6, 50):.0f}us max {max(handler_seconds) * 1e6:.0f}us")
+    print(f"debounced: {stats['events']} events -> {stats['handled']} changes in {stats['batches']} batches")
+    print(f"hashes: {counts['hashes']}, registry saves: {counts['registry_saves']}, "
+          f"ingestion jobs: {len(jobs)} ({sum(job['status'] == 'done' for job in jobs)} done), "
+          f"documents indexed: {len(indexed)}")
+
+
+def bench_shards(args):
+    """Fan-out search over several collections, sequential vs. parallel, against one collection holding every chunk."""
+    directory = tempfile.mkdtemp(prefix='rag-shards-')
+    rng = np.random.default_rng(0)
+    dimension = app.embedding_dimension
+    app.COLLECTIONS_DIR = os.path.join(directory, 'collections')
+    app.STORE_DIR = os.path.join(directory, 'store')
+    app.INDEX_CACHE_PATH = os.path.join(directory, 'index.faiss')
+    app.INDEX_CACHE_STATE_PATH = os.path.join(directory, 'index.faiss.json')
+    app.INDEX_TYPE = args.index_type
+    names = [f"tenant-{number:02d}" for number in range(args.collections)]
+    combined = SegmentStore(app.STORE_DIR, dimension)
+    chunk_ids = []
+    for name in names:
+        vectors = clustered_vectors(args.chunks, dimension, args.clusters, rng)
+        records = [{'full_text': synthetic_chunk(chunk, 100), 'source': f"{name}-{chunk // 100:04d}.pdf",
+                    'chunk_id': f"{name}-{chunk // 100:04d}.pdf-chunk-{chunk % 100}"} for chunk in range(args.chunks)]
+        SegmentStore(os.path.join(app.COLLECTIONS_DIR, name, 'store'), dimension).append(vectors, records)
+        combined.append(vectors, records)
+        chunk_ids.extend(record['chunk_id'] for record in records)
+    chunk_ids = np.array(chunk_ids)
+    app.initialize_index()
+    everything = app.current_snapshot()
+
+    start = time.perf_counter()
+    collections = [app.get_collection(name) for name in names]
+    for collection in collections:
+        app.current_snapshot(collection)
+    load_seconds = time.perf_counter() - start
+    print(f"{args.collections} collections of {args.chunks} chunks ({app.index_type_of(everything.index)} index), "
+          f"loaded lazily in {load_seconds * 1000:.0f}ms; k={args.k}, {args.queries} queries")
+
+    stored = np.vstack([vectors for _, vectors in combined.load_vectors()])
+    queries = stored[rng.integers(len(stored), size=args.queries)]
+    queries += 0.1 * rng.standard_normal(queries.shape, dtype='float32')
+    _, expected = faiss.knn(queries, stored, args.k)
+
+    pool = app.fanout_pool
+    runs = [
+        ('one collection', [app.default_collection], 1),
+        ('fan-out, sequential', collections, 1),
+        (f"fan-out, {args.workers} threads", collections, args.workers),
+    ]
+    print(f"{'search':24} {'p50':>9} {'p95':>9} {'recall@k':>9}")
+    try:
+        for label, searched, workers in runs:
+            app.fanout_pool = ThreadPoolExecutor(max_workers=workers)
+            timings = []
+            found = []
+            for query in queries:
+                start = time.perf_counter()
+                contexts = app.search_collections(searched, ['query'], query[None, :], args.k, 'dense')[0]
+                timings.append(time.perf_counter() - start)
+                found.append([context['chunk_id'] for context in contexts])
+            app.fanout_pool.shutdown()
+            recall = recall_at_k(found, [chunk_ids[row].tolist() for row in expected])
+            print(f"{label:24} {np.percentile(timings, 50) * 1000:7.2f}ms {np.percentile(timings, 95) * 1000:7.2f}ms "
+                  f"{recall:9.3f}")
+    finally:
+        app.fanout_pool = pool
+
+    rss = app.process_rss_bytes()
+    app.COLLECTION_IDLE_SECONDS = 0
+    evicted = app.evict_idle_collections()
+    gc.collect()
+    freed = rss - app.process_rss_bytes() if rss is not None else None
+    start = time.perf_counter()
+    app.current_snapshot(collections[0])
+    reload_ms = (time.perf_counter() - start) * 1000
+    print(f"evicted {len(evicted)} idle collections"
+          + (f", {freed / 2**20:.0f} MB released" if freed is not None else '')
+          + f"; reloading one took {reload_ms:.0f}ms")
+
+
+# Latency and throughput metrics of the end-to-end benchmark compared with a baseline, each
+# with whether a larger value is better. Counts and memory figures are only reported.
+COMPARED_METRICS = {
+    'model_load_seconds': False,
+    'ingest_seconds': False,
+    'ingest_documents_per_sec': True,
+    'ingest_chunks_per_sec': True,
+    'index_build_seconds': False,
+    'index_load_seconds': False,
+    **{f"{prefix}_{percentile}_ms": False
+       for prefix in ('search_dense', 'search_lexical', 'search_hybrid', 'chat', 'chat_stream_first_token')
+       for percentile in ('p50', 'p95', 'p99')},
+}
+
+
+def memory_mb(field):
+    """A memory field of /proc/self/status (VmRSS, VmHWM) in MB, or None where it is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            return int(f.read().split(field + ':')[1].split()[0]) / 1024
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def latency_percentiles(prefix, seconds):
+    """p50, p95 and p99 of a list of durations, in milliseconds."""
+    p50, p95, p99 = np.percentile(np.array(seconds) * 1000, [50, 95, 99])
+    return {f"{prefix}_p50_ms": p50, f"{prefix}_p95_ms": p95, f"{prefix}_p99_ms": p99}
+
+
+def git_revision():
+    """Short hash of the checked out commit, suffixed with '-dirty' when the tree has changes."""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=backend_dir,
+                                check=True, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no', '.'], cwd=backend_dir,
+                               check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def compare_results(baseline, metrics_now, tolerance):
+    """Print each of COMPARED_METRICS against a baseline run; returns the names of those that
+    regressed by more than ``tolerance``."""
+    regressions = []
+    print(f"\n{'metric':32} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, higher_is_better in COMPARED_METRICS.items():
+        before = baseline['metrics'].get(name)
+        value = metrics_now.get(name)
+        if before is None or value is None or not before:
+            continue
+        change = (value - before) / abs(before)
+        worse = -change if higher_is_better else change
+        flag = ' REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:32} {before:12.3f} {value:12.3f} {change:+7.1%}{flag}")
+    return regressions
+
+
+def bench_e2e(args):
+    """End-to-end run on a synthetic corpus: ingestion, index build, retrieval and /api/chat (stub LLM), saved as JSON."""
+    directory = tempfile.mkdtemp(prefix='rag-e2e-')
+    results = {}
+    failures = []
+    rss_before = memory_mb('VmRSS')
+
+    start = time.perf_counter()
+    paths = generate_corpus(os.path.join(directory, 'corpus'), args.documents, pages=args.pages)
+    print(f"Generated {len(paths)} PDF/DOCX/PPTX documents with {args.pages} pages in "
+          f"{time.perf_counter() - start:.1f}s ({directory})")
+    use_temporary_store(directory)
+    # Ingestion, the build below and initialize_index() all use the requested index type
+    app.INDEX_TYPE = args.index_type
+    # Every query must go through retrieval and the LLM, not the query cache
+    app.query_cache = QueryCache(max_entries=0)
+    start = time.perf_counter()
+    app.get_embedding_model()
+    results['model_load_seconds'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = app.ingest_documents(paths, workers=args.workers)
+    seconds = time.perf_counter() - start
+    current = app.current_snapshot()
+    results.update(ingest_seconds=seconds, ingest_documents_per_sec=indexed / seconds,
+                   ingest_chunks_per_sec=current.ntotal / seconds, chunks=current.ntotal)
+    if indexed != len(paths):
+        failures.append(f"ingestion: {indexed} of {len(paths)} documents indexed")
+    if current.ntotal != len(current.metadata):
+        failures.append(f"ingestion: index has {current.ntotal} vectors but metadata {len(current.metadata)} chunks")
+
+    start = time.perf_counter()
+    app.build_index_from_store(app.target_index_type(current.ntotal))
+    results['index_build_seconds'] = time.perf_counter() - start
+    start = time.perf_counter()
+    app.initialize_index()
+    results['index_load_seconds'] = time.perf_counter() - start
+    current = app.current_snapshot()
+
+    rng = np.random.default_rng(0)
+    ids = current.metadata.ids_of_sources(current.metadata.catalog_names)
+    texts = [current.metadata[int(chunk_id)]['full_text'] for chunk_id in rng.choice(ids, size=args.queries)]
+    queries = [' '.join(text.split()[:args.query_words]) for text in texts]
+    for mode in ('dense', 'lexical', 'hybrid'):
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            contexts = app.retrieve([query], args.k, mode=mode, rerank=False)[0]
+            timings.append(time.perf_counter() - start)
+            if not contexts:
+                failures.append(f"{mode} search: no contexts for '{query}'")
+        results.update(latency_percentiles(f"search_{mode}", timings))
+
+    server = start_stub_ollama()
+    client = app.app.test_client()
+    blocking, first_token = [], []
+    try:
+        for query in queries[:args.chats]:
+            start = time.perf_counter()
+            response = client.post('/api/chat', json={'query': query})
+            blocking.append(time.perf_counter() - start)
+            if response.status_code != 200 or not response.json.get('response') or not response.json.get('contexts'):
+                failures.append(f"/api/chat: {response.status_code} {response.get_data(as_text=True)[:200]}")
+
+            start = time.perf_counter()
+            response = client.post('/api/chat/stream', json={'query': query}, buffered=False)
+            for line in response.response:
+                if line.startswith(b'event: token'):
+                    first_token.append(time.perf_counter() - start)
+                    break
+            else:
+                failures.append(f"/api/chat/stream: no token for '{query}'")
+            response.close()
+    finally:
+        server.shutdown()
+    results.update(latency_percentiles('chat', blocking))
+    results.update(latency_percentiles('chat_stream_first_token', first_token))
+    results.update(rss_mb=memory_mb('VmRSS'), peak_rss_mb=memory_mb('VmHWM'),
+                   rss_growth_mb=memory_mb('VmRSS') - rss_before if rss_before is not None else None)
+
+    for name, value in results.items():
+        print(f"{name:32} {value:12.3f}" if isinstance(value, float) else f"{name:32} {value!s:>12}")
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.time(),
+            'python': sys.version.split()[0],
+            'faiss': faiss.__version__,
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+            'index_type': app.index_type_of(current.index),
+            'embedding_backend': app.EMBEDDING_BACKEND,
+            'retrieval_mode': app.RETRIEVAL_MODE,
+            'args': {name: value for name, value in vars(args).items() if name != 'func'},
+        },
+        'metrics': results,
+        'failures': failures,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline['meta'].get('revision')} ({args.compare}), tolerance {args.tolerance:.0%}")
+        regressions = compare_results(baseline, results, args.tolerance)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if regressions:
+        print(f"FAILED {len(regressions)} metrics regressed: {', '.join(regressions)}")
+    if failures or regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help=bench_ingest.__doc__)
+    ingest.add_argument('--folder', default=app.UPLOAD_FOLDER)
+    ingest.add_argument('--batch-size', type=int, default=app.EMBEDDING_BATCH_SIZE)
+    ingest.add_argument('--repeat', type=int, default=1, help='Repeat the sample chunks to enlarge the corpus')
+    ingest.set_defaults(func=bench_ingest)
+
+    coldstart = subparsers.add_parser('coldstart', help=bench_coldstart.__doc__)
+    coldstart.add_argument('--chunks', type=int, default=1_000_000)
+    coldstart.add_argument('--text-chars', type=int, default=1000)
+    coldstart.add_argument('--segment-size', type=int, default=100_000)
+    coldstart.add_argument('--dir', help='Reuse a previously generated corpus')
+    coldstart.set_defaults(func=bench_coldstart)
+
+    startup = subparsers.add_parser('startup', help=bench_startup.__doc__)
+    startup.add_argument('--mode', choices=['wsgi', 'asgi'], default='asgi')
+    startup.add_argument('--runs', type=int, default=3)
+    startup.add_argument('--port', type=int, default=5111, help='App port; the stub Ollama uses port + 1')
+    startup.add_argument('--timeout', type=float, default=300)
+    startup.add_argument('--query', default='Quelles sont les compétences du candidat ?')
+    startup.set_defaults(func=bench_startup)
+
+    ann = subparsers.add_parser('ann', help=bench_ann.__doc__)
+    ann.add_argument('--vectors', type=int, default=200_000)
+    ann.add_argument('--queries', type=int, default=500)
+    ann.add_argument('--clusters', type=int, default=1000)
+    ann.add_argument('--k', type=int, default=3)
+    ann.add_argument('--nprobe', type=int, default=app.INDEX_PARAMS['nprobe'])
+    ann.add_argument('--ef-search', type=int, default=app.INDEX_PARAMS['ef_search'])
+    ann.add_argument('--types', nargs='+', choices=INDEX_TYPES)
+    ann.set_defaults(func=bench_ann)
+
+    ttft = subparsers.add_parser('ttft', help=bench_ttft.__doc__)
+    ttft.add_argument('--requests', type=int, default=20)
+    ttft.add_argument('--query', default='Quelles sont les compétences du candidat ?')
+    ttft.set_defaults(func=bench_ttft)
+
+    load = subparsers.add_parser('load', help=bench_load.__doc__)
+    load.add_argument('--mode', choices=['wsgi', 'asgi'], default='asgi')
+    load.add_argument('--users', type=int, default=32)
+    load.add_argument('--requests', type=int, default=5, help='Requests per user')
+    load.add_argument('--llm-concurrency', type=int, default=4, help='LLM_MAX_CONCURRENCY for the asgi mode')
+    load.add_argument('--port', type=int, default=5101, help='App port; the stub Ollama uses port + 1')
+    load.add_argument('--timeout', type=float, default=120)
+    load.add_argument('--query', default='Quelles sont les compétences du candidat ?')
+    load.set_defaults(func=bench_load)
+
+    largedoc = subparsers.add_parser('largedoc', help=bench_largedoc.__doc__)
+    largedoc.add_argument('--pages', type=int, default=5000)
+    largedoc.add_argument('--chars-per-page', type=int, default=3000)
+    largedoc.set_defaults(func=bench_largedoc)
+
+    hybrid = subparsers.add_parser('hybrid', help=bench_hybrid.__doc__)
+    hybrid.add_argument('--folder', default=app.UPLOAD_FOLDER)
+    hybrid.add_argument('--k', type=int, default=3)
+    hybrid.add_argument('--chunks', type=int, default=100_000)
+    hybrid.add_argument('--vocabulary', type=int, default=50_000)
+    hybrid.add_argument('--words-per-chunk', type=int, default=150)
+    hybrid.add_argument('--queries', type=int, default=200)
+    hybrid.add_argument('--budget-ms', type=float, default=LATENCY_BUDGET_MS)
+    hybrid.set_defaults(func=bench_hybrid)
+
+    embeddings = subparsers.add_parser('embeddings', help=bench_embeddings.__doc__)
+    embeddings.add_argument('--folder', default=app.UPLOAD_FOLDER)
+    embeddings.add_argument('--backends', nargs='+', choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKENDS)
+    embeddings.add_argument('--repeat', type=int, default=1, help='Repeat the sample chunks to enlarge the corpus')
+    embeddings.add_argument('--batch-size', type=int, default=app.EMBEDDING_BATCH_SIZE)
+    embeddings.add_argument('--queries', type=int, default=200)
+    embeddings.add_argument('--query-chars', type=int, default=120, help='Length of the queries cut from chunks')
+    embeddings.add_argument('--latency-queries', type=int, default=100)
+    embeddings.add_argument('--k', type=int, default=10)
+    embeddings.add_argument('--max-recall-delta', type=float, default=MAX_RECALL_DELTA)
+    embeddings.set_defaults(func=bench_embeddings)
+
+    packing = subparsers.add_parser('packing', help=bench_packing.__doc__)
+    packing.add_argument('--folder', default=app.UPLOAD_FOLDER)
+    packing.add_argument('--k', type=int, default=3)
+    packing.add_argument('--budget', type=int, default=app.CONTEXT_TOKEN_BUDGET)
+    packing.add_argument('--ollama-url', help='Measure a real Ollama instead of the stub')
+    packing.add_argument('--prefill-per-token', type=float, default=0.005,
+                         help='Stub prefill seconds per prompt token (CPU 7B models: a few ms)')
+    packing.set_defaults(func=bench_packing)
+
+    rerank = subparsers.add_parser('rerank', help=bench_rerank.__doc__)
+    rerank.add_argument('--folder', default=app.UPLOAD_FOLDER)
+    rerank.add_argument('--k', type=int, default=3)
+    rerank.add_argument('--mode', choices=['dense', 'lexical', 'hybrid'], default='dense')
+    rerank.add_argument('--candidates', type=int, default=app.RERANK_CANDIDATES)
+    rerank.add_argument('--deadline-ms', type=float, default=app.RERANK_DEADLINE_MS)
+    rerank.set_defaults(func=bench_rerank)
+
+    metrics_parser = subparsers.add_parser('metrics', help=bench_metrics.__doc__)
+    metrics_parser.add_argument('--documents', type=int, default=6)
+    metrics_parser.add_argument('--requests', type=int, default=20)
+    metrics_parser.add_argument('--observations', type=int, default=100000)
+    metrics_parser.set_defaults(func=bench_metrics)
+
+    pipeline = subparsers.add_parser('pipeline', help=bench_pipeline.__doc__)
+    pipeline.add_argument('--documents', type=int, default=60)
+    pipeline.add_argument('--pages', type=int, default=20)
+    pipeline.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    pipeline.set_defaults(func=bench_pipeline)
+
+    stress = subparsers.add_parser('stress', help=bench_stress.__doc__)
+    stress.add_argument('--documents', type=int, default=200)
+    stress.add_argument('--chunks', type=int, default=20, help='Chunks per document')
+    stress.add_argument('--readers', type=int, default=8)
+    stress.add_argument('--max-segments', type=int, default=8)
+    stress.set_defaults(func=bench_stress)
+
+    search = subparsers.add_parser('search', help=bench_search.__doc__)
+    search.add_argument('--documents', type=int, default=12)
+    search.add_argument('--pages', type=int, default=20)
+    search.add_argument('--users', type=int, nargs='+', default=[1, 8, 32])
+    search.add_argument('--requests', type=int, default=50, help='Queries per client')
+    search.add_argument('--k', type=int, default=3)
+    search.add_argument('--mode', choices=['dense', 'lexical', 'hybrid'], default=app.RETRIEVAL_MODE)
+    search.add_argument('--batch-size', type=int, default=app.QUERY_BATCH_SIZE)
+    search.add_argument('--wait-ms', type=float, default=app.QUERY_BATCH_WAIT_MS)
+    search.set_defaults(func=bench_search)
+
+    reindex = subparsers.add_parser('reindex', help=bench_reindex.__doc__)
+    reindex.add_argument('--documents', type=int, default=12)
+    reindex.add_argument('--pages', type=int, default=10)
+    reindex.add_argument('--rounds', type=int, default=3)
+    reindex.add_argument('--workers', type=int, default=app.INGEST_WORKERS)
+    reindex.set_defaults(func=bench_reindex)
+
+    embedcache = subparsers.add_parser('embedcache', help=bench_embedcache.__doc__)
+    embedcache.add_argument('--documents', type=int, default=30)
+    embedcache.add_argument('--pages', type=int, default=20)
+    embedcache.add_argument('--workers', type=int, default=app.INGEST_WORKERS)
+    embedcache.set_defaults(func=bench_embedcache)
+
+    filtered = subparsers.add_parser('filter', help=bench_filter.__doc__)
+    filtered.add_argument('--documents', type=int, default=1000)
+    filtered.add_argument('--chunks', type=int, default=100)
+    filtered.add_argument('--clusters', type=int, default=100)
+    filtered.add_argument('--queries', type=int, default=50)
+    filtered.add_argument('--k', type=int, default=10)
+    filtered.add_argument('--index-type', default='flat', choices=['auto'] + INDEX_TYPES)
+    filtered.set_defaults(func=bench_filter)
+
+    catalog = subparsers.add_parser('catalog', help=bench_catalog.__doc__)
+    catalog.add_argument('--documents', type=int, default=20000)
+    catalog.add_argument('--chunks', type=int, default=5)
+    catalog.add_argument('--commits', type=int, default=40)
+    catalog.add_argument('--segments', type=int, default=32)
+    catalog.add_argument('--repeats', type=int, default=20)
+    catalog.set_defaults(func=bench_catalog)
+
+    watcher = subparsers.add_parser('watcher', help=bench_watcher.__doc__)
+    watcher.add_argument('--documents', type=int, default=6)
+    watcher.add_argument('--rounds', type=int, default=2)
+    watcher.add_argument('--writes', type=int, default=8)
+    watcher.set_defaults(func=bench_watcher)
+
+    shards = subparsers.add_parser('shards', help=bench_shards.__doc__)
+    shards.add_argument('--collections', type=int, default=8)
+    shards.add_argument('--chunks', type=int, default=25000, help='Chunks per collection')
+    shards.add_argument('--clusters', type=int, default=50)
+    shards.add_argument('--queries', type=int, default=100)
+    shards.add_argument('--k', type=int, default=10)
+    shards.add_argument('--workers', type=int, default=app.FANOUT_WORKERS)
+    shards.add_argument('--index-type', default='flat', choices=['auto'] + INDEX_TYPES)
+    shards.set_defaults(func=bench_shards)
+
+    e2e = subparsers.add_parser('e2e', help=bench_e2e.__doc__)
+    e2e.add_argument('--documents', type=int, default=30)
+    e2e.add_argument('--pages', type=int, default=10)
+    e2e.add_argument('--workers', type=int, default=app.INGEST_WORKERS)
+    e2e.add_argument('--index-type', default='auto', choices=['auto'] + INDEX_TYPES)
+    e2e.add_argument('--queries', type=int, default=100, help='Queries per retrieval mode')
+    e2e.add_argument('--query-words', type=int, default=8)
+    e2e.add_argument('--chats', type=int, default=10, help='Requests to /api/chat and /api/chat/stream')
+    e2e.add_argument('--k', type=int, default=3)
+    e2e.add_argument('--output', help='Write the results to this JSON file')
+    e2e.add_argument('--compare', help='JSON results of a previous run to compare with')
+    e2e.add_argument('--tolerance', type=float, default=0.2, help='Relative change counted as a regression')
+    e2e.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Token-aware packing of retrieved chunks into the prompt.
+
+Ollama's prefill time grows with the prompt, so the contexts sent to it are
+packed into a token budget instead of being pasted whole:
+
+* chunks with exactly the same text (e.g. a document uploaded twice) are
+  only kept once,
+* consecutive chunks of the same source are merged into one passage; the
+  overlap ``chunk_text_simple`` leaves between them is only kept once,
+* passages are added best ranked first while they fit in the budget. The
+  first passage that does not fit is cut at a word boundary if at least
+  ``MIN_TRUNCATED_TOKENS`` tokens are left, otherwise skipped for a smaller
+  one.
+
+Token counts are estimated without the LLM's tokenizer: words are split
+into pieces of at most four characters and every punctuation mark counts as
+one token. On French and English text this is close to, and usually a bit
+above, what BPE tokenizers produce, so the budget errs on the safe side.
+"""
+import re
+
+TOKEN_PATTERN = re.compile(r'\w{1,4}|[^\w\s]')
+
+# A passage cut to fewer tokens than this is not worth its header
+MIN_TRUNCATED_TOKENS = 48
+
+# Longest overlap looked for between consecutive chunks (chunks overlap by 100 characters)
+MAX_OVERLAP = 200
+
+
+def count_tokens(text):
+    """Estimated number of LLM tokens of a text."""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Longest prefix of a text with at most ``max_tokens`` tokens, cut at a word boundary."""
+    for number, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if number == max_tokens:
+            cut = match.start()
+            space = text.rfind(' ', 0, cut)
+            if space > cut // 2:
+                cut = space
+            return text[:cut].rstrip() + ' […]'
+    return text
+
+
+def overlap_length(left, right, max_overlap=MAX_OVERLAP):
+    """Length of the longest end of ``left`` that ``right`` starts with."""
+    for length in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def format_passage(number, passage):
+    """The block of the prompt presenting one passage."""
+    location = f"{passage['source']}, page {passage['page']}" if passage['page'] else passage['source']
+    return f"Document {number} (Source: {location}):\n{passage['content']}"
+
+
+def merge_adjacent(contexts):
+    """Group ranked contexts into passages of consecutive chunks of the same source.
+
+    Returns passages ordered by the rank of their best chunk. Each passage
+    is a dict with the source, the page of its first chunk, its chunk
+    numbers and its text.
+    """
+    runs = {}
+    for rank, context in enumerate(contexts):
+        runs.setdefault(context['source'], []).append((rank, context))
+
+    passages = []
+    for members in runs.values():
+        members.sort(key=lambda member: (member[1].get('chunk') is None, member[1].get('chunk') or 0))
+        current = None
+        for rank, context in members:
+            chunk = context.get('chunk')
+            if current is not None and chunk is not None and current['chunks'][-1] + 1 == chunk:
+                skip = overlap_length(current['content'], context['content'])
+                current['content'] += context['content'][skip:]
+                current['chunks'].append(chunk)
+                current['rank'] = min(current['rank'], rank)
+                continue
+            current = {'source': context['source'], 'page': context.get('page'), 'rank': rank,
+                       'chunks': [chunk] if chunk is not None else [], 'content': context['content']}
+            passages.append(current)
+            if chunk is None:
+                current = None
+    passages.sort(key=lambda passage: passage['rank'])
+    return passages
+
+
+def pack_contexts(contexts, budget):
+    """Pack ranked contexts into at most ``budget`` tokens of prompt passages.
+
+    Returns (passages, stats). Every passage carries its formatted ``tokens``
+    count and whether it was ``truncated``; stats compare the tokens of the
+    packed passages with those of the contexts pasted whole.
+    """
+    seen = set()
+    unique = []
+    for context in contexts:
+        key = context['content'].strip()
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(context)
+
+    packed = []
+    used = 0
+    for passage in merge_adjacent(unique):
+        number = len(packed) + 1
+        tokens = count_tokens(format_passage(number, passage))
+        passage['truncated'] = False
+        if used + tokens > budget:
+            header_tokens = count_tokens(format_passage(number, dict(passage, content='')))
+            room = budget - used - header_tokens
+            if room < MIN_TRUNCATED_TOKENS:
+                continue
+            # The ' […]' marking the cut is three tokens
+            passage['content'] = truncate_to_tokens(passage['content'], room - 3)
+            passage['truncated'] = True
+            tokens = count_tokens(format_passage(number, passage))
+        passage['tokens'] = tokens
+        packed.append(passage)
+        used += tokens
+
+    stats = {
+        'contexts': len(contexts),
+        'passages': len(packed),
+        'tokens': used,
+        'unpacked_tokens': sum(count_tokens(format_passage(i + 1, context)) for i, context in enumerate(contexts)),
+        'budget': budget,
+    }
+    return packed, stats
@@ -0,0 +1,161 @@
+"""Persistent, content-addressed cache of chunk embeddings.
+
+A chunk is keyed by a 16-byte BLAKE2b hash of the model name and its text,
+so the same text is only ever encoded once per model, whichever document or
+version of a document it comes from. Entries live in three memory-mapped
+arrays with a fixed number of slots:
+
+* ``vectors.npy`` float32 embeddings, one row per slot
+* ``keys.npy``    the key held by each slot
+* ``used.npy``    logical time each slot was last used, 0 for empty slots
+
+The hash index from keys to slots is rebuilt from ``keys.npy`` and
+``used.npy`` when the cache is opened. Once every slot is taken, the least
+recently used entry is overwritten. The key stored in a slot is checked on
+every hit, so an index entry that went stale (e.g. because another process
+reused the slot) only causes a miss, never a wrong vector.
+
+The files are opened (and created if needed) by ``open`` or the first
+lookup, not when the cache object is created.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from vector_store import atomic_write
+
+KEY_SIZE = 16
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of embeddings keyed by a hash of (model name, text)."""
+
+    def __init__(self, directory, model_name, dimension, max_entries=100_000):
+        self.directory = directory
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.slots = OrderedDict()  # key -> slot, least recently used first
+        self.free = []
+        self.clock = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.opened = False
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def open(self):
+        """Open the cache files now rather than on the first lookup (idempotent)."""
+        if self.enabled:
+            with self.lock:
+                self._open()
+
+    def _open(self):
+        """Open or create the cache files and rebuild the slot index. Called with the lock held."""
+        if self.opened:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        info_path = os.path.join(self.directory, 'cache.json')
+        info = {'model': self.model_name, 'dimension': self.dimension, 'max_entries': self.max_entries}
+        paths = [os.path.join(self.directory, name) for name in ('vectors.npy', 'keys.npy', 'used.npy')]
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                reuse = json.load(f) == info and all(os.path.exists(path) for path in paths)
+        except (OSError, ValueError):
+            reuse = False
+
+        if reuse:
+            self.vectors = np.load(paths[0], mmap_mode='r+')
+            self.keys = np.load(paths[1], mmap_mode='r+')
+            self.used = np.load(paths[2], mmap_mode='r+')
+        else:
+            # A different model, dimension or size starts a new cache
+            print(f"Creating embedding cache with {self.max_entries} entries in {self.directory}")
+            open_memmap = np.lib.format.open_memmap
+            self.vectors = open_memmap(paths[0], mode='w+', dtype='float32', shape=(self.max_entries, self.dimension))
+            self.keys = open_memmap(paths[1], mode='w+', dtype='uint8', shape=(self.max_entries, KEY_SIZE))
+            self.used = open_memmap(paths[2], mode='w+', dtype='<i8', shape=(self.max_entries,))
+            atomic_write(info_path, lambda f: json.dump(info, f), mode='w')
+
+        used = np.asarray(self.used)
+        occupied = np.nonzero(used)[0]
+        for slot in occupied[np.argsort(used[occupied], kind='stable')]:
+            self.slots[self.keys[slot].tobytes()] = int(slot)
+        self.free = np.nonzero(used == 0)[0][::-1].tolist()
+        self.clock = int(used.max()) if len(used) else 0
+        self.opened = True
+        if self.slots:
+            print(f"Loaded embedding cache with {len(self.slots)} entries from {self.directory}")
+
+    def key(self, text):
+        digest = hashlib.blake2b(digest_size=KEY_SIZE)
+        digest.update(self.model_name.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.digest()
+
+    def _touch(self, key, slot):
+        self.slots.move_to_end(key)
+        self.clock += 1
+        self.used[slot] = self.clock
+
+    def get_many(self, texts):
+        """Return a list with the cached embedding of each text, or None for misses."""
+        if not self.enabled:
+            return [None] * len(texts)
+        keys = [self.key(text) for text in texts]
+        results = []
+        with self.lock:
+            self._open()
+            for key in keys:
+                slot = self.slots.get(key)
+                if slot is not None and self.keys[slot].tobytes() == key:
+                    self._touch(key, slot)
+                    results.append(np.array(self.vectors[slot]))
+                else:
+                    if slot is not None:
+                        # The slot was taken over elsewhere; it now belongs to another key
+                        del self.slots[key]
+                    results.append(None)
+            hits = sum(result is not None for result in results)
+            self.stats['hits'] += hits
+            self.stats['misses'] += len(results) - hits
+        return results
+
+    def put_many(self, texts, vectors):
+        """Store freshly computed embeddings, evicting the least recently used entries."""
+        if not self.enabled:
+            return
+        keys = [self.key(text) for text in texts]
+        with self.lock:
+            self._open()
+            for key, vector in zip(keys, vectors):
+                slot = self.slots.get(key)
+                if slot is None:
+                    if self.free:
+                        slot = self.free.pop()
+                    else:
+                        _, slot = self.slots.popitem(last=False)
+                        self.stats['evictions'] += 1
+                    self.slots[key] = slot
+                self.vectors[slot] = vector
+                # The key is written last so that a half-written slot never matches
+                self.keys[slot] = np.frombuffer(key, dtype='uint8')
+                self._touch(key, slot)
+            for array in (self.vectors, self.keys, self.used):
+                array.flush()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.slots)
+        stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
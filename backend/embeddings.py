@@ -0,0 +1,60 @@
+"""Embedding model loading for the supported inference backends.
+
+The same sentence-transformers model can be run by:
+
+* ``torch``     PyTorch in full precision (float32), the reference
+* ``onnx``      ONNX Runtime on the float32 ONNX export of the model
+* ``onnx-int8`` ONNX Runtime on the dynamically quantized (int8) export,
+  usually the fastest on CPUs without a GPU
+
+The ONNX backends need ``optimum[onnxruntime]``, an optional dependency
+(``pip install -r requirements-onnx.txt``); the ONNX files are the ones
+published with the model on the Hugging Face hub. Every backend produces
+vectors of the same dimension that can be searched against each other, but
+they are not bit-identical: ``benchmark.py embeddings`` checks that the
+retrieval results of each backend stay within ``MAX_RECALL_DELTA`` of the
+PyTorch ones.
+
+sentence-transformers (and with it PyTorch) is only imported when a model is
+loaded, which takes seconds; importing this module is cheap.
+"""
+import importlib.util
+import platform
+
+EMBEDDING_BACKENDS = ['torch', 'onnx', 'onnx-int8']
+
+# Largest acceptable drop of recall@k against the torch backend
+MAX_RECALL_DELTA = 0.05
+
+ONNX_FILES = {
+    'onnx': 'onnx/model.onnx',
+    # Quantized exports are tuned per instruction set
+    'onnx-int8': 'onnx/model_qint8_arm64.onnx' if platform.machine().lower() in ('arm64', 'aarch64')
+                 else 'onnx/model_qint8_avx2.onnx',
+}
+
+
+def load_embedding_model(model_name, backend='torch', onnx_file=None):
+    """Load a SentenceTransformer running on the given backend.
+
+    ``onnx_file`` overrides the ONNX file of the model repository to load,
+    e.g. ``onnx/model_qint8_avx512_vnni.onnx`` on CPUs supporting VNNI.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Allowed backends: {', '.join(EMBEDDING_BACKENDS)}")
+    from sentence_transformers import SentenceTransformer
+
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+
+    try:
+        available = importlib.util.find_spec('optimum.onnxruntime') is not None
+    except ModuleNotFoundError:
+        available = False
+    if not available:
+        raise ImportError(f"The '{backend}' embedding backend needs optimum with ONNX Runtime: "
+                          "pip install -r requirements-onnx.txt")
+    return SentenceTransformer(model_name, backend='onnx', model_kwargs={
+        'file_name': onnx_file or ONNX_FILES[backend],
+        'provider': 'CPUExecutionProvider',
+    })
@@ -0,0 +1,269 @@
+"""Text extraction and chunking for PDF, DOCX and PPTX documents.
+
+This module only depends on the document libraries (no embedding model, no
+FAISS), so it can be imported cheaply by the extraction worker processes.
+The document libraries themselves are imported on first use, so importing
+the app does not pay for them.
+
+Documents are read one page (PDF), slide (PPTX) or paragraph (DOCX) at a
+time and chunked as the text comes in, so memory use does not grow with the
+size of the file. The streamed chunks are identical to the ones
+``chunk_text_simple`` produces from the whole text.
+"""
+import os
+import pickle
+import re
+import time
+import uuid
+import zipfile
+
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.pptx']
+
+
+def iter_pdf_pages(filepath):
+    """Yield (page number, text) for each page of a PDF file."""
+    import fitz
+
+    try:
+        with fitz.open(filepath) as doc:
+            for page_number, page in enumerate(doc, start=1):
+                yield page_number, page.get_text()
+    except Exception as e:
+        print(f"Error extracting text from PDF: {e}")
+        raise Exception(f"Failed to extract text from PDF: {e}")
+
+
+def iter_docx_pages(filepath):
+    """Yield (None, text) pieces of a Word document; it has no page numbers to offer."""
+    import docx
+
+    try:
+        doc = docx.Document(filepath)
+        for para in doc.paragraphs:
+            yield None, para.text + "\n"
+
+        # Extract text from tables as well
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    yield None, cell.text + " "
+                yield None, "\n"
+    except Exception as e:
+        print(f"Error extracting text from DOCX: {e}")
+        raise Exception(f"Failed to extract text from DOCX: {e}")
+
+
+def iter_pptx_pages(filepath):
+    """Yield (slide number, text) for each slide of a PowerPoint presentation."""
+    from pptx import Presentation
+
+    try:
+        pres = Presentation(filepath)
+        for slide_number, slide in enumerate(pres.slides, start=1):
+            text = f"Slide {slide_number}:\n"
+
+            # Extract text from shapes (includes text boxes)
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    text += shape.text + "\n"
+
+            # Add separator between slides
+            text += "\n" + "-"*40 + "\n"
+            yield slide_number, text
+    except Exception as e:
+        print(f"Error extracting text from PPTX: {e}")
+        raise Exception(f"Failed to extract text from PPTX: {e}")
+
+
+def iter_document_pages(filepath):
+    """Yield (page number or None, text) pieces of a document, based on its file extension."""
+    file_extension = os.path.splitext(filepath)[1].lower()
+
+    if file_extension == '.pdf':
+        return iter_pdf_pages(filepath)
+    elif file_extension == '.docx':
+        return iter_docx_pages(filepath)
+    elif file_extension == '.pptx':
+        return iter_pptx_pages(filepath)
+    else:
+        raise ValueError(f"Unsupported file format: {file_extension}")
+
+
+def page_count(filepath):
+    """Number of pages or slides of a document, or None when it cannot be known upfront."""
+    file_extension = os.path.splitext(filepath)[1].lower()
+    try:
+        if file_extension == '.pdf':
+            import fitz
+
+            with fitz.open(filepath) as doc:
+                return doc.page_count
+        if file_extension == '.pptx':
+            # Counting the slide parts is much cheaper than parsing the presentation
+            with zipfile.ZipFile(filepath) as archive:
+                return sum(1 for name in archive.namelist() if re.fullmatch(r'ppt/slides/slide\d+\.xml', name))
+    except Exception as e:
+        print(f"Could not count pages of {filepath}: {e}")
+    return None
+
+
+def extract_text_from_pdf(filepath):
+    """Extract text from a PDF file."""
+    return ''.join(text for _, text in iter_pdf_pages(filepath))
+
+
+def extract_text_from_docx(filepath):
+    """Extract text from a Word document."""
+    return ''.join(text for _, text in iter_docx_pages(filepath))
+
+
+def extract_text_from_pptx(filepath):
+    """Extract text from a PowerPoint presentation."""
+    return ''.join(text for _, text in iter_pptx_pages(filepath))
+
+
+def process_document(filepath):
+    """Process document based on file extension."""
+    return ''.join(text for _, text in iter_document_pages(filepath))
+
+
+def iter_chunks(pages, chunk_size=1000, overlap=100):
+    """Chunk a stream of (page, text) pieces the way ``chunk_text_simple`` chunks their concatenation.
+
+    Yields (page, chunk), where page is the page the chunk starts on. Only the
+    text of the chunk being built is kept in memory.
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    base = 0          # offset of buffer[0] in the whole text
+    start = 0         # offset of the next chunk in the whole text
+    page_starts = []  # (offset, page) of the buffered pieces
+    emitted = False
+
+    def page_at(offset):
+        while len(page_starts) > 1 and page_starts[1][0] <= offset:
+            page_starts.pop(0)
+        return page_starts[0][1] if page_starts else None
+
+    for page, text in pages:
+        if not text:
+            continue
+        page_starts.append((base + len(buffer), page))
+        buffer += text
+        # A text of exactly chunk_size is a single chunk, so the first one waits for more
+        while base + len(buffer) - start > chunk_size or (emitted and base + len(buffer) - start == chunk_size):
+            yield page_at(start), buffer[start - base:start - base + chunk_size]
+            emitted = True
+            start += step
+        if start > base:
+            buffer = buffer[start - base:]
+            base = start
+
+    if not emitted:
+        # If text is very short, return it as is
+        yield page_at(start), buffer
+        return
+    end = base + len(buffer)
+    while start < end:
+        yield page_at(start), buffer[start - base:start - base + chunk_size]
+        start += step
+
+
+def chunk_text_simple(text, chunk_size=1000, overlap=100):
+    """Split text into overlapping chunks with a simpler method."""
+    chunks = []
+    start = 0
+    text_length = len(text)
+
+    # If text is very short, return it as is
+    if text_length <= chunk_size:
+        return [text]
+
+    while start < text_length:
+        # Determine the end of current chunk
+        end = min(start + chunk_size, text_length)
+
+        # Add chunk to results
+        current_chunk = text[start:end]
+        chunks.append(current_chunk)
+
+        # Calculate start of next chunk with overlap
+        start = start + chunk_size - overlap
+
+    return chunks
+
+
+def iter_document_chunks(filepath, chunk_size=1000, overlap=100, timings=None):
+    """Yield the (page, chunk) pairs of a document while it is being read.
+
+    If ``timings`` is a dict, the seconds spent reading pages and cutting
+    them into chunks are added to its 'extraction' and 'chunking' entries.
+    """
+    pages = iter_document_pages(filepath)
+    if timings is None:
+        return iter_chunks(pages, chunk_size=chunk_size, overlap=overlap)
+    return _timed_chunks(pages, chunk_size, overlap, timings)
+
+
+def _timed_chunks(pages, chunk_size, overlap, timings):
+    extraction = [0.0]
+
+    def timed_pages():
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(pages)
+            except StopIteration:
+                return
+            finally:
+                extraction[0] += time.perf_counter() - start
+            yield item
+
+    chunks = iter_chunks(timed_pages(), chunk_size=chunk_size, overlap=overlap)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        # Time spent in the chunk generator that was not spent reading pages
+        timings['extraction'] = timings.get('extraction', 0.0) + extraction[0]
+        timings['chunking'] = timings.get('chunking', 0.0) + total - extraction[0]
+
+
+def extract_and_spool(filepath, spool_dir, chunk_size=1000, overlap=100):
+    """Extract and chunk one document into a spool file; runs in the extraction worker processes.
+
+    Chunks are written to disk instead of being sent back, so a large
+    document never has to be held in memory by the worker or the parent.
+    Returns (basename, spool path, number of chunks, timings), timings being
+    the seconds spent in extraction and chunking.
+    """
+    spool_path = os.path.join(spool_dir, f"{uuid.uuid4().hex}.chunks")
+    count = 0
+    timings = {}
+    try:
+        with open(spool_path, 'wb') as f:
+            for item in iter_document_chunks(filepath, chunk_size=chunk_size, overlap=overlap, timings=timings):
+                pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+                count += 1
+    except Exception:
+        os.remove(spool_path)
+        raise
+    return os.path.basename(filepath), spool_path, count, timings
+
+
+def read_spool(spool_path):
+    """Yield the (page, chunk) pairs written by ``extract_and_spool``."""
+    with open(spool_path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
@@ -0,0 +1,192 @@
+"""Persistent background queue for document ingestion jobs.
+
+Every job is a small JSON file in the jobs directory, rewritten atomically
+whenever its state changes. Jobs that were queued or running when the
+process stopped are queued again at the next start. A single worker thread
+runs jobs in submission order; submitting a file with the same name, content
+hash and collection as a job that is still queued or running returns that job
+instead of a new one. Finished jobs are never matched: the file on disk may
+have changed since, and ingesting unchanged content again is cheap because
+unchanged chunks are kept.
+
+Nothing is read from or written to the jobs directory before ``start`` (or
+the first ``submit``), so creating a queue, e.g. when the app module is
+imported, touches no files.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from vector_store import atomic_write
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def dedup_key(content_hash, filename, collection=None):
+    """Key under which an active job is found again by the file it ingests."""
+    return collection, filename, content_hash
+
+
+class JobQueue:
+    """FIFO queue of ingestion jobs with on-disk state and progress reporting."""
+
+    def __init__(self, directory, runner):
+        """``runner(job, progress)`` does the work; ``progress(**fields)`` updates the job."""
+        self.directory = directory
+        self.runner = runner
+        self.jobs = {}
+        self.by_hash = {}
+        self.pending = []
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def _load(self):
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable job file {filename}: {e}")
+                continue
+            self.jobs[job['id']] = job
+
+        # Jobs interrupted by a restart start over from the beginning
+        interrupted = sorted(
+            (job for job in self.jobs.values() if job['status'] in ACTIVE_STATUSES),
+            key=lambda job: job['created_at']
+        )
+        for job in interrupted:
+            self._reset(job)
+            self.pending.append(job['id'])
+            self.by_hash[self._key(job)] = job['id']
+        if interrupted:
+            print(f"Resuming {len(interrupted)} ingestion jobs from {self.directory}")
+
+    def _reset(self, job):
+        job.update(status='queued', stage='queued', chunks_total=None, chunks_processed=0,
+                   pages_total=None, pages_processed=0, started_at=None, embedding_started_at=None, finished_at=None, error=None)
+        self._save(job)
+
+    @staticmethod
+    def _key(job):
+        return dedup_key(job['content_hash'], job['filename'], job.get('collection'))
+
+    def _save(self, job):
+        path = os.path.join(self.directory, f"{job['id']}.json")
+        atomic_write(path, lambda f: json.dump(job, f, ensure_ascii=False), mode='w')
+
+    def start(self):
+        """Load the jobs left by the previous run and start the worker thread (idempotent)."""
+        with self.condition:
+            if self.worker is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._load()
+                self.worker = threading.Thread(target=self._run, name='ingestion-jobs', daemon=True)
+                self.worker.start()
+
+    def submit(self, filepath, filename, content_hash, collection=None):
+        """Queue a file for ingestion, into a named collection if given. Returns (job, created)."""
+        key = dedup_key(content_hash, filename, collection)
+        self.start()
+        with self.condition:
+            existing_id = self.by_hash.get(key)
+            if existing_id is not None:
+                return self.describe(existing_id), False
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'filename': filename,
+                'filepath': filepath,
+                'content_hash': content_hash,
+                'collection': collection,
+                'status': 'queued',
+                'stage': 'queued',
+                'chunks_total': None,
+                'chunks_processed': 0,
+                'pages_total': None,
+                'pages_processed': 0,
+                'created_at': time.time(),
+                'started_at': None,
+                'embedding_started_at': None,
+                'finished_at': None,
+                'error': None,
+                'result': None,
+            }
+            self._save(job)
+            self.jobs[job['id']] = job
+            self.by_hash[key] = job['id']
+            self.pending.append(job['id'])
+            self.condition.notify()
+        return self.describe(job['id']), True
+
+    def describe(self, job_id):
+        """Public view of a job with its queue position and ETA, or None if unknown."""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            job['queue_position'] = self.pending.index(job_id) + 1 if job_id in self.pending else None
+        job.pop('filepath', None)
+        job['eta_seconds'] = self._eta(job)
+        return job
+
+    @staticmethod
+    def _eta(job):
+        if job['status'] != 'running' or not job['embedding_started_at']:
+            return None
+        # Streamed documents only know their page count upfront, not their chunk count
+        if job['chunks_total']:
+            total, processed = job['chunks_total'], job['chunks_processed']
+        else:
+            total, processed = job.get('pages_total'), job.get('pages_processed')
+        if not total or not processed:
+            return None
+        elapsed = time.time() - job['embedding_started_at']
+        rate = processed / elapsed if elapsed > 0 else 0
+        if rate <= 0:
+            return None
+        return max(total - processed, 0) / rate
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                job = self.jobs[self.pending.pop(0)]
+                job.update(status='running', started_at=time.time())
+                self._save(job)
+
+            def progress(**fields):
+                with self.condition:
+                    if fields.get('stage') == 'embedding':
+                        fields.setdefault('embedding_started_at', time.time())
+                    job.update(fields)
+                    # Progress counters change often; only stage changes are persisted
+                    if 'stage' in fields:
+                        self._save(job)
+
+            try:
+                result = self.runner(job, progress)
+                with self.condition:
+                    job.update(status='done', stage='done', result=result, finished_at=time.time())
+                    self._forget(job)
+                    self._save(job)
+                print(f"Ingestion job {job['id']} for {job['filename']} done in "
+                      f"{job['finished_at'] - job['started_at']:.1f}s")
+            except Exception as e:
+                print(f"Ingestion job {job['id']} for {job['filename']} failed: {e}")
+                with self.condition:
+                    job.update(status='failed', error=str(e), finished_at=time.time())
+                    self._forget(job)
+                    self._save(job)
+
+    def _forget(self, job):
+        """Stop matching new submissions against a finished job. Called with the condition held."""
+        key = self._key(job)
+        if self.by_hash.get(key) == job['id']:
+            del self.by_hash[key]
@@ -0,0 +1,278 @@
+"""BM25 lexical search over the chunks of the vector store.
+
+Dense MiniLM embeddings are weak on exact tokens: names, identifiers, phone
+numbers, formula terms. Every store segment therefore also gets an inverted
+index of its chunks, written next to it when the segment is written
+(``<name>.bm25``) and never modified afterwards, like the rest of the
+segment. Deleted chunks are filtered out at query time with the segment's
+tombstones, and compaction merges the postings of the merged segments.
+
+A postings file holds five arrays saved back to back in .npy format and
+memory-mapped on load, so opening it costs no parsing:
+
+* terms:   uint64 hash of every distinct term, sorted
+* starts:  int64 offset of each term's postings (plus the total at the end)
+* rows:    uint32 row in the segment of each posting, grouped by term
+* tfs:     uint16 term frequency of each posting
+* lengths: int32 number of tokens of each row
+
+Terms are identified by a 64-bit hash of the token, so no vocabulary strings
+are stored. Tokens are lowercased, stripped of accents and split on
+non-word characters; a few very common French and English words are
+dropped.
+
+Latency budget: lexical search plus rank fusion must stay within
+``LATENCY_BUDGET_MS`` at the 95th percentile for a corpus of 100k chunks,
+on top of the dense search. ``benchmark.py hybrid`` checks it.
+"""
+import array
+import functools
+import hashlib
+import math
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+LATENCY_BUDGET_MS = 25
+
+# Okapi BM25 parameters
+K1 = 1.2
+B = 0.75
+
+POSTINGS_ARRAYS = 5
+
+TOKEN_PATTERN = re.compile(r'\w+')
+COMBINING_MARKS = re.compile('[\u0300-\u036f]')
+STOPWORDS = frozenset("""
+a au aux avec ce ces dans de des du elle en et il ils je la le les leur lui ma mais me meme mes
+moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un
+une vos votre vous c d j l m n s t y est sont ete etre
+an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+
+def tokenize(text):
+    """Lowercased, accent-free word tokens of a text, without stopwords."""
+    folded = COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text.lower()))
+    return [token for token in TOKEN_PATTERN.findall(folded) if token not in STOPWORDS]
+
+
+@functools.lru_cache(maxsize=65536)
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class SegmentPostings:
+    """Inverted index of the rows of one segment."""
+
+    def __init__(self, terms, starts, rows, tfs, lengths):
+        self.terms = terms
+        self.starts = starts
+        self.rows = rows
+        self.tfs = tfs
+        self.lengths = lengths
+        self._float_lengths = None
+
+    @property
+    def float_lengths(self):
+        """``lengths`` as float32, converted once for the BM25 length normalization."""
+        if self._float_lengths is None:
+            self._float_lengths = np.asarray(self.lengths, dtype='float32')
+        return self._float_lengths
+
+    def lookup(self, terms):
+        """Postings of several term hashes at once.
+
+        Returns (index in ``terms``, row, term frequency) arrays with one
+        entry per posting of every term that is present.
+        """
+        positions = np.minimum(np.searchsorted(self.terms, terms), max(len(self.terms) - 1, 0))
+        present = np.nonzero(self.terms[positions] == terms)[0] if len(self.terms) else np.empty(0, dtype=np.int64)
+        starts = self.starts[positions[present]]
+        counts = self.starts[positions[present] + 1] - starts
+        # Indices of all the postings of the present terms, without a Python loop
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        postings = np.arange(int(counts.sum())) + offsets
+        return np.repeat(present, counts), self.rows[postings].astype(np.int64), self.tfs[postings]
+
+    @classmethod
+    def from_arrays(cls, terms, rows, tfs, lengths):
+        """Build postings from parallel (term, row, tf) arrays, rows ascending for each term."""
+        order = np.argsort(terms, kind='stable')
+        unique_terms, starts = np.unique(terms[order], return_index=True)
+        return cls(
+            unique_terms.astype('<u8'),
+            np.append(starts, len(terms)).astype('<i8'),
+            rows[order].astype('<u4'),
+            np.minimum(tfs[order], np.iinfo('<u2').max).astype('<u2'),
+            np.asarray(lengths, dtype='<i4')
+        )
+
+
+class PostingsBuilder:
+    """Accumulates the postings of a segment while its chunks are written."""
+
+    def __init__(self):
+        self.terms = array.array('Q')
+        self.rows = array.array('I')
+        self.tfs = array.array('I')
+        self.lengths = array.array('i')
+
+    def add(self, text):
+        tokens = tokenize(text)
+        row = len(self.lengths)
+        self.lengths.append(len(tokens))
+        for token, tf in Counter(tokens).items():
+            self.terms.append(term_hash(token))
+            self.rows.append(row)
+            self.tfs.append(tf)
+
+    def build(self):
+        return SegmentPostings.from_arrays(
+            np.frombuffer(self.terms, dtype='<u8'), np.frombuffer(self.rows, dtype='<u4'),
+            np.frombuffer(self.tfs, dtype='<u4'), np.frombuffer(self.lengths, dtype='<i4')
+        )
+
+
+def merge_postings(parts):
+    """Merge the postings of several segments into the postings of their concatenation.
+
+    ``parts`` is a list of (SegmentPostings, live row mask or None) in
+    segment order; rows that are not live are dropped and the remaining rows
+    are renumbered consecutively.
+    """
+    terms, rows, tfs, lengths = [], [], [], []
+    offset = 0
+    for postings, live in parts:
+        part_terms = np.repeat(postings.terms, np.diff(postings.starts))
+        part_rows = postings.rows.astype(np.int64)
+        part_tfs = postings.tfs
+        part_lengths = postings.lengths
+        if live is not None:
+            new_rows = np.cumsum(live) - 1
+            kept = live[part_rows]
+            part_terms, part_rows, part_tfs = part_terms[kept], new_rows[part_rows[kept]], part_tfs[kept]
+            part_lengths = part_lengths[live]
+        terms.append(part_terms)
+        rows.append(part_rows + offset)
+        tfs.append(part_tfs)
+        lengths.append(part_lengths)
+        offset += len(part_lengths)
+    if not parts:
+        return PostingsBuilder().build()
+    return SegmentPostings.from_arrays(np.concatenate(terms), np.concatenate(rows),
+                                       np.concatenate(tfs), np.concatenate(lengths))
+
+
+def save_postings(f, postings):
+    """Write postings to an open binary file."""
+    for values in (postings.terms, postings.starts, postings.rows, postings.tfs, postings.lengths):
+        np.lib.format.write_array(f, np.ascontiguousarray(values), version=(1, 0))
+
+
+def load_postings(path):
+    """Memory-map the postings written by ``save_postings``."""
+    arrays = []
+    with open(path, 'rb') as f:
+        for _ in range(POSTINGS_ARRAYS):
+            np.lib.format.read_magic(f)
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            offset = f.tell()
+            if math.prod(shape):
+                # Plain ndarray views: np.memmap slicing is much slower in the query loop
+                values = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape).view(np.ndarray)
+            else:
+                values = np.zeros(shape, dtype=dtype)
+            arrays.append(values)
+            f.seek(offset + math.prod(shape) * dtype.itemsize)
+    return SegmentPostings(*arrays)
+
+
+def live_length_stats(postings, live=None):
+    """(number, total token length) of the live rows of a segment's postings."""
+    lengths = np.asarray(postings.lengths)
+    if live is not None:
+        lengths = lengths[live]
+    return len(lengths), int(lengths.sum())
+
+
+class LexicalIndex:
+    """BM25 search over the live chunks of a set of segments.
+
+    ``segments`` is a list of (SegmentPostings, chunk ids of the rows, live
+    row mask or None); statistics (number of chunks, average length and
+    document frequencies) only count live chunks. ``stats`` are the
+    ``live_length_stats`` of the segments, if already known.
+    """
+
+    def __init__(self, segments, stats=None):
+        self.segments = segments
+        if stats is None:
+            stats = [live_length_stats(postings, live) for postings, _, live in segments]
+        self.count = sum(count for count, _ in stats)
+        total_length = sum(length for _, length in stats)
+        self.average_length = total_length / self.count if self.count else 0.0
+
+    def search(self, query, k, allowed=None):
+        """Return (chunk ids, BM25 scores) of the ``k`` best chunks, best first.
+
+        ``allowed``, a sorted array of chunk ids, restricts the results to
+        those chunks; only the rows matching a query term are checked.
+        """
+        terms = np.array(sorted({term_hash(token) for token in tokenize(query)}), dtype='<u8')
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype='float32')
+        if not len(terms) or not self.count:
+            return empty
+
+        # Document frequencies need every segment's postings before anything can be scored
+        matches = []
+        document_frequencies = np.zeros(len(terms))
+        for segment_number, (postings, _, live) in enumerate(self.segments):
+            term_numbers, rows, tfs = postings.lookup(terms)
+            if live is not None:
+                kept = live[rows]
+                term_numbers, rows, tfs = term_numbers[kept], rows[kept], tfs[kept]
+            if len(rows):
+                matches.append((segment_number, term_numbers, rows, tfs))
+                document_frequencies += np.bincount(term_numbers, minlength=len(terms))
+        if not matches:
+            return empty
+        idfs = np.log(1 + (self.count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+
+        all_ids = []
+        all_scores = []
+        for segment_number, term_numbers, rows, tfs in matches:
+            tfs = tfs.astype('float32')
+            lengths = self.segments[segment_number][0].float_lengths
+            # Length normalization of the matching rows only: the average length changes at every commit
+            norms = K1 * (1 - B) + (K1 * B / max(self.average_length, 1e-9)) * lengths[rows]
+            contributions = idfs[term_numbers] * tfs * (K1 + 1) / (tfs + norms)
+            # Sum the contributions of the query terms per row
+            row_scores = np.bincount(rows, weights=contributions, minlength=len(lengths))
+            segment_rows = np.nonzero(row_scores)[0]
+            all_ids.append(np.asarray(self.segments[segment_number][1])[segment_rows])
+            all_scores.append(row_scores[segment_rows])
+        ids = np.concatenate(all_ids).astype(np.int64)
+        scores = np.concatenate(all_scores).astype('float32')
+        if allowed is not None:
+            kept = np.isin(ids, allowed)
+            ids, scores = ids[kept], scores[kept]
+        if len(ids) > k:
+            best = np.argpartition(-scores, k)[:k]
+            ids, scores = ids[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return ids[order], scores[order]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several rankings of chunk ids into one with reciprocal rank fusion.
+
+    Returns a list of (chunk id, fused score), best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[int(chunk_id)] = scores.get(int(chunk_id), 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
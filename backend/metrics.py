@@ -0,0 +1,126 @@
+"""Per-stage latency metrics in the Prometheus text format.
+
+Every stage of ingestion (extraction, chunking, embedding, index add,
+persistence) and of a chat request (cache lookup, query encode, search,
+re-rank, context packing, LLM call, think-tag stripping) is timed with
+``timed(stage)`` or ``observe_stage``. The durations go to the
+``rag_stage_duration_seconds`` histogram, which ``/metrics`` renders with
+``render`` for Prometheus to scrape.
+
+A request can also collect its own trace: within ``with tracing() as
+trace``, every stage timed in the same context (thread, or asyncio task)
+is appended to ``trace``. The chat endpoints return it when the
+``X-Debug-Trace`` header is set.
+
+No dependency on prometheus_client: the exposition format is simple
+enough to write here.
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from sub-millisecond searches to multi-second LLM answers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+DEBUG_TRACE_HEADER = 'X-Debug-Trace'
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with labels."""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted((key, list(values)) for key, values in self.series.items())
+        for key, values in series:
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, key))
+            prefix = f"{labels}," if labels else ''
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{format_value(bound)}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {format_value(values[-2])}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return '\n'.join(lines)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+stage_seconds = Histogram('rag_stage_duration_seconds', 'Time spent in each ingestion and chat stage.', ['stage'])
+request_seconds = Histogram('rag_request_duration_seconds', 'Time to response headers of HTTP requests.',
+                            ['endpoint', 'method', 'status'])
+
+_trace = contextvars.ContextVar('rag_trace', default=None)
+
+
+@contextmanager
+def tracing(enabled=True):
+    """Collect the stages timed in the enclosed block; yields the trace list, or None if not enabled.
+
+    The previous trace is restored on exit, since pooled threads and
+    keep-alive connections serve several requests in the same context.
+    """
+    token = _trace.set([] if enabled else None)
+    try:
+        yield _trace.get()
+    finally:
+        _trace.reset(token)
+
+
+def observe_stage(stage, seconds):
+    """Record the duration of one stage, in the histogram and the current trace."""
+    stage_seconds.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append({'stage': stage, 'ms': round(seconds * 1000, 3)})
+
+
+@contextmanager
+def timed(stage):
+    """Time the enclosed block as one occurrence of ``stage``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def render(gauges=()):
+    """All metrics in the Prometheus text exposition format.
+
+    ``gauges`` are extra (name, documentation, value) samples computed by
+    the caller at scrape time.
+    """
+    parts = [stage_seconds.render(), request_seconds.render()]
+    for name, documentation, value in gauges:
+        parts.append(f"# HELP {name} {documentation}\n# TYPE {name} gauge\n{name} {format_value(value)}")
+    return '\n'.join(parts) + '\n'
@@ -0,0 +1,153 @@
+"""Two-level cache of chat answers.
+
+1. Exact: an LRU keyed on the normalized query text and the index version.
+2. Semantic: when there is no exact hit, the query embedding is compared with
+   the embeddings of the cached queries and the closest answer is reused if
+   its cosine distance is at most ``max_distance``.
+
+Each entry remembers the documents its contexts came from, so that
+reindexing a document only drops the answers that cited it (plus the
+answers that had no context at all, since the new document might now
+answer them).
+"""
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """Case-, whitespace- and Unicode-normalized form of a query."""
+    return ' '.join(unicodedata.normalize('NFC', query).lower().split())
+
+
+class CacheEntry:
+    def __init__(self, key, embedding, result, sources, compute_seconds):
+        self.key = key
+        self.embedding = embedding
+        self.result = result
+        self.sources = sources
+        self.compute_seconds = compute_seconds
+
+
+class QueryCache:
+    """Thread-safe exact + semantic LRU cache of chat results."""
+
+    def __init__(self, max_entries=512, max_distance=0.05):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.entries = OrderedDict()
+        self.version = 0
+        self.lock = threading.Lock()
+        self._matrix = None
+        self._matrix_keys = []
+        self.stats = {
+            'lookups': 0,
+            'exact_hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'latency_saved_seconds': 0.0,
+        }
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _key(self, query):
+        return (normalize_query(query), self.version)
+
+    def get_exact(self, query):
+        """Return the cached result for this exact (normalized) query, or None."""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        with self.lock:
+            self.stats['lookups'] += 1
+            entry = self.entries.get(self._key(query))
+            if entry is None:
+                return None
+            self.entries.move_to_end(entry.key)
+            self._record_hit('exact_hits', entry, start)
+            return entry.result
+
+    def get_semantic(self, embedding):
+        """Return the result of the closest cached query within max_distance, or None.
+
+        Must be called after a get_exact miss for the same query; a miss here
+        is counted as a cache miss.
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        with self.lock:
+            if self.max_distance >= 0 and self.entries:
+                matrix = self._embedding_matrix()
+                similarities = matrix @ self._unit(embedding)
+                best = int(np.argmax(similarities))
+                if 1.0 - float(similarities[best]) <= self.max_distance:
+                    entry = self.entries[self._matrix_keys[best]]
+                    self.entries.move_to_end(entry.key)
+                    self._record_hit('semantic_hits', entry, start)
+                    return entry.result
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, query, embedding, result, sources, compute_seconds):
+        """Cache a freshly computed result."""
+        if not self.enabled:
+            return
+        with self.lock:
+            key = self._key(query)
+            self.entries[key] = CacheEntry(key, self._unit(embedding), result, set(sources), compute_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate_sources(self, sources):
+        """Drop entries citing any of these documents, and entries without context."""
+        sources = set(sources)
+        with self.lock:
+            stale = [key for key, entry in self.entries.items()
+                     if not entry.sources or entry.sources & sources]
+            for key in stale:
+                del self.entries[key]
+            if stale:
+                self._matrix = None
+            self.stats['invalidations'] += len(stale)
+
+    def reset(self):
+        """Forget everything, e.g. after the index has been rebuilt."""
+        with self.lock:
+            self.stats['invalidations'] += len(self.entries)
+            self.entries.clear()
+            self.version += 1
+            self._matrix = None
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['index_version'] = self.version
+        hits = stats['exact_hits'] + stats['semantic_hits']
+        stats['hit_rate'] = hits / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+    def _record_hit(self, counter, entry, start):
+        self.stats[counter] += 1
+        self.stats['latency_saved_seconds'] += max(entry.compute_seconds - (time.perf_counter() - start), 0.0)
+
+    def _embedding_matrix(self):
+        if self._matrix is None:
+            self._matrix_keys = list(self.entries.keys())
+            self._matrix = np.vstack([self.entries[key].embedding for key in self._matrix_keys])
+        return self._matrix
+
+    @staticmethod
+    def _unit(embedding):
+        embedding = np.asarray(embedding, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
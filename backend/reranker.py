@@ -0,0 +1,104 @@
+"""Cross-encoder re-ranking of retrieved chunks.
+
+FAISS and BM25 rank chunks without looking at the query and the chunk
+together. A cross-encoder reads both and scores their relevance much more
+precisely, but is far too slow to run over the corpus. Retrieval therefore
+over-fetches candidates and the cross-encoder re-orders them, keeping the
+best k.
+
+Re-ranking is bounded by a deadline. Candidate pairs are scored in batches,
+best first-stage ranks first (rank 1 of every query, then rank 2, ...). A
+batch is only started if the time of one batch, averaged over the previous
+ones, still fits before the deadline. The first batch always runs, so one
+slow batch (a cold start, a GC pause) cannot stop re-ranking for good: the
+estimate is updated again by every query. Candidates that were not scored
+keep their first-stage order, after the scored ones.
+
+sentence-transformers is imported when the model is first loaded.
+"""
+import threading
+import time
+
+
+class Reranker:
+    """Thread-safe cross-encoder re-ranker, loaded on first use."""
+
+    def __init__(self, model_name, batch_size=16, deadline_ms=200):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.deadline = deadline_ms / 1000
+        self.model = None
+        self.lock = threading.Lock()
+        self.batch_seconds = None  # moving average of the time of one batch
+        self.stats = {'queries': 0, 'pairs_scored': 0, 'pairs_skipped': 0, 'deadline_hits': 0}
+
+    def load(self):
+        """Load the cross-encoder unless it already is."""
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    start = time.time()
+                    model = CrossEncoder(self.model_name)
+                    model.predict([('warm up', 'warm up')])
+                    self.model = model
+                    print(f"Loaded re-ranker {self.model_name} in {time.time() - start:.2f}s")
+        return self.model
+
+    def rerank(self, queries, candidates, k):
+        """Re-rank the candidate contexts of several queries and keep the ``k`` best of each.
+
+        ``candidates`` holds one list of contexts per query, in first-stage
+        order. Scored contexts get a ``rerank_score``.
+        """
+        model = self.load()
+        start = time.monotonic()
+        pairs = [
+            (query_number, rank)
+            for rank in range(max((len(contexts) for contexts in candidates), default=0))
+            for query_number, contexts in enumerate(candidates) if rank < len(contexts)
+        ]
+        scores = {}
+        deadline_hit = False
+        for batch_start in range(0, len(pairs), self.batch_size):
+            expected = self.batch_seconds or 0.0
+            if batch_start and time.monotonic() - start + expected > self.deadline:
+                deadline_hit = True
+                break
+            batch = pairs[batch_start:batch_start + self.batch_size]
+            batch_began = time.monotonic()
+            batch_scores = model.predict(
+                [(queries[q], candidates[q][rank]['content']) for q, rank in batch],
+                batch_size=self.batch_size, show_progress_bar=False
+            )
+            elapsed = time.monotonic() - batch_began
+            self.batch_seconds = elapsed if self.batch_seconds is None else 0.8 * self.batch_seconds + 0.2 * elapsed
+            scores.update(zip(batch, (float(score) for score in batch_scores)))
+
+        with self.lock:
+            self.stats['queries'] += len(queries)
+            self.stats['pairs_scored'] += len(scores)
+            self.stats['pairs_skipped'] += len(pairs) - len(scores)
+            self.stats['deadline_hits'] += int(deadline_hit)
+
+        results = []
+        for query_number, contexts in enumerate(candidates):
+            scored = [(scores[(query_number, rank)], rank) for rank in range(len(contexts))
+                      if (query_number, rank) in scores]
+            order = [rank for _, rank in sorted(scored, key=lambda item: -item[0])]
+            order += [rank for rank in range(len(contexts)) if (query_number, rank) not in scores]
+            best = []
+            for rank in order[:k]:
+                context = dict(contexts[rank])
+                if (query_number, rank) in scores:
+                    context['rerank_score'] = scores[(query_number, rank)]
+                best.append(context)
+            results.append(best)
+        return results
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['batch_ms'] = self.batch_seconds * 1000 if self.batch_seconds is not None else None
+        return stats
@@ -0,0 +1,52 @@
+"""Minimal stand-in for the Ollama /api/generate endpoint, used by benchmark.py.
+
+It answers every prompt with a fixed <think> block followed by a fixed answer,
+emitting one token every STUB_TOKEN_DELAY seconds, so that latency numbers
+do not depend on a real model being installed. Prefill takes
+STUB_PREFILL_DELAY seconds plus STUB_PREFILL_PER_TOKEN seconds per prompt
+token, and the prompt size is reported in ``prompt_eval_count`` like Ollama.
+
+    python stub_ollama.py            # listens on port 11434 like Ollama
+"""
+import json
+import os
+import time
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+
+TOKEN_DELAY = float(os.environ.get('STUB_TOKEN_DELAY', 0.02))
+PREFILL_DELAY = float(os.environ.get('STUB_PREFILL_DELAY', 0.2))
+PREFILL_PER_TOKEN = float(os.environ.get('STUB_PREFILL_PER_TOKEN', 0))
+THINK_TOKENS = ['<think>', 'Je ', 'réfléchis ', 'à ', 'la ', 'question.', '</think>', '\n\n']
+ANSWER_TOKENS = ['Voici ', 'une ', 'réponse ', 'basée ', 'sur ', 'les ', 'contextes ', 'fournis.']
+
+
+@app.route('/api/generate', methods=['POST'])
+def generate():
+    data = request.json or {}
+    tokens = THINK_TOKENS + ANSWER_TOKENS
+    context = list(data.get('context') or []) + [len(data.get('prompt', ''))]
+    # Roughly four characters per token, plus the tokens of the previous conversation
+    prompt_tokens = len(data.get('system', '') + data.get('prompt', '')) // 4 + len(data.get('context') or [])
+    prefill = PREFILL_DELAY + PREFILL_PER_TOKEN * prompt_tokens
+
+    if not data.get('stream', True):
+        time.sleep(prefill + TOKEN_DELAY * len(tokens))
+        return jsonify({'model': data.get('model'), 'response': ''.join(tokens), 'done': True, 'context': context,
+                        'prompt_eval_count': prompt_tokens})
+
+    def stream():
+        time.sleep(prefill)
+        for token in tokens:
+            time.sleep(TOKEN_DELAY)
+            yield json.dumps({'model': data.get('model'), 'response': token, 'done': False}) + '\n'
+        yield json.dumps({'model': data.get('model'), 'response': '', 'done': True, 'context': context,
+                          'prompt_eval_count': prompt_tokens}) + '\n'
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=int(os.environ.get('PORT', 11434)), threaded=True)
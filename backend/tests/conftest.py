@@ -0,0 +1,49 @@
+"""Shared fixtures: tests import the backend modules and never touch models/."""
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+
+class StubEmbedder:
+    """Deterministic bag-of-words embeddings, so tests do not need the sentence-transformers model."""
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.calls = 0
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dimension] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-6)
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    """The app module pointed at an empty store in a temporary directory, with a stub embedder."""
+    monkeypatch.setattr(app, 'STORE_DIR', str(tmp_path / 'store'))
+    monkeypatch.setattr(app, 'INDEX_CACHE_PATH', str(tmp_path / 'index.faiss'))
+    monkeypatch.setattr(app, 'INDEX_CACHE_STATE_PATH', str(tmp_path / 'index.faiss.json'))
+    monkeypatch.setattr(app, 'COLLECTIONS_DIR', str(tmp_path / 'collections'))
+    monkeypatch.setattr(app, 'PROCESSED_FILES_REGISTRY', str(tmp_path / 'processed_files.pkl'))
+    monkeypatch.setattr(app, 'embedding_model', StubEmbedder(app.embedding_dimension))
+    monkeypatch.setattr(app, 'embedding_cache', EmbeddingCache(
+        None, app.EMBEDDING_MODEL_NAME, app.embedding_dimension, max_entries=0
+    ))
+    monkeypatch.setattr(app, 'processed_files', {})
+    monkeypatch.setattr(app, 'processed_stats', {})
+    app.initialize_index()
+    yield app
+    app.snapshot = None
+    app.vector_store = None
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_concurrent_items_are_batched_and_results_reach_their_callers():
+    entered = threading.Event()
+    release = threading.Event()
+    batches = []
+
+    def square(items):
+        # The first batch holds the worker while the other callers submit
+        entered.set()
+        release.wait(5)
+        batches.append(list(items))
+        return [item * item for item in items]
+
+    batcher = MicroBatcher(square, max_batch_size=4, max_wait_ms=1)
+    results = {}
+
+    def submit(number):
+        results[number] = batcher.submit(number)
+
+    threads = [threading.Thread(target=submit, args=(0,))]
+    threads[0].start()
+    assert entered.wait(5)
+    threads += [threading.Thread(target=submit, args=(number,)) for number in range(1, 9)]
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while len(batcher.pending) < 8 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {number: number * number for number in range(9)}
+    assert [len(batch) for batch in batches] == [1, 4, 4]
+    assert batcher.get_stats()['average_batch_size'] == 3.0
+
+
+def test_a_failed_batch_raises_in_every_caller_and_the_worker_goes_on():
+    def function(items):
+        if 'bad' in items:
+            raise ValueError('bad item')
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(function, max_batch_size=8, max_wait_ms=1)
+    with pytest.raises(ValueError):
+        batcher.submit_many(['good', 'bad'])
+    assert batcher.submit_many(['a', 'b']) == ['A', 'B']
+
+
+def test_batch_size_one_runs_items_in_the_callers_thread():
+    threads = []
+    batcher = MicroBatcher(lambda items: threads.append(threading.current_thread()) or items, max_batch_size=1)
+    assert batcher.submit_many([1, 2]) == [1, 2]
+    assert threads == [threading.current_thread()] * 2 and batcher.worker is None
@@ -0,0 +1,44 @@
+import time
+
+
+def test_idle_collection_unloaded_without_further_requests(rag, monkeypatch):
+    monkeypatch.setattr(rag, 'COLLECTION_IDLE_SECONDS', 0.5)
+    collection = rag.get_collection('contracts', create=True)
+    rag.current_snapshot(collection)
+    assert collection.snapshot is not None
+
+    # Only the default collection is searched from now on
+    deadline = time.monotonic() + 10
+    while collection.snapshot is not None and time.monotonic() < deadline:
+        rag.current_snapshot()
+        time.sleep(0.1)
+    assert collection.snapshot is None
+
+
+def test_least_recently_used_collections_beyond_the_limit_are_unloaded(rag, monkeypatch):
+    monkeypatch.setattr(rag, 'collection_registry', {})
+    monkeypatch.setattr(rag, 'MAX_LOADED_COLLECTIONS', 2)
+    collections = []
+    for name in ('hr', 'legal', 'sales'):
+        collection = rag.get_collection(name, create=True)
+        batch = rag.IngestionBatch(collection=collection)
+        batch.add_document(f"{name}.pdf", [(None, f"the {name} policy")])
+        batch.commit()
+        collections.append(collection)
+        time.sleep(0.01)
+    hr, legal, sales = collections
+
+    # A pinned collection (a write in progress) stays loaded however long it is unused
+    legal.pin()
+    hr.last_used = legal.last_used - 1
+    try:
+        assert rag.evict_idle_collections() == ['hr']
+        monkeypatch.setattr(rag, 'MAX_LOADED_COLLECTIONS', 0)
+        assert rag.evict_idle_collections() == ['sales']
+        assert legal.snapshot is not None
+    finally:
+        legal.unpin()
+    assert rag.evict_idle_collections() == ['legal']
+
+    # An unloaded collection is loaded again by its next search
+    assert rag.current_snapshot(hr).metadata.sources() == {'hr.pdf'}
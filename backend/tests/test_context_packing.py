@@ -0,0 +1,26 @@
+from context_packing import pack_contexts
+
+
+def test_consecutive_chunks_of_a_source_are_packed_into_one_passage(rag):
+    chunks = ["the first part of the policy about leave days",
+              "the second part of the policy about leave days",
+              "an unrelated chunk about kubernetes clusters"]
+    rag.store_in_faiss(chunks, 'policy.pdf')
+    current = rag.current_snapshot()
+    ids = current.metadata.ids_of_sources(['policy.pdf'])
+
+    contexts = rag.contexts_for_hits(current, [(int(ids[1]), 0.1, ['dense']), (int(ids[0]), 0.2, ['dense'])])
+    assert [context['chunk'] for context in contexts] == [1, 0]
+
+    passages, stats = pack_contexts(contexts, 1000)
+    assert stats['passages'] == 1
+    assert passages[0]['chunks'] == [0, 1]
+
+
+def test_conversation_over_the_history_budget_is_dropped_not_cut(rag, monkeypatch):
+    monkeypatch.setattr(rag, 'HISTORY_TOKEN_BUDGET', 4)
+    assert rag.build_ollama_payload('query', [1, 2, 3, 4])['context'] == [1, 2, 3, 4]
+    # Ollama's context starts with the tokenized system prompt: keeping its tail would corrupt it
+    assert 'context' not in rag.build_ollama_payload('query', [1, 2, 3, 4, 5])
+    monkeypatch.setattr(rag, 'HISTORY_TOKEN_BUDGET', 0)
+    assert rag.build_ollama_payload('query', [1, 2, 3, 4, 5])['context'] == [1, 2, 3, 4, 5]
@@ -0,0 +1,58 @@
+import os
+import time
+
+import benchmark
+from jobs import JobQueue
+
+
+def test_folder_documents_are_listed_after_reindex_all(rag, tmp_path, monkeypatch):
+    folder = str(tmp_path / 'documents')
+    monkeypatch.setattr(rag, 'DOCUMENTS_FOLDER', folder)
+    paths = benchmark.generate_corpus(folder, 3, pages=2)
+    client = rag.app.test_client()
+
+    assert client.post('/api/reindex-all').status_code == 200
+    listing = client.get('/api/list-documents').json
+
+    names = sorted(os.path.basename(path) for path in paths)
+    assert [document['filename'] for document in listing['folder_documents']] == names
+    assert all(document['indexed'] for document in listing['folder_documents'])
+    assert sorted(listing['indexed_documents']) == names
+    assert sorted(rag.processed_files) == sorted(paths)
+
+
+def test_uploads_are_registered_only_once_ingested(rag, tmp_path, monkeypatch):
+    uploads = str(tmp_path / 'uploads')
+    monkeypatch.setattr(rag, 'UPLOAD_FOLDER', uploads)
+    monkeypatch.setattr(rag, 'job_queue', JobQueue(str(tmp_path / 'jobs'), rag.run_ingestion_job))
+    (source,) = benchmark.generate_corpus(str(tmp_path / 'corpus'), 1, pages=1)
+    filepath = os.path.join(uploads, os.path.basename(source))
+    client = rag.app.test_client()
+
+    def upload():
+        with open(source, 'rb') as f:
+            response = client.post('/api/upload', data={'file': (f, os.path.basename(source))})
+        assert response.status_code == 202
+        deadline = time.time() + 10
+        while rag.job_queue.describe(response.json['job_id'])['status'] in ('queued', 'running'):
+            assert time.time() < deadline
+            time.sleep(0.01)
+        return rag.job_queue.describe(response.json['job_id'])
+
+    ingest_job_file = rag.ingest_job_file
+    failures = [RuntimeError('extraction failed')]
+
+    def ingest_or_fail(job, progress):
+        # The upload is not registered while its job runs
+        assert filepath not in rag.processed_files
+        if failures:
+            raise failures.pop()
+        return ingest_job_file(job, progress)
+
+    monkeypatch.setattr(rag, 'ingest_job_file', ingest_or_fail)
+    assert upload()['status'] == 'failed'
+    assert filepath not in rag.processed_files
+
+    assert upload()['status'] == 'done'
+    assert rag.processed_files[filepath] == rag.file_md5(filepath)
+    assert rag.is_file_processed(filepath)
@@ -0,0 +1,55 @@
+CHUNKS = ["annual leave requests go to the manager", "expense reports are due monthly",
+          "the vpn needs two factor authentication"]
+
+
+def chunk_ids(current):
+    ids = current.metadata.ids_of_sources(current.metadata.sources())
+    return sorted(int(chunk_id) for chunk_id in ids)
+
+
+def test_commits_reuse_the_index_no_search_holds(rag):
+    rag.store_in_faiss(CHUNKS, 'a.pdf')
+    first = rag.current_snapshot().index
+    rag.store_in_faiss(CHUNKS, 'b.pdf')
+    rag.store_in_faiss(CHUNKS, 'c.pdf')
+    current = rag.current_snapshot()
+
+    assert current.index is first
+    assert current.ntotal == len(current.metadata) == 9
+    _, I = current.search(rag.encode_query(CHUNKS[0]), 9)
+    assert sorted(I[0].tolist()) == chunk_ids(current)
+
+
+def test_index_of_a_held_snapshot_is_never_written(rag):
+    rag.store_in_faiss(CHUNKS, 'a.pdf')
+    held = rag.current_snapshot()
+    rag.store_in_faiss(CHUNKS, 'b.pdf')
+    rag.store_in_faiss(CHUNKS, 'c.pdf')
+
+    assert rag.current_snapshot().index is not held.index
+    assert held.index.ntotal == 3
+    assert rag.current_snapshot().ntotal == 9
+
+
+def test_hnsw_deletions_are_skipped_without_rebuilding(rag, monkeypatch):
+    monkeypatch.setattr(rag, 'INDEX_TYPE', 'hnsw')
+    rag.initialize_index()
+    for name in ('a.pdf', 'b.pdf', 'c.pdf', 'd.pdf', 'e.pdf', 'f.pdf'):
+        rag.store_in_faiss(CHUNKS, name)
+    graph = rag.current_snapshot().index
+
+    rag.delete_document('a.pdf')
+    current = rag.current_snapshot()
+    assert rag.index_type_of(current.index) == 'hnsw'
+    assert current.index.ntotal == graph.ntotal == 18
+    assert current.ntotal == len(current.metadata) == 15
+    _, I = current.search(rag.encode_query(CHUNKS[0]), 18)
+    assert sorted(I[0][I[0] >= 0].tolist()) == chunk_ids(current)
+
+    # Past HNSW_MAX_REMOVED_FRACTION the graph is rebuilt without them
+    rag.delete_document('b.pdf')
+    current = rag.current_snapshot()
+    assert current.index.ntotal == current.ntotal == 12
+    assert not len(current.removed)
+    _, I = current.search(rag.encode_query(CHUNKS[1]), 12)
+    assert sorted(I[0].tolist()) == chunk_ids(current)
@@ -0,0 +1,41 @@
+import os
+import threading
+import time
+
+import benchmark
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_ingestions_locking_documents_in_opposite_orders_both_finish(rag, tmp_path, monkeypatch):
+    paths = sorted(benchmark.generate_corpus(str(tmp_path / 'documents'), 2, pages=1))
+    first, second = (os.path.basename(path) for path in paths)
+    extracted = []
+    monkeypatch.setattr(rag, 'observe_extraction', extracted.append)
+    # Another ingestion holds the second document; the first is held until both are extracted,
+    # so the pipeline gets them in the same batch
+    held = rag.IngestionBatch()
+    held.add_document(second, [(None, 'a chunk of the second document')])
+    blocker = rag.IngestionBatch()
+    blocker.add_document(first, [(None, 'a chunk of the first document')])
+
+    result = {}
+    ingestion = threading.Thread(target=lambda: result.update(indexed=rag.ingest_documents(paths, workers=1)))
+    ingestion.start()
+    wait_until(lambda: len(extracted) == 2)
+    time.sleep(0.2)
+    blocker.abort()
+    # The pipeline takes the first document, then finds the second one held
+    wait_until(lambda: rag.document_lock(first).locked() or first in rag.current_snapshot().metadata.sources())
+
+    other = threading.Thread(target=lambda: (held.add_document(first, [(None, 'a chunk of the first document')]),
+                                             held.commit()))
+    other.start()
+    other.join(30)
+    ingestion.join(30)
+    assert not other.is_alive() and not ingestion.is_alive()
+    assert result['indexed'] == 2
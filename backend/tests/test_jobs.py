@@ -0,0 +1,80 @@
+import threading
+import time
+
+from jobs import JobQueue
+
+
+def wait_until_finished(queue):
+    deadline = time.time() + 10
+    while any(job['status'] in ('queued', 'running') for job in queue.jobs.values()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_active_jobs_are_deduplicated_finished_ones_are_not(tmp_path):
+    release = threading.Event()
+    ran = []
+
+    def runner(job, progress):
+        release.wait(10)
+        ran.append(job['filename'])
+
+    queue = JobQueue(str(tmp_path), runner)
+    first, created = queue.submit('a.pdf', 'a.pdf', 'v1')
+    assert created
+    same, created = queue.submit('a.pdf', 'a.pdf', 'v1')
+    assert not created and same['id'] == first['id']
+    # The same bytes under another name or in another collection are other documents
+    assert queue.submit('b.pdf', 'b.pdf', 'v1')[1]
+    assert queue.submit('a.pdf', 'a.pdf', 'v1', collection='hr')[1]
+    release.set()
+    wait_until_finished(queue)
+
+    # The file went back to a version that was already ingested: it is ingested again
+    assert queue.submit('a.pdf', 'a.pdf', 'v2')[1]
+    wait_until_finished(queue)
+    again, created = queue.submit('a.pdf', 'a.pdf', 'v1')
+    assert created and again['id'] != first['id']
+    wait_until_finished(queue)
+    assert ran == ['a.pdf', 'b.pdf', 'a.pdf', 'a.pdf', 'a.pdf']
+
+
+def test_jobs_directory_is_only_read_once_started(tmp_path):
+    directory = tmp_path / 'jobs'
+    queue = JobQueue(str(directory), lambda job, progress: None)
+    assert not directory.exists()
+    queue.start()
+    assert directory.is_dir() and queue.worker.is_alive()
+
+
+def test_interrupted_jobs_run_again_and_failures_are_reported(tmp_path):
+    ran = []
+
+    def runner(job, progress):
+        progress(stage='embedding', chunks_total=4, chunks_processed=2)
+        ran.append(job['filename'])
+        if job['filename'] == 'broken.pdf':
+            raise ValueError('no text layer')
+        return {'chunks': 4}
+
+    # A job that was running when the process stopped, and one that had finished
+    first = JobQueue(str(tmp_path), runner)
+    first.start()
+    interrupted, _ = first.submit('a.pdf', 'a.pdf', 'v1')
+    wait_until_finished(first)
+    first.jobs[interrupted['id']].update(status='running', stage='embedding', chunks_processed=2)
+    first._save(first.jobs[interrupted['id']])
+    ran.clear()
+
+    queue = JobQueue(str(tmp_path), runner)
+    queue.start()
+    failed, _ = queue.submit('broken.pdf', 'broken.pdf', 'v1')
+    wait_until_finished(queue)
+    assert ran == ['a.pdf', 'broken.pdf']
+    resumed = queue.describe(interrupted['id'])
+    assert (resumed['status'], resumed['stage'], resumed['result']) == ('done', 'done', {'chunks': 4})
+    failed = queue.describe(failed['id'])
+    assert (failed['status'], failed['error']) == ('failed', 'no text layer')
+    # A failed job does not stop a new submission of the same file
+    assert queue.submit('broken.pdf', 'broken.pdf', 'v1')[1]
+    wait_until_finished(queue)
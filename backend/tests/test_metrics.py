@@ -0,0 +1,22 @@
+import metrics
+
+
+def test_trace_ends_with_its_request(rag, monkeypatch):
+    monkeypatch.setattr(rag, 'generate_response_ollama', lambda augmented_query, history=None: 'An answer.')
+    client = rag.app.test_client()
+
+    response = client.post('/api/chat', json={'query': 'leave policy'}, headers={metrics.DEBUG_TRACE_HEADER: '1'})
+    assert response.get_json()['trace']
+    # Later requests served by the same thread do not add their stages to that trace
+    assert metrics._trace.get() is None
+    assert 'trace' not in client.post('/api/chat', json={'query': 'vpn access'}).get_json()
+    assert metrics._trace.get() is None
+
+
+def test_nested_traces_restore_the_outer_one():
+    with metrics.tracing() as outer:
+        with metrics.tracing(False) as inner:
+            metrics.observe_stage('search', 0.001)
+        metrics.observe_stage('packing', 0.002)
+    metrics.observe_stage('llm', 0.003)
+    assert inner is None and [stage['stage'] for stage in outer] == ['packing']
@@ -0,0 +1,26 @@
+import os
+
+import benchmark
+from vector_store import MANIFEST_NAME
+
+
+def segment_bytes(directory):
+    # The manifest and the catalog hold ingestion times, and the catalog grows until it is rewritten
+    return sum(entry.stat().st_size for entry in os.scandir(directory)
+               if entry.is_file() and entry.name != MANIFEST_NAME and not entry.name.startswith('catalog-'))
+
+
+def test_reindexing_does_not_grow_the_index_or_the_store(rag, tmp_path, monkeypatch):
+    folder = str(tmp_path / 'documents')
+    monkeypatch.setattr(rag, 'DOCUMENTS_FOLDER', folder)
+    benchmark.generate_corpus(folder, 3, pages=2)
+    client = rag.app.test_client()
+
+    sizes = []
+    for _ in range(4):
+        assert client.post('/api/reindex-all').status_code == 200
+        sizes.append((rag.snapshot.ntotal, rag.vector_store.count, len(rag.vector_store.segments),
+                      segment_bytes(rag.STORE_DIR)))
+    assert sizes[0][0] > 0
+    assert sizes[0][0] == sizes[0][1]
+    assert len(set(sizes)) == 1
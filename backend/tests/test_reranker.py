@@ -0,0 +1,52 @@
+import time
+
+from reranker import Reranker
+
+
+class StubCrossEncoder:
+    def predict(self, pairs, **kwargs):
+        # Longer contents are more relevant
+        return [len(content) for _, content in pairs]
+
+
+def test_first_batch_is_scored_after_a_slow_batch():
+    reranker = Reranker('stub', batch_size=2, deadline_ms=50)
+    reranker.model = StubCrossEncoder()
+    # A previous batch took far longer than the deadline
+    reranker.batch_seconds = 5.0
+    contexts = [{'content': 'a'}, {'content': 'abc'}, {'content': 'ab'}]
+
+    best = reranker.rerank(['query'], [contexts], 2)[0]
+
+    assert [context['content'] for context in best] == ['abc', 'a']
+    assert 'rerank_score' in best[0]
+    assert reranker.batch_seconds < 5.0
+    assert reranker.get_stats()['pairs_scored'] == 2
+
+
+class SlowCrossEncoder(StubCrossEncoder):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.batches = 0
+
+    def predict(self, pairs, **kwargs):
+        self.batches += 1
+        time.sleep(self.seconds)
+        return super().predict(pairs, **kwargs)
+
+
+def test_batches_that_would_miss_the_deadline_are_skipped():
+    reranker = Reranker('stub', batch_size=2, deadline_ms=50)
+    reranker.model = SlowCrossEncoder(0.04)
+    candidates = [[{'content': 'a'}, {'content': 'abcd'}, {'content': 'abc'}, {'content': 'ab'}],
+                  [{'content': 'x'}, {'content': 'xy'}]]
+
+    first, second = reranker.rerank(['query', 'other query'], candidates, 3)
+
+    # Only rank 1 of both queries was scored; the other candidates keep their first-stage order
+    assert reranker.model.batches == 1
+    assert [context['content'] for context in first] == ['a', 'abcd', 'abc']
+    assert 'rerank_score' in first[0] and 'rerank_score' not in first[1]
+    assert [context['content'] for context in second] == ['x', 'xy']
+    stats = reranker.get_stats()
+    assert (stats['pairs_scored'], stats['pairs_skipped'], stats['deadline_hits']) == (2, 4, 1)
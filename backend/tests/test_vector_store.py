@@ -0,0 +1,114 @@
+import json
+
+import numpy as np
+
+import vector_store
+from lexical_index import LexicalIndex, live_length_stats
+from vector_store import SegmentStore
+
+
+def records(source, texts):
+    return [{'text': text, 'full_text': text, 'source': source, 'chunk_id': f"{source}-chunk-{i}", 'chunk': i}
+            for i, text in enumerate(texts)]
+
+
+def test_commits_reopen_only_new_segments(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path), 4, max_segments=8, max_deleted_fraction=0.5)
+    rng = np.random.default_rng(0)
+    store.append(rng.random((2, 4), dtype='float32'), records('a.pdf', ['leave policy', 'leave days']))
+    store.append(rng.random((2, 4), dtype='float32'), records('b.pdf', ['vpn access', 'vpn tokens']))
+    first, second = store.metadata.files
+    computed = []
+    monkeypatch.setattr(vector_store, 'live_length_stats',
+                        lambda postings, live: computed.append(postings) or live_length_stats(postings, live))
+
+    store.delete(store.metadata.source_ids('a.pdf')[:1])
+    store.append(rng.random((1, 4), dtype='float32'), records('c.pdf', ['leave requests']))
+
+    metadata = store.metadata
+    assert metadata.files[:2] == [first, second]
+    assert len(metadata.files) == 3
+    # Only segments with new tombstones and new segments get their BM25 statistics computed again
+    assert second.postings not in computed
+    assert first.postings in computed and metadata.files[2].postings in computed
+    # BM25 statistics follow the tombstones of the reused segments
+    fresh = LexicalIndex(metadata.lexical.segments)
+    assert (metadata.lexical.count, metadata.lexical.average_length) == (fresh.count, fresh.average_length) == (4, 2.0)
+    ids, _ = metadata.lexical.search('leave', 5)
+    assert sorted(metadata[chunk_id]['source'] for chunk_id in ids) == ['a.pdf', 'c.pdf']
+
+
+def test_tombstones_are_kept_out_of_the_manifest(tmp_path):
+    store = SegmentStore(str(tmp_path), 4, max_segments=8, max_deleted_fraction=0.9)
+    rng = np.random.default_rng(0)
+    store.append(rng.random((3, 4), dtype='float32'), records('a.pdf', ['leave policy', 'leave days', 'leave form']))
+    store.append(rng.random((2, 4), dtype='float32'), records('b.pdf', ['vpn access', 'vpn tokens']))
+    deleted = store.metadata.source_ids('a.pdf')[:2]
+    store.delete(deleted)
+    first, second = store.segments
+    assert first['deleted'] == 2 and 'deleted' not in second
+    assert np.load(tmp_path / first['tombstones']).tolist() == deleted
+
+    # Commits without deletes leave the tombstones file alone, and the one it replaces is removed
+    store.append(rng.random((1, 4), dtype='float32'), records('c.pdf', ['vpn setup']))
+    assert store.segments[0]['tombstones'] == first['tombstones']
+    store.delete(store.metadata.source_ids('b.pdf')[:1])
+    assert sorted(path.name for path in tmp_path.glob('*.del.npy')) == sorted(
+        segment['tombstones'] for segment in store.segments if segment.get('tombstones'))
+
+    reopened = SegmentStore(str(tmp_path), 4)
+    assert reopened.count == store.count == 3
+    assert all(chunk_id not in reopened.metadata for chunk_id in deleted)
+    assert reopened.catalog['a.pdf']['chunks'] == 1 and reopened.catalog['b.pdf']['chunks'] == 1
+
+
+def test_upgrade_moves_tombstones_sources_and_catalog_to_files(tmp_path):
+    store = SegmentStore(str(tmp_path), 4, max_deleted_fraction=0.9)
+    store.append(np.ones((3, 4), dtype='float32'), records('a.pdf', ['leave policy', 'leave days', 'leave form']))
+    deleted = store.metadata.source_ids('a.pdf')[:1]
+    store.delete(deleted)
+    # Version 6 kept the tombstones, sources and catalog in the manifest
+    manifest = {key: value for key, value in store.manifest.items() if not key.startswith('catalog_')}
+    manifest.update(version=6, catalog=store.catalog)
+    (segment,) = manifest['segments']
+    (tmp_path / segment.pop('tombstones')).unlink()
+    segment.update(deleted=deleted, sources=['a.pdf'])
+    for path in tmp_path.glob('catalog-*'):
+        path.unlink()
+    (tmp_path / f"{segment['name']}.sources.json").unlink()
+    vector_store.atomic_write(store.manifest_path, lambda f: json.dump(manifest, f), mode='w')
+
+    upgraded = SegmentStore(str(tmp_path), 4)
+    assert upgraded.segments[0]['deleted'] == 1 and 'sources' not in upgraded.segments[0]
+    assert upgraded.count == 2 and deleted[0] not in upgraded.metadata
+    assert upgraded.metadata[upgraded.metadata.source_ids('a.pdf')[0]]['source'] == 'a.pdf'
+    assert upgraded.catalog == store.catalog
+
+
+def test_catalog_file_only_gets_the_changed_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, 'CATALOG_SLACK', 4)
+    store = SegmentStore(str(tmp_path), 4, max_segments=64)
+    for number in range(3):
+        store.append(np.ones((1, 4), dtype='float32'), records(f"{number}.pdf", ['leave policy']))
+    path = tmp_path / store.manifest['catalog_file']
+    size = path.stat().st_size
+    store.commit(documents={'1.pdf': {'content_hash': 'abc'}})
+    appended = path.read_bytes()[size:]
+    assert appended.count(b'\n') == 1 and b'1.pdf' in appended and b'abc' in appended
+
+    # Lines past the committed length were written by a commit that never reached the manifest
+    with open(path, 'ab') as f:
+        f.write(b'["2.pdf", null]\n')
+    reopened = SegmentStore(str(tmp_path), 4, max_segments=64)
+    assert reopened.catalog == store.catalog and '2.pdf' in reopened.catalog
+    reopened.delete(reopened.metadata.source_ids('0.pdf'))
+    assert sorted(SegmentStore(str(tmp_path), 4).catalog) == ['1.pdf', '2.pdf']
+
+    # Once superseded lines pile up, the catalog is rewritten to a new file with one line per document
+    for number in range(6):
+        reopened.commit(documents={'2.pdf': {'content_hash': str(number)}})
+    assert reopened.manifest['catalog_file'] != path.name
+    assert [entry.name for entry in tmp_path.glob('catalog-*')] == [reopened.manifest['catalog_file']]
+    assert reopened.manifest['catalog_records'] < 2 * len(reopened.catalog) + 4
+    assert SegmentStore(str(tmp_path), 4).catalog == reopened.catalog
+    assert reopened.catalog['2.pdf']['content_hash'] == '5'
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from watcher import DebouncedScheduler
+
+
+def test_bursts_are_coalesced_into_one_batch_of_last_events():
+    batches = []
+    handled = threading.Event()
+
+    def handler(batch):
+        batches.append(sorted(batch))
+        handled.set()
+
+    scheduler = DebouncedScheduler(handler, quiet_seconds=0.2)
+    for event in range(5):
+        scheduler.schedule('a.pdf', f"changed-{event}")
+        scheduler.schedule('b.pdf', 'changed')
+    scheduler.schedule('b.pdf', 'deleted')
+
+    assert handled.wait(5)
+    time.sleep(0.3)
+    assert batches == [[('a.pdf', 'changed-4'), ('b.pdf', 'deleted')]]
+    assert scheduler.get_stats() == {'events': 11, 'coalesced': 9, 'handled': 2, 'batches': 1, 'pending': 0}
+
+
+def test_a_key_settles_only_after_quiet_seconds_without_events():
+    batches = []
+    scheduler = DebouncedScheduler(batches.append, quiet_seconds=0.3)
+    start = time.monotonic()
+    # Events keep arriving for 0.6s, each one postponing the handling of the key
+    while time.monotonic() - start < 0.6:
+        scheduler.schedule('a.pdf', 'changed')
+        assert batches == []
+        time.sleep(0.02)
+    deadline = time.monotonic() + 5
+    while not batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert batches == [[('a.pdf', 'changed')]]
+
+
+def test_handler_errors_do_not_stop_the_worker():
+    batches = []
+
+    def handler(batch):
+        batches.append(batch)
+        if len(batches) == 1:
+            raise RuntimeError('ingestion failed')
+
+    scheduler = DebouncedScheduler(handler, quiet_seconds=0.01)
+    scheduler.schedule('a.pdf', 'changed')
+    deadline = time.monotonic() + 5
+    while not batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.schedule('b.pdf', 'changed')
+    while len(batches) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert batches == [[('a.pdf', 'changed')], [('b.pdf', 'changed')]]
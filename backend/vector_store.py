@@ -0,0 +1,1006 @@
+"""Append-only on-disk storage for chunk embeddings and metadata.
+
+Each commit writes one new segment and then atomically rewrites a small
+manifest listing the committed segments. A ``SegmentWriter`` streams the
+vectors and texts of a segment to disk as they are produced, so a document
+of any size is stored without being held in memory. Nothing already on disk is
+rewritten during ingestion, so the cost of persisting a document is
+proportional to the document and not to the whole corpus. Segments that are
+not listed in the manifest (e.g. left behind by a crash) are ignored and
+cleaned up.
+
+A segment is stored column by column so that startup never has to parse the
+chunk text:
+
+* ``<name>.vec.npy``  float32 vectors, loaded with ``mmap_mode='r'``
+* ``<name>.cols.npy`` one fixed-size row per chunk (chunk id, text offset and
+  length, source id, chunk number and page number), also memory-mapped
+* ``<name>.text``     the UTF-8 chunk texts concatenated; a chunk is only read
+  from disk when it is looked up (e.g. for the top-k hits of a query)
+* ``<name>.bm25``     the BM25 postings of the chunks (see lexical_index.py)
+* ``<name>.sources.json`` the source file names the chunks refer to by number
+
+A catalog of every stored document (chunk count, id range, text size, content
+hash and ingestion time) is updated by each commit, so listing the documents
+never scans the chunks. It is kept in an append-only ``catalog-<commit>.jsonl``
+file: a commit appends the entries of the documents it changed, and the
+manifest records the length of the file that is committed. The file is
+rewritten with one line per document once superseded lines make up most of
+it. A commit thus writes a manifest the size of the segment list, not of the
+number of documents.
+
+Every chunk gets a stable 64-bit id when it is appended. Ids only grow, so
+they are sorted in storage order, and they are what the FAISS index returns.
+Deleting a chunk does not rewrite its segment: its id is added to the
+segment's tombstones, in the same commit as any chunks that replace it. The
+sorted tombstone ids of a segment are kept next to it in
+``<name>.<commit>.del.npy``, written anew by each commit that deletes rows of
+the segment and referenced from its manifest entry, so a commit only writes
+the tombstones of the segments it deletes from.
+
+When the number of segments grows past ``max_segments``, or tombstones make up
+more than ``max_deleted_fraction`` of the rows, the segments are merged into a
+single segment without the deleted rows. Chunk ids survive compaction.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from lexical_index import (
+    LexicalIndex, PostingsBuilder, live_length_stats, load_postings, merge_postings, save_postings
+)
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 8
+# Segments being written live here until they are committed
+PENDING_DIR = 'pending'
+# Superseded catalog lines tolerated on top of one line per document before the file is rewritten
+CATALOG_SLACK = 1024
+
+COLUMNS_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('offset', '<i8'),
+    ('length', '<i4'),
+    ('source', '<i4'),
+    ('chunk', '<i4'),
+    ('page', '<i4'),         # page or slide number, 0 if unknown
+])
+
+
+def atomic_write(path, write_fn, mode='wb'):
+    """Write a file through a temporary file and rename it into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def preview_text(text, limit=500):
+    """Short ASCII-only preview of a chunk, as stored in the 'text' metadata field."""
+    truncated_text = text[:limit] if len(text) > limit else text
+    return ''.join(char for char in truncated_text if ord(char) < 128)
+
+
+def chunk_number(record):
+    """Position of a chunk within its source document."""
+    if 'chunk' in record:
+        return int(record['chunk'])
+    # Records from older versions only have the textual chunk id
+    return int(record['chunk_id'].rsplit('-chunk-', 1)[1])
+
+
+def source_totals(columns):
+    """(source number, chunks, text bytes, first id, last id) of every source in some column rows."""
+    sources, inverse, counts = np.unique(columns['source'], return_inverse=True, return_counts=True)
+    text_bytes = np.bincount(inverse, weights=columns['length'], minlength=len(sources))
+    first_ids = np.full(len(sources), np.iinfo('<i8').max, dtype='<i8')
+    last_ids = np.full(len(sources), -1, dtype='<i8')
+    np.minimum.at(first_ids, inverse, columns['id'])
+    np.maximum.at(last_ids, inverse, columns['id'])
+    return zip(sources.tolist(), counts.tolist(), text_bytes.astype('<i8').tolist(),
+               first_ids.tolist(), last_ids.tolist())
+
+
+def catalog_lines(catalog, names):
+    """Catalog file lines of some documents: ``[name, entry]``, with a null entry for a removed document."""
+    return b''.join(json.dumps([name, catalog.get(name)], ensure_ascii=False).encode('utf-8') + b'\n'
+                    for name in names)
+
+
+def text_digest(text):
+    """Short hash identifying a chunk text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def npy_header(shape, dtype='float32'):
+    """The .npy (version 1.0) header of a C-ordered array."""
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buffer, {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        'fortran_order': False,
+        'shape': shape,
+    })
+    return buffer.getvalue()
+
+
+class ChunkDiff:
+    """Matches the new chunks of a document, one at a time, against its stored chunks.
+
+    ``stored`` is a list of (chunk id, chunk number, text digest). ``match``
+    classifies a new chunk as 'kept' (stored with the same number and text,
+    nothing to write), 'reused' (text stored under another number, its
+    vector can be copied) or None (must be encoded). Stored chunks that were
+    not kept are ``stale`` once the whole document has been seen.
+    """
+
+    def __init__(self, stored):
+        self.by_number = {}
+        self.by_digest = {}
+        for chunk_id, number, digest in stored:
+            self.by_number[number] = (chunk_id, digest)
+            self.by_digest.setdefault(digest, chunk_id)
+        self.kept = set()
+
+    def match(self, position, text):
+        """Return ('kept' | 'reused' | None, stored chunk id or None)."""
+        if not self.by_number:
+            return None, None
+        digest = text_digest(text)
+        stored_chunk = self.by_number.get(position)
+        if stored_chunk is not None and stored_chunk[1] == digest:
+            self.kept.add(stored_chunk[0])
+            return 'kept', stored_chunk[0]
+        if digest in self.by_digest:
+            return 'reused', self.by_digest[digest]
+        return None, None
+
+    def stale(self):
+        """Ids of stored chunks that are not part of the new version."""
+        return [chunk_id for chunk_id, _ in self.by_number.values() if chunk_id not in self.kept]
+
+
+class SegmentFiles:
+    """The open files of one committed segment and the arrays derived from them.
+
+    Segment files never change once committed, so every metadata view that
+    includes the segment shares this object: a commit only opens its new
+    (or compacted) segment. Only the tombstones of a segment change, and
+    they only grow, so what depends on them is recomputed when their number
+    changes.
+    """
+
+    def __init__(self, store, name):
+        self.name = name
+        self.columns = store._load_columns(name)
+        self.vectors = store._load_vectors(name)
+        self.text_file = open(store._segment_paths(name)[2], 'rb')
+        self.read_lock = threading.Lock()
+        self.postings = store._load_postings(name)
+        self.sources = store._load_sources(name)
+        self.store = store
+        self._source_index = None
+        # (tombstones file, sorted tombstone ids)
+        self._tombstones = (None, np.empty(0, dtype='<i8'))
+        # (number of tombstones, live row mask, BM25 stats), None until first computed
+        self._live = None
+
+    def tombstones(self, segment):
+        """Sorted ids of the deleted rows, as of the manifest entry ``segment``."""
+        if self._tombstones[0] != segment.get('tombstones'):
+            self._tombstones = (segment.get('tombstones'), self.store._load_tombstones(segment))
+        return self._tombstones[1]
+
+    def live_rows(self, deleted):
+        """Mask of the rows whose ids are not in ``deleted`` (None if all are live) and
+        their (count, total length) for BM25."""
+        if self._live is None or self._live[0] != len(deleted):
+            live = ~np.isin(self.columns['id'], deleted) if len(deleted) else None
+            self._live = (len(deleted), live, live_length_stats(self.postings, live))
+        return self._live[1:]
+
+    def read_text(self, offset, length):
+        if hasattr(os, 'pread'):
+            data = os.pread(self.text_file.fileno(), length, offset)
+        else:
+            with self.read_lock:
+                self.text_file.seek(offset)
+                data = self.text_file.read(length)
+        return data.decode('utf-8')
+
+    def source_index(self):
+        """Its source numbers by name, and its row numbers grouped by source.
+
+        Built on first use, then finding the rows of a document costs the
+        number of its rows instead of a scan of the segment.
+        """
+        if self._source_index is None:
+            order = np.argsort(self.columns['source'], kind='stable')
+            bounds = np.searchsorted(self.columns['source'][order], np.arange(len(self.sources) + 1))
+            numbers = {source: number for number, source in enumerate(self.sources)}
+            self._source_index = (numbers, order, bounds)
+        return self._source_index
+
+
+class ChunkMetadata:
+    """Read-only view over the metadata of all committed segments, keyed by chunk id.
+
+    ``metadata[chunk_id]`` returns the same dictionary the app used to keep in
+    memory ('text', 'full_text', 'source', 'chunk_id', plus 'chunk' and 'page'), but the
+    text is only read from disk when the item is accessed. Deleted chunks are
+    not visible. ``lexical`` is the BM25 index of the same chunks.
+
+    A view keeps its segment files open (and their vectors memory-mapped), so
+    it stays readable after a compaction has replaced (and deleted) the
+    segments it was built from. The files are shared with the other views
+    of the same segments, see ``SegmentFiles``. ``catalog`` maps every
+    document to its catalog entry, see ``SegmentStore.catalog``.
+    """
+
+    def __init__(self, store, segments, catalog=None):
+        self.store = store
+        self.segments = segments
+        self.catalog = catalog if catalog is not None else {}
+        self._catalog_names = None
+        self.files = [store._segment_files(segment['name']) for segment in segments]
+        self.columns = [files.columns for files in self.files]
+        self.vectors = [files.vectors for files in self.files]
+        self.starts = np.cumsum([0] + [segment['count'] for segment in segments])
+        self.tombstones = [files.tombstones(segment) for segment, files in zip(segments, self.files)]
+        self.deleted_count = sum(len(tombstones) for tombstones in self.tombstones)
+        self._ids = None
+        self._deleted_ids = None
+        live_rows = [files.live_rows(tombstones) for files, tombstones in zip(self.files, self.tombstones)]
+        self.lexical = LexicalIndex(
+            [(files.postings, files.columns['id'], live) for files, (live, _) in zip(self.files, live_rows)],
+            stats=[stats for _, stats in live_rows]
+        )
+
+    @property
+    def ids(self):
+        """Ids of every stored row, deleted ones included, in (ascending) storage order."""
+        if self._ids is None:
+            if self.columns:
+                self._ids = np.concatenate([columns['id'] for columns in self.columns])
+            else:
+                self._ids = np.empty(0, dtype='<i8')
+        return self._ids
+
+    @property
+    def deleted_ids(self):
+        """Sorted ids of the tombstoned rows."""
+        if self._deleted_ids is None:
+            # Segments are in id order, so their tombstones are too
+            if self.tombstones:
+                self._deleted_ids = np.concatenate(self.tombstones)
+            else:
+                self._deleted_ids = np.empty(0, dtype='<i8')
+        return self._deleted_ids
+
+    def __len__(self):
+        return int(self.starts[-1]) - self.deleted_count
+
+    def __contains__(self, chunk_id):
+        return self.locate(chunk_id) is not None
+
+    def __getitem__(self, chunk_id):
+        location = self.locate(chunk_id)
+        if location is None:
+            raise KeyError(chunk_id)
+        segment_number, row_number = location
+        row = self.columns[segment_number][row_number]
+
+        full_text = self._read_text(segment_number, int(row['offset']), int(row['length']))
+        source = self.files[segment_number].sources[int(row['source'])]
+        return {
+            'text': preview_text(full_text),
+            'full_text': full_text,
+            'source': source,
+            'chunk_id': f"{source}-chunk-{int(row['chunk'])}",
+            'chunk': int(row['chunk']),
+            'page': int(row['page']) or None
+        }
+
+    def get(self, chunk_id, default=None):
+        try:
+            return self[chunk_id]
+        except KeyError:
+            return default
+
+    def locate(self, chunk_id):
+        """(segment number, row number) of a live chunk, or None."""
+        chunk_id = int(chunk_id)
+        position = int(np.searchsorted(self.ids, chunk_id))
+        if position >= len(self.ids) or self.ids[position] != chunk_id:
+            return None
+        segment_number = int(np.searchsorted(self.starts, position, side='right')) - 1
+        tombstones = self.tombstones[segment_number]
+        deleted_position = int(np.searchsorted(tombstones, chunk_id))
+        if deleted_position < len(tombstones) and tombstones[deleted_position] == chunk_id:
+            return None
+        return segment_number, position - int(self.starts[segment_number])
+
+    def _read_text(self, segment_number, offset, length):
+        return self.files[segment_number].read_text(offset, length)
+
+    def _source_rows(self, source):
+        """Yield (segment number, row) for the live chunks of one document."""
+        for segment_number, files in enumerate(self.files):
+            numbers, order, bounds = files.source_index()
+            number = numbers.get(source)
+            if number is None:
+                continue
+            rows = files.columns[order[bounds[number]:bounds[number + 1]]]
+            if len(self.tombstones[segment_number]):
+                rows = rows[~np.isin(rows['id'], self.tombstones[segment_number])]
+            for row in rows:
+                yield segment_number, row
+
+    def source_ids(self, source):
+        """Ids of the live chunks of one document."""
+        return self.ids_of_sources([source]).tolist()
+
+    def ids_of_sources(self, sources):
+        """Sorted ids of the live chunks of several documents."""
+        parts = []
+        for files in self.files:
+            numbers, order, bounds = files.source_index()
+            for source in sources:
+                number = numbers.get(source)
+                if number is not None:
+                    parts.append(files.columns['id'][order[bounds[number]:bounds[number + 1]]])
+        ids = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype='<i8')
+        if self.deleted_count and len(ids):
+            ids = ids[~np.isin(ids, self.deleted_ids)]
+        return ids
+
+    def get_vectors(self, ids):
+        """Stored vectors of live chunks, in the order of ``ids``."""
+        ids = np.asarray(ids, dtype='<i8')
+        positions = np.searchsorted(self.ids, ids)
+        valid = positions < len(self.ids)
+        valid[valid] = self.ids[positions[valid]] == ids[valid]
+        if not valid.all() or (self.deleted_count and np.isin(ids, self.deleted_ids).any()):
+            raise KeyError(f"Unknown or deleted chunk ids in {ids.tolist()[:10]}")
+
+        vectors = np.empty((len(ids), self.store.dimension), dtype='float32')
+        segment_numbers = np.searchsorted(self.starts, positions, side='right') - 1
+        for segment_number in np.unique(segment_numbers):
+            rows = np.nonzero(segment_numbers == segment_number)[0]
+            vectors[rows] = self.vectors[segment_number][positions[rows] - self.starts[segment_number]]
+        return vectors
+
+    def source_digests(self, source):
+        """(chunk id, chunk number, text digest) of the live chunks of one document.
+
+        Texts are read and hashed one at a time, for ``ChunkDiff``.
+        """
+        return [
+            (int(row['id']), int(row['chunk']),
+             text_digest(self._read_text(segment_number, int(row['offset']), int(row['length']))))
+            for segment_number, row in self._source_rows(source)
+        ]
+
+    def sources(self):
+        """Set of all source documents, read from the catalog."""
+        return set(self.catalog)
+
+    @property
+    def catalog_names(self):
+        """Document names in alphabetical order, sorted once per view."""
+        if self._catalog_names is None:
+            self._catalog_names = sorted(self.catalog)
+        return self._catalog_names
+
+
+class SegmentWriter:
+    """Writes the files of one new segment incrementally.
+
+    Vectors and chunk texts go straight to disk; only the small fixed-size
+    columns are kept in memory. Chunk ids and the segment name are assigned
+    by ``finish`` when the segment is committed, so ids stay in storage order
+    even when several writers run at once.
+    """
+
+    def __init__(self, store):
+        self.dimension = store.dimension
+        base = os.path.join(store.directory, PENDING_DIR, uuid.uuid4().hex)
+        self.vectors_path = f"{base}.vec.npy"
+        self.text_path = f"{base}.text"
+        self.vectors_file = open(self.vectors_path, 'wb')
+        self.text_file = open(self.text_path, 'wb')
+        # Placeholder header, rewritten with the real row count by finish()
+        self.header = npy_header((0, self.dimension))
+        self.vectors_file.write(self.header)
+        self.columns = []
+        self.postings = PostingsBuilder()
+        self.sources = []
+        self.source_ids = {}
+        self.count = 0
+        self.offset = 0
+
+    def write(self, vectors, records):
+        """Append vectors and their metadata records."""
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if len(vectors) != len(records):
+            raise ValueError(f"Got {len(vectors)} vectors but {len(records)} metadata records")
+        columns = np.zeros(len(records), dtype=COLUMNS_DTYPE)
+        encoded_texts = []
+        for row, record in enumerate(records):
+            encoded = record['full_text'].encode('utf-8')
+            encoded_texts.append(encoded)
+            self.postings.add(record['full_text'])
+            if record['source'] not in self.source_ids:
+                self.source_ids[record['source']] = len(self.sources)
+                self.sources.append(record['source'])
+            columns[row] = (0, self.offset, len(encoded), self.source_ids[record['source']],
+                            chunk_number(record), record.get('page') or 0)
+            self.offset += len(encoded)
+
+        self.vectors_file.write(vectors.tobytes())
+        self.text_file.writelines(encoded_texts)
+        self.columns.append(columns)
+        self.count += len(records)
+
+    def finish(self, store, name, ids):
+        """Give the rows their ids and move the files in place as segment ``name``.
+
+        Returns the segment's manifest entry.
+        """
+        header = npy_header((self.count, self.dimension))
+        if len(header) != len(self.header):
+            raise ValueError(f"Cannot rewrite .npy header for {self.count} rows")
+        self.vectors_file.seek(0)
+        self.vectors_file.write(header)
+        for f in (self.vectors_file, self.text_file):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+        vectors_path, columns_path, text_path = store._segment_paths(name)
+        columns = np.concatenate(self.columns) if self.columns else np.zeros(0, dtype=COLUMNS_DTYPE)
+        columns['id'] = ids
+        postings = self.postings.build()
+        atomic_write(store._postings_path(name), lambda f: save_postings(f, postings))
+        atomic_write(columns_path, lambda f: np.save(f, columns))
+        store._write_sources(name, self.sources)
+        os.replace(self.vectors_path, vectors_path)
+        os.replace(self.text_path, text_path)
+        return {'name': name, 'count': self.count}
+
+    def abort(self):
+        """Discard everything written so far."""
+        for f in (self.vectors_file, self.text_file):
+            f.close()
+        for path in (self.vectors_path, self.text_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SegmentStore:
+    """Segmented, append-only store of vectors and metadata records."""
+
+    def __init__(self, directory, dimension, max_segments=32, max_deleted_fraction=0.25):
+        self.directory = directory
+        self.dimension = dimension
+        self.max_segments = max_segments
+        self.max_deleted_fraction = max_deleted_fraction
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        os.makedirs(directory, exist_ok=True)
+        # Segments left pending by a crash were never committed
+        shutil.rmtree(os.path.join(directory, PENDING_DIR), ignore_errors=True)
+        os.makedirs(os.path.join(directory, PENDING_DIR))
+        self.manifest = self._read_manifest()
+        self._catalog = self._read_catalog()
+        # Open files of the committed segments, shared by the metadata views
+        self.open_segments = {}
+        self.metadata = ChunkMetadata(self, self.segments, self.catalog)
+
+    def exists(self):
+        """Return True if a manifest has been committed."""
+        return os.path.exists(self.manifest_path)
+
+    @property
+    def segments(self):
+        return self.manifest['segments']
+
+    @property
+    def catalog(self):
+        """Per-document entries: 'chunks', 'bytes' (of chunk text), 'first_id' and 'last_id'.
+
+        Every live chunk id of the document lies between 'first_id' and
+        'last_id'. 'ingested_at' is the time of the document's last commit
+        and 'content_hash' the hash given by the caller, if any.
+        """
+        return self._catalog
+
+    @property
+    def count(self):
+        """Number of live (not deleted) vectors in committed segments."""
+        return sum(segment['count'] for segment in self.segments) - self.deleted_count
+
+    @property
+    def deleted_count(self):
+        """Number of tombstoned rows waiting for the next compaction."""
+        return sum(segment.get('deleted', 0) for segment in self.segments)
+
+    @property
+    def next_id(self):
+        """Id the next appended chunk will get."""
+        return self.manifest.get('next_id', 0)
+
+    def _read_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('dimension') != self.dimension:
+                raise ValueError(
+                    f"Store dimension {manifest.get('dimension')} does not match model dimension {self.dimension}"
+                )
+            if manifest.get('version', 1) < MANIFEST_VERSION:
+                manifest = self._upgrade_manifest(manifest)
+            return manifest
+        return {'version': MANIFEST_VERSION, 'dimension': self.dimension, 'next_segment': 0, 'next_id': 0,
+                'segments': []}
+
+    def _write_manifest(self, manifest, catalog=None):
+        atomic_write(
+            self.manifest_path,
+            lambda f: json.dump(manifest, f, ensure_ascii=False, indent=1),
+            mode='w'
+        )
+        self.manifest = manifest
+        if catalog is not None:
+            self._catalog = catalog
+        self.metadata = ChunkMetadata(self, self.segments, self.catalog)
+        # Views of older manifests keep the files of the segments dropped since
+        self.open_segments = {files.name: files for files in self.metadata.files}
+
+    def _read_catalog(self):
+        """Replay the catalog file up to the length committed by the manifest."""
+        catalog = {}
+        if self.manifest.get('catalog_file'):
+            with open(os.path.join(self.directory, self.manifest['catalog_file']), 'rb') as f:
+                data = f.read(self.manifest['catalog_length'])
+            for line in data.splitlines():
+                name, entry = json.loads(line)
+                if entry is None:
+                    catalog.pop(name, None)
+                else:
+                    catalog[name] = entry
+        return catalog
+
+    def _write_catalog(self, catalog, changed=None):
+        """Write the entries of the ``changed`` documents and return the manifest fields committing them.
+
+        They are appended to the catalog file after its committed length
+        (whatever follows was written by a commit that never reached the
+        manifest). The whole catalog is written to a new file instead when
+        ``changed`` is None, or once superseded lines outnumber the documents
+        by more than ``CATALOG_SLACK``.
+        """
+        records = self.manifest.get('catalog_records', 0) + len(changed or ())
+        if changed is None or not self.manifest.get('catalog_file') or records > 2 * len(catalog) + CATALOG_SLACK:
+            filename = f"catalog-{self.manifest['next_segment']:06d}.jsonl"
+            data = catalog_lines(catalog, catalog)
+            atomic_write(os.path.join(self.directory, filename), lambda f: f.write(data))
+            return {'catalog_file': filename, 'catalog_length': len(data), 'catalog_records': len(catalog)}
+
+        data = catalog_lines(catalog, changed)
+        length = self.manifest['catalog_length']
+        with open(os.path.join(self.directory, self.manifest['catalog_file']), 'r+b') as f:
+            f.truncate(length)
+            f.seek(length)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return {'catalog_file': self.manifest['catalog_file'], 'catalog_length': length + len(data),
+                'catalog_records': records}
+
+    def _segment_files(self, name):
+        files = self.open_segments.get(name)
+        if files is None:
+            files = self.open_segments[name] = SegmentFiles(self, name)
+        return files
+
+    def _segment_paths(self, name):
+        base = os.path.join(self.directory, name)
+        return f"{base}.vec.npy", f"{base}.cols.npy", f"{base}.text"
+
+    def _postings_path(self, name):
+        return os.path.join(self.directory, f"{name}.bm25")
+
+    def _sources_path(self, name):
+        return os.path.join(self.directory, f"{name}.sources.json")
+
+    def _load_sources(self, name):
+        with open(self._sources_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_sources(self, name, sources):
+        atomic_write(self._sources_path(name), lambda f: json.dump(sources, f, ensure_ascii=False), mode='w')
+
+    def _load_postings(self, name):
+        return load_postings(self._postings_path(name))
+
+    def _load_tombstones(self, segment):
+        """Sorted ids of the deleted rows of a segment, from its tombstones file."""
+        if not segment.get('tombstones'):
+            return np.empty(0, dtype='<i8')
+        return np.load(os.path.join(self.directory, segment['tombstones']))
+
+    def _write_tombstones(self, segment, deleted):
+        """Write the sorted ids ``deleted`` to a new tombstones file and return the updated entry.
+
+        The file is named after the next commit, so the tombstones of the
+        current manifest are never overwritten.
+        """
+        filename = f"{segment['name']}.{self.manifest['next_segment']:06d}.del.npy"
+        atomic_write(os.path.join(self.directory, filename), lambda f: np.save(f, np.asarray(deleted, dtype='<i8')))
+        return dict(segment, deleted=len(deleted), tombstones=filename)
+
+    def _write_postings(self, name):
+        """(Re)build the postings of a committed segment from its texts."""
+        columns = self._load_columns(name)
+        builder = PostingsBuilder()
+        with open(self._segment_paths(name)[2], 'rb') as f:
+            for row in columns:
+                f.seek(int(row['offset']))
+                builder.add(f.read(int(row['length'])).decode('utf-8'))
+        postings = builder.build()
+        atomic_write(self._postings_path(name), lambda f: save_postings(f, postings))
+
+    def _write_segment(self, name, vectors, records, ids):
+        """Write a segment's files and return its manifest entry."""
+        writer = SegmentWriter(self)
+        writer.write(vectors, records)
+        return writer.finish(self, name, ids)
+
+    def _load_vectors(self, name):
+        return np.load(self._segment_paths(name)[0], mmap_mode='r')
+
+    def _load_columns(self, name):
+        return np.load(self._segment_paths(name)[1], mmap_mode='r')
+
+    def _next_name(self):
+        return f"seg-{self.manifest['next_segment']:06d}"
+
+    def _commit(self, segments, next_id=None, catalog=None, changed=None):
+        """Commit a new manifest; ``catalog`` replaces the catalog, of which only ``changed`` documents
+        are written (all of them if None)."""
+        manifest = dict(self.manifest)
+        manifest['segments'] = segments
+        manifest['next_segment'] = self.manifest['next_segment'] + 1
+        if next_id is not None:
+            manifest['next_id'] = next_id
+        if catalog is not None:
+            manifest.update(self._write_catalog(catalog, changed))
+        old_catalog_file = self.manifest.get('catalog_file')
+        self._write_manifest(manifest, catalog)
+        if old_catalog_file and old_catalog_file != manifest.get('catalog_file'):
+            self._delete_file(os.path.join(self.directory, old_catalog_file))
+
+    def segment_writer(self):
+        """Start writing a new segment; commit it with ``commit``."""
+        return SegmentWriter(self)
+
+    def commit(self, writer=None, delete_ids=(), documents=None):
+        """Tombstone ``delete_ids`` and commit the segment written by ``writer``.
+
+        Both changes become visible in a single manifest commit, with the
+        catalog updated to match. ``documents`` optionally maps document
+        names to fields to record in their catalog entries (e.g.
+        'content_hash'); their 'ingested_at' is updated even if none of their
+        chunks changed. Returns the ids given to the new chunks, in the
+        order they were written.
+        """
+        count = writer.count if writer is not None else 0
+        ids = np.arange(self.next_id, self.next_id + count, dtype='<i8')
+        delete_ids = np.unique(np.asarray(list(delete_ids), dtype='<i8'))
+        documents = documents or {}
+        if count == 0 and len(delete_ids) == 0 and not any(name in self.catalog for name in documents):
+            if writer is not None:
+                writer.abort()
+            return ids
+
+        now = time.time()
+        catalog = dict(self.catalog)
+        changed = set()
+        segments = list(self.segments)
+        replaced = []
+        emptied = []
+        if len(delete_ids):
+            segments = []
+            metadata = self.metadata
+            for segment, files, tombstones in zip(self.segments, metadata.files, metadata.tombstones):
+                columns = files.columns
+                # Ids are sorted within a segment, so only the ids of its range are looked up
+                start, end = np.searchsorted(delete_ids, (columns['id'][0], columns['id'][-1] + 1))
+                rows = np.searchsorted(columns['id'], delete_ids[start:end])
+                rows = rows[columns['id'][rows] == delete_ids[start:end]]
+                if len(tombstones):
+                    rows = rows[~np.isin(columns['id'][rows], tombstones)]
+                if len(rows):
+                    for source, chunks, text_bytes, _, _ in source_totals(columns[rows]):
+                        name = files.sources[source]
+                        changed.add(name)
+                        entry = dict(catalog[name], chunks=catalog[name]['chunks'] - chunks,
+                                     bytes=catalog[name]['bytes'] - text_bytes)
+                        if entry['chunks'] > 0:
+                            catalog[name] = entry
+                        else:
+                            del catalog[name]
+                    replaced.append(segment)
+                    segment = self._write_tombstones(segment, np.union1d(tombstones, columns['id'][rows]))
+                if segment.get('deleted', 0) == segment['count']:
+                    emptied.append(segment)
+                else:
+                    segments.append(segment)
+        if count:
+            segment = writer.finish(self, self._next_name(), ids)
+            segments.append(segment)
+            for source, chunks, text_bytes, first_id, last_id in source_totals(self._load_columns(segment['name'])):
+                name = writer.sources[source]
+                changed.add(name)
+                entry = catalog.get(name) or {'chunks': 0, 'bytes': 0, 'first_id': first_id, 'last_id': last_id,
+                                              'content_hash': None}
+                catalog[name] = dict(entry, chunks=entry['chunks'] + chunks, bytes=entry['bytes'] + text_bytes,
+                                     first_id=min(entry['first_id'], first_id),
+                                     last_id=max(entry['last_id'], last_id), ingested_at=now)
+        elif writer is not None:
+            writer.abort()
+        for name, fields in documents.items():
+            if name in catalog:
+                catalog[name] = dict(catalog[name], **fields, ingested_at=now)
+                changed.add(name)
+
+        # New segments, tombstones and catalog entries only become visible once the manifest references them
+        self._commit(segments, next_id=self.next_id + count, catalog=catalog, changed=changed)
+        for segment in replaced:
+            self._delete_tombstones(segment)
+        for segment in emptied:
+            self._delete_segment(segment)
+
+        if (len(self.segments) > self.max_segments
+                or self.deleted_count > self.max_deleted_fraction * max(self.count, 1)):
+            self.compact()
+        return ids
+
+    def update(self, vectors, records, delete_ids=()):
+        """Tombstone ``delete_ids`` and persist new vectors and metadata as a new segment.
+
+        Returns the ids given to the new chunks, in the order of ``records``.
+        """
+        writer = self.segment_writer()
+        try:
+            writer.write(vectors, records)
+        except Exception:
+            writer.abort()
+            raise
+        return self.commit(writer, delete_ids)
+
+    def append(self, vectors, records):
+        """Persist a batch of vectors and their metadata as a new segment. Returns their ids."""
+        return self.update(vectors, records)
+
+    def delete(self, ids):
+        """Tombstone chunks by id."""
+        self.update(np.empty((0, self.dimension), dtype='float32'), [], ids)
+
+    def get_vectors(self, ids):
+        """Stored vectors of live chunks, in the order of ``ids``."""
+        return self.metadata.get_vectors(ids)
+
+    def load_vectors(self):
+        """Yield (ids, vectors) for the live chunks of every committed segment in order.
+
+        Vectors are memory-mapped unless the segment has deleted rows.
+        """
+        self._remove_orphans()
+        for segment in self.segments:
+            ids = np.asarray(self._load_columns(segment['name'])['id'])
+            vectors = self._load_vectors(segment['name'])
+            if segment.get('deleted'):
+                live = ~np.isin(ids, self._load_tombstones(segment))
+                ids, vectors = ids[live], vectors[live]
+            yield ids, vectors
+
+    def compact(self):
+        """Merge all committed segments into a single segment, dropping deleted rows."""
+        if len(self.segments) <= 1 and not self.deleted_count:
+            return
+        old_segments = list(self.segments)
+        name = self._next_name()
+        vectors_path, columns_path, text_path = self._segment_paths(name)
+
+        sources = []
+        source_ids = {}
+        all_columns = []
+        all_vectors = []
+        all_postings = []
+        offset = 0
+        with open(f"{text_path}.tmp", 'wb') as text_file:
+            for segment in old_segments:
+                columns = np.array(self._load_columns(segment['name']))
+                vectors = self._load_vectors(segment['name'])
+                deleted = segment.get('deleted')
+                live = None
+                if deleted:
+                    live = ~np.isin(columns['id'], self._load_tombstones(segment))
+                    columns, vectors = columns[live], vectors[live]
+                all_vectors.append(vectors)
+                all_postings.append((self._load_postings(segment['name']), live))
+
+                # Remap per-segment source ids onto the merged source list, dropping deleted sources
+                segment_sources = self._load_sources(segment['name'])
+                remap = np.full(len(segment_sources), -1, dtype='<i4')
+                for source_number in np.unique(columns['source']):
+                    source = segment_sources[source_number]
+                    if source not in source_ids:
+                        source_ids[source] = len(sources)
+                        sources.append(source)
+                    remap[source_number] = source_ids[source]
+                if len(columns):
+                    columns['source'] = remap[columns['source']]
+
+                with open(self._segment_paths(segment['name'])[2], 'rb') as f:
+                    if deleted:
+                        # Copy the text of the remaining rows only
+                        for row in columns:
+                            f.seek(int(row['offset']))
+                            text_file.write(f.read(int(row['length'])))
+                        columns['offset'] = offset + np.concatenate(([0], np.cumsum(columns['length'][:-1])))
+                    else:
+                        shutil.copyfileobj(f, text_file)
+                        columns['offset'] += offset
+                all_columns.append(columns)
+                offset = text_file.tell()
+            text_file.flush()
+            os.fsync(text_file.fileno())
+        os.replace(f"{text_path}.tmp", text_path)
+
+        # Stream the vectors segment by segment rather than stacking them in memory
+        count = sum(len(vectors) for vectors in all_vectors)
+
+        def write_vectors(f):
+            f.write(npy_header((count, self.dimension)))
+            for vectors in all_vectors:
+                f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+
+        atomic_write(vectors_path, write_vectors)
+        postings = merge_postings(all_postings)
+        atomic_write(self._postings_path(name), lambda f: save_postings(f, postings))
+        atomic_write(columns_path, lambda f: np.save(f, np.concatenate(all_columns)))
+        self._write_sources(name, sources)
+
+        self._commit([{'name': name, 'count': count}])
+        for segment in old_segments:
+            self._delete_segment(segment)
+        print(f"Compacted {len(old_segments)} segments into {name} ({count} vectors)")
+
+    def reset(self):
+        """Drop every segment and start from an empty store."""
+        old_segments = list(self.segments)
+        self._commit([], catalog={})
+        for segment in old_segments:
+            self._delete_segment(segment)
+
+    def _delete_segment(self, segment):
+        self._delete_tombstones(segment)
+        name = segment['name']
+        for path in self._segment_paths(name) + (self._postings_path(name), self._sources_path(name)):
+            self._delete_file(path)
+
+    def _delete_tombstones(self, segment):
+        """Delete the tombstones file of a manifest entry that is no longer committed."""
+        if segment.get('tombstones'):
+            self._delete_file(os.path.join(self.directory, segment['tombstones']))
+
+    def _delete_file(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            # Still open by an older metadata view (Windows); removed as an orphan at next start
+            print(f"Could not delete {path}: {e}")
+
+    def _remove_orphans(self):
+        """Delete segment, tombstones, catalog and temporary files not referenced by the manifest."""
+        committed = {segment['name'] for segment in self.segments}
+        tombstones = {segment.get('tombstones') for segment in self.segments}
+        for filename in os.listdir(self.directory):
+            if filename == MANIFEST_NAME:
+                continue
+            name = filename.split('.', 1)[0]
+            if filename.endswith('.tmp') or (filename.startswith('seg-') and name not in committed) \
+                    or (filename.endswith('.del.npy') and filename not in tombstones) \
+                    or (filename.startswith('catalog-') and filename != self.manifest.get('catalog_file')):
+                os.remove(os.path.join(self.directory, filename))
+
+    def _upgrade_manifest(self, manifest):
+        """Bring older segments to the current format, numbering chunks in storage order.
+
+        Version 1 segments (.npy vectors + .jsonl metadata) are rewritten in
+        the columnar format; later columns gain the fields they are missing
+        (chunk ids from version 3, page numbers from version 4). Segments
+        from before version 5 get their BM25 postings, and manifests from
+        before version 6 their document catalog. Tombstone id lists kept in
+        the manifest before version 7 move to tombstones files, and the
+        source lists and catalog before version 8 to their own files.
+        """
+        version = manifest.get('version', 1)
+        print(f"Upgrading {len(manifest['segments'])} segments in {self.directory} "
+              f"from format {version} to {MANIFEST_VERSION}")
+        self.manifest = manifest
+        segments = []
+        next_id = manifest.get('next_id', 0)
+        for segment in manifest['segments']:
+            if version >= 5:
+                segments.append(segment)
+                continue
+            base = os.path.join(self.directory, segment['name'])
+            ids = np.arange(next_id, next_id + segment['count'], dtype='<i8')
+            if version < 2:
+                vectors = np.load(f"{base}.npy")
+                with open(f"{base}.jsonl", 'r', encoding='utf-8') as f:
+                    records = [json.loads(line) for line in f if line.strip()]
+                segments.append(self._write_segment(segment['name'], vectors, records, ids))
+            else:
+                old_columns = np.load(self._segment_paths(segment['name'])[1])
+                columns = np.zeros(len(old_columns), dtype=COLUMNS_DTYPE)
+                for field in old_columns.dtype.names:
+                    columns[field] = old_columns[field]
+                if 'id' not in old_columns.dtype.names:
+                    columns['id'] = ids
+                    next_id += segment['count']
+                atomic_write(self._segment_paths(segment['name'])[1], lambda f: np.save(f, columns))
+                self._write_postings(segment['name'])
+                segments.append(segment)
+                continue
+            next_id += segment['count']
+        for number, segment in enumerate(segments):
+            if isinstance(segment.get('deleted'), list):
+                segment = self._write_tombstones(segment, sorted(segment['deleted']))
+            if 'sources' in segment:
+                self._write_sources(segment['name'], segment['sources'])
+                segment = {key: value for key, value in segment.items() if key != 'sources'}
+            segments[number] = segment
+
+        catalog = manifest.pop('catalog') if version >= 6 else self._build_catalog(segments)
+        manifest = dict(manifest, version=MANIFEST_VERSION, segments=segments, next_id=next_id,
+                        **self._write_catalog(catalog))
+        atomic_write(
+            self.manifest_path,
+            lambda f: json.dump(manifest, f, ensure_ascii=False, indent=1),
+            mode='w'
+        )
+        if version < 2:
+            for segment in segments:
+                base = os.path.join(self.directory, segment['name'])
+                for path in (f"{base}.npy", f"{base}.jsonl"):
+                    os.remove(path)
+        return manifest
+
+    def _build_catalog(self, segments):
+        """Catalog of the live chunks of some segments; ingestion times and hashes are unknown."""
+        catalog = {}
+        for segment in segments:
+            columns = self._load_columns(segment['name'])
+            if segment.get('deleted'):
+                columns = columns[~np.isin(columns['id'], self._load_tombstones(segment))]
+            sources = self._load_sources(segment['name'])
+            for source, chunks, text_bytes, first_id, last_id in source_totals(columns):
+                name = sources[source]
+                entry = catalog.get(name) or {'chunks': 0, 'bytes': 0, 'first_id': first_id, 'last_id': last_id,
+                                              'content_hash': None, 'ingested_at': None}
+                catalog[name] = dict(entry, chunks=entry['chunks'] + chunks, bytes=entry['bytes'] + text_bytes,
+                                     first_id=min(entry['first_id'], first_id), last_id=max(entry['last_id'], last_id))
+        return catalog
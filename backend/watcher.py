@@ -0,0 +1,62 @@
+"""Debouncing of file system events from the documents folder watcher.
+
+Saving a document in an editor, or copying it into the folder, fires a burst
+of created/modified events for the same file. Instead of handling every
+event on the watchdog thread, events are recorded per path and only the
+latest one is handled, once no new event arrived for that path during
+``quiet_seconds``. Paths that settle together are handed to ``handler`` as
+one batch, on a worker thread, so the observer thread never blocks.
+"""
+import threading
+import time
+
+
+class DebouncedScheduler:
+    """Coalesces events per key and hands settled ones to ``handler`` in batches.
+
+    ``handler`` takes a list of (key, event) pairs, where event is the last
+    one scheduled for the key.
+    """
+
+    def __init__(self, handler, quiet_seconds=1.0, name='debouncer'):
+        self.handler = handler
+        self.quiet_seconds = quiet_seconds
+        self.name = name
+        self.pending = {}  # key -> (event, time the key settles)
+        self.condition = threading.Condition()
+        self.worker = None
+        self.stats = {'events': 0, 'coalesced': 0, 'handled': 0, 'batches': 0}
+
+    def schedule(self, key, event):
+        """Record an event for a key, replacing the one still waiting for it."""
+        with self.condition:
+            self.stats['events'] += 1
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            self.pending[key] = (event, time.monotonic() + self.quiet_seconds)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.worker.start()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    due = [key for key, (_, settles_at) in self.pending.items() if settles_at <= now]
+                    if due:
+                        break
+                    next_due = min((settles_at for _, settles_at in self.pending.values()), default=None)
+                    self.condition.wait(None if next_due is None else next_due - now)
+                batch = [(key, self.pending.pop(key)[0]) for key in due]
+                self.stats['handled'] += len(batch)
+                self.stats['batches'] += 1
+            try:
+                self.handler(batch)
+            except Exception as e:
+                print(f"Error handling {self.name} events: {e}")
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, pending=len(self.pending))
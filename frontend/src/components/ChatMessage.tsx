@@ -35,10 +35,14 @@ const ChatMessage = ({ message, contexts, showContexts = false }: Props) => {
             <div className="mt-2 space-y-2 max-h-40 overflow-y-auto">
               {contexts.map((context, idx) => (
                 <div key={idx} className="p-2 bg-white rounded border border-gray-200">
-                  <div className="font-medium">{context.source}</div>
-                  <div className="text-gray-500 text-xs">
-                    Relevance: {(Math.abs((1 - context.similarity)) * 100).toFixed(1)}%
+                  <div className="font-medium">
+                    {context.source}{context.page ? `, page ${context.page}` : ""}
                   </div>
+                  {context.similarity !== null && (
+                    <div className="text-gray-500 text-xs">
+                      Relevance: {(Math.abs((1 - context.similarity)) * 100).toFixed(1)}%
+                    </div>
+                  )}
                 </div>
               ))}
             </div>
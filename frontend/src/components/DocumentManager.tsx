@@ -1,20 +1,21 @@
 import { useState, useEffect } from "react";
-import { Document } from "../types";
+import { DocumentsResponse } from "../types";
 
 interface DocumentManagerProps {
   refreshTrigger: number;
 }
 
-interface DocumentsResponse {
-  indexed_documents: string[];
-  folder_documents: Document[];
-}
+// Documents shown per page of the list
+const PAGE_SIZE = 100;
 
 const DocumentManager = ({ refreshTrigger }: DocumentManagerProps) => {
-  const [documents, setDocuments] = useState<DocumentsResponse>({
-    indexed_documents: [],
+  const [documents, setDocuments] = useState<
+    Pick<DocumentsResponse, "folder_documents" | "folder_total">
+  >({
     folder_documents: [],
+    folder_total: 0,
   });
+  const [offset, setOffset] = useState(0);
   const [isLoading, setIsLoading] = useState(false);
   const [reindexing, setReindexing] = useState(false);
   const [message, setMessage] = useState("");
@@ -22,11 +23,18 @@ const DocumentManager = ({ refreshTrigger }: DocumentManagerProps) => {
   const loadDocuments = async () => {
     setIsLoading(true);
     try {
-      const response = await fetch("http://127.0.0.1:5001/api/list-documents");
+      const response = await fetch(
+        `http://127.0.0.1:5001/api/list-documents?offset=${offset}&limit=${PAGE_SIZE}`
+      );
       if (!response.ok) {
         throw new Error("Failed to fetch documents");
       }
-      const data = await response.json();
+      const data: DocumentsResponse = await response.json();
+      if (offset > 0 && data.folder_documents.length === 0) {
+        // The page no longer exists, e.g. after documents were removed
+        setOffset(Math.max(0, Math.floor((data.folder_total - 1) / PAGE_SIZE) * PAGE_SIZE));
+        return;
+      }
       setDocuments(data);
     } catch (error) {
       console.error("Error loading documents:", error);
@@ -61,10 +69,12 @@ const DocumentManager = ({ refreshTrigger }: DocumentManagerProps) => {
     }
   };
 
-  // Load documents when component mounts or refreshTrigger changes
+  // Load documents when component mounts, refreshTrigger changes or another page is selected
   useEffect(() => {
     loadDocuments();
-  }, [refreshTrigger]);
+  }, [refreshTrigger, offset]);
+
+  const pageEnd = offset + documents.folder_documents.length;
 
   return (
     <div className="mb-8 p-6 border border-gray-200 rounded-2xl shadow-xl bg-white dark:bg-gray-800 transition-all duration-300">
@@ -264,6 +274,31 @@ const DocumentManager = ({ refreshTrigger }: DocumentManagerProps) => {
                 </div>
               )}
             </div>
+            {documents.folder_total > PAGE_SIZE && (
+              <div className="mt-3 flex items-center justify-between text-sm text-gray-600 dark:text-gray-300">
+                <span>
+                  {offset + 1}–{pageEnd} of {documents.folder_total} documents
+                </span>
+                <div className="flex gap-2">
+                  <button
+                    onClick={() => setOffset(Math.max(0, offset - PAGE_SIZE))}
+                    disabled={offset === 0}
+                    className="px-3 py-1 rounded-lg border border-gray-200 dark:border-gray-600 hover:bg-gray-100 dark:hover:bg-gray-600
+                      disabled:opacity-50 disabled:cursor-not-allowed transition duration-150 ease-in-out"
+                  >
+                    Previous
+                  </button>
+                  <button
+                    onClick={() => setOffset(offset + PAGE_SIZE)}
+                    disabled={pageEnd >= documents.folder_total}
+                    className="px-3 py-1 rounded-lg border border-gray-200 dark:border-gray-600 hover:bg-gray-100 dark:hover:bg-gray-600
+                      disabled:opacity-50 disabled:cursor-not-allowed transition duration-150 ease-in-out"
+                  >
+                    Next
+                  </button>
+                </div>
+              </div>
+            )}
           </div>
         </div>
       )}
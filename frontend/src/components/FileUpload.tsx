@@ -46,8 +46,35 @@ const FileUpload = ({ onUploadSuccess }: FileUploadProps) => {
         throw new Error(data.error || "Upload failed");
       }
 
+      // The backend indexes the file in the background: poll the job until it finishes
+      let job = data;
+      while (job.status === "queued" || job.status === "running") {
+        // Large documents are streamed page by page, so progress is counted in pages when known
+        const progress = job.pages_total
+          ? `page ${job.pages_processed}/${job.pages_total}, ${job.chunks_processed} chunks`
+          : `${job.chunks_processed}/${job.chunks_total ?? "?"} chunks`;
+        setMessage(
+          job.status === "queued"
+            ? `${file.name} queued for processing...`
+            : `${file.name}: ${job.stage} (${progress})`
+        );
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobResponse = await fetch(`http://127.0.0.1:5001/api/jobs/${data.job_id}`);
+        job = await jobResponse.json();
+        if (!jobResponse.ok) {
+          throw new Error(job.error || "Could not get upload status");
+        }
+      }
+      if (job.status === "failed") {
+        throw new Error(job.error || "Processing failed");
+      }
+
       // Success
-      setMessage(`${file.name} processed with ${data.chunks} chunks stored`);
+      setMessage(
+        data.duplicate
+          ? `${file.name} was already processed`
+          : `${file.name} processed with ${job.result?.chunks_stored ?? 0} chunks stored`
+      );
       
       // Notify parent component about successful upload
       if (onUploadSuccess) {
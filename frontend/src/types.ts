@@ -24,12 +24,42 @@ export interface Context {
   content: string;
   source: string;
   chunk_id: string;
-  similarity: number;
+  // Position of the chunk in its document
+  chunk?: number | null;
+  page?: number | null;
+  // L2 distance to the query; null when it could not be computed
+  similarity: number | null;
+  // Retrievers that found the chunk: "dense" and/or "lexical"
+  matched_by?: string[];
+  // Cross-encoder relevance, when the chunk was re-ranked
+  rerank_score?: number;
+  // Collection the chunk comes from, when the request named collections
+  collection?: string;
+}
+
+// Catalog entry of an indexed document
+export interface IndexedDocument {
+  filename: string;
+  chunks: number;
+  // Bytes of chunk text
+  bytes: number;
+  first_id: number;
+  last_id: number;
+  content_hash: string | null;
+  // Unix time of the last ingestion, null for documents indexed before the catalog existed
+  ingested_at: number | null;
 }
 
 export interface DocumentsResponse {
+  collection: string;
+  documents: IndexedDocument[];
   indexed_documents: string[];
   folder_documents: Document[];
+  total: number;
+  folder_total: number;
+  offset: number;
+  limit: number;
+  next_offset: number | null;
 }
 
 export interface UploadSuccessCallback {